@@ -2,6 +2,7 @@ from flask import Flask
 from celery import Celery, Task
 import flask_cors
 from app import config
+from app.lib.responses import FastJSONProvider, compress_response
 from app.models.media_items_repository import MediaItemsRepository
 
 
@@ -9,6 +10,8 @@ from app.models.media_items_repository import MediaItemsRepository
 def create_flask_app() -> Flask:
     flask_app = Flask(config.APP_NAME)
     flask_app.config.from_prefixed_env()
+    flask_app.json = FastJSONProvider(flask_app)
+    flask_app.after_request(compress_response)
     # Only set up CORS origins if CLIENT_HOST is configured (tests may not set this)
     if getattr(config, "CLIENT_HOST", None):
         flask_cors.CORS(flask_app, origins=[config.CLIENT_HOST])
@@ -37,11 +40,32 @@ def celery_init_app(flask_app: Flask) -> Celery:
         result_backend=f"redis://{config.REDIS_HOST}",
     )
 
+    celery_app.conf.task_routes = celery_task_routes()
+
     celery_app.set_default()
     flask_app.extensions["celery"] = celery_app
 
     return celery_app
 
 
+def celery_task_routes() -> dict:
+    """
+    @return queue of each task, by task name
+    """
+    io_tasks = ["store_images", "download_chunk"]
+    cpu_tasks = [
+        "process_duplicates",
+        "detect_duplicates",
+        "embed_chunk",
+        "compare_chunks",
+    ]
+    routes = {}
+    for name in io_tasks:
+        routes[f"app.tasks.{name}"] = {"queue": config.CELERY_IO_QUEUE}
+    for name in cpu_tasks:
+        routes[f"app.tasks.{name}"] = {"queue": config.CELERY_CPU_QUEUE}
+    return routes
+
+
 FLASK_APP = create_flask_app()
 CELERY_APP = FLASK_APP.extensions["celery"]
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of rendering a large task results response: JSON encoding
+with Flask's default provider vs FastJSONProvider, and the bytes sent with
+each compression and similarity format.
+
+    python -m app.benchmarks.task_results_response [--groups 10000]
+"""
+import argparse
+import gzip
+import random
+import time
+import flask
+from flask.json.provider import DefaultJSONProvider
+from app.lib import responses
+from app.lib.responses import FastJSONProvider
+from app.lib.similarity_edges import SimilarityEdges
+
+
+def media_item_id(rng: random.Random) -> str:
+    # Google media item ids are ~100 url-safe characters
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+    return "AE-" + "".join(rng.choices(alphabet, k=97))
+
+
+def task_results(num_groups: int, seed: int = 0) -> dict:
+    """
+    @return results as rendered by get_active_task_results, with groups of
+    2-4 similar media items
+    """
+    rng = random.Random(seed)
+    groups, media_items, similarity_map = {}, {}, {}
+
+    for group_index in range(num_groups):
+        ids = [media_item_id(rng) for _ in range(rng.choice([2, 2, 2, 3, 4]))]
+        groups[str(group_index)] = {
+            "id": str(group_index),
+            "mediaItemIds": ids,
+            "originalMediaItemId": ids[0],
+            "size": len(ids),
+            "reclaimableBytes": rng.randrange(1_000_000, 5_000_000),
+        }
+        for id in ids:
+            media_items[id] = {
+                "id": id,
+                "productUrl": f"https://photos.google.com/lr/photo/{id}",
+                "filename": f"PXL_2023{rng.randrange(10**10):010d}.jpg",
+                "mimeType": "image/jpeg",
+                "deletedAt": None,
+                "userUrl": None,
+                "imageUrl": f"/api/images/{id}-250.jpg",
+                "dimensions": "4032 x 3024",
+            }
+            similarity_map[id] = {
+                other: round(rng.uniform(0.99, 1.0), 6) for other in ids if other != id
+            }
+
+    return {"groups": groups, "mediaItems": media_items, "similarityMap": similarity_map}
+
+
+def best_time(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--groups", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = task_results(args.groups)
+    similarity_edges = SimilarityEdges.from_similarity_map(results["similarityMap"])
+    edges_results = {k: v for k, v in results.items() if k != "similarityMap"}
+    edges_results["similarityEdges"] = similarity_edges.to_json()
+
+    app = flask.Flask(__name__)
+    providers = {"default": DefaultJSONProvider(app), "fast": FastJSONProvider(app)}
+    fast_encoder = "orjson" if responses.orjson is not None else "stdlib fallback"
+    print(f"{args.groups:,} groups, {len(results['mediaItems']):,} media items")
+    print(f"FastJSONProvider is using {fast_encoder}\n")
+
+    with app.app_context():
+        for format, value in (("map", results), ("edges", edges_results)):
+            for name, provider in providers.items():
+                seconds = best_time(lambda: provider.response(value), args.repeat)
+                print(f"format={format:<5} {name:<7} encode: {seconds * 1000:8.1f} ms")
+
+            body = providers["fast"].response(value).get_data()
+            sizes = {"identity": len(body), "gzip": len(gzip.compress(body, 6))}
+            if responses.brotli is not None:
+                sizes["br"] = len(responses.brotli.compress(body, quality=5))
+            print(
+                f"format={format:<5} bytes:  "
+                + ", ".join(f"{k} {v / 1e6:.2f} MB" for k, v in sizes.items())
+                + "\n"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Benchmark of chunked detection throughput with every task on one queue vs the
+io and cpu queues, each consumed by workers started with its profile.
+
+Runs real download_chunk | embed_chunk chains, as process_duplicates fans
+them out, through Celery workers started with the task routes and profiles
+the app ships, downloading from a local image server that answers each
+request after a simulated network latency. With one queue, a process per core
+downloading a chunk leaves its core idle. With the io and cpu queues, threads
+download chunks while a process per core embeds the chunks already
+downloaded.
+
+Uses the Mongo and Redis configured for the app (e.g. `docker-compose up
+mongo redis`). Media items are seeded for a benchmark user and deleted
+afterwards.
+
+    python -m app.benchmarks.worker_queues [--chunks 16] [--chunk-size 50]
+"""
+import argparse
+import datetime
+import http.server
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+import celery
+import numpy as np
+from app import CELERY_APP as celery_app
+from app import config
+from app import tasks
+from app.models.media_items_repository import MediaItemsRepository
+
+USER_ID = "benchmark-worker-queues"
+
+# Pins BLAS to one thread per process, like the cpu worker profile
+SINGLE_THREADED_BLAS = {
+    "OMP_NUM_THREADS": "1",
+    "OPENBLAS_NUM_THREADS": "1",
+    "MKL_NUM_THREADS": "1",
+}
+
+
+def worker_profiles(args) -> dict:
+    """
+    @return the (name, worker arguments, environment) of each worker to start,
+    by setup. The io and cpu profiles match the prod-worker-io and
+    prod-worker-cpu targets of app/Dockerfile. The single queue worker has as
+    many processes as the cpu one, so the setups only differ in their queues.
+    """
+    return {
+        "single queue": [
+            (
+                "all",
+                [
+                    "-Q",
+                    f"celery,{config.CELERY_IO_QUEUE},{config.CELERY_CPU_QUEUE}",
+                    "--concurrency",
+                    str(args.cpu_workers),
+                ],
+                SINGLE_THREADED_BLAS,
+            ),
+        ],
+        "io + cpu queues": [
+            (
+                "io",
+                [
+                    "-Q",
+                    config.CELERY_IO_QUEUE,
+                    "--pool",
+                    "threads",
+                    "--concurrency",
+                    str(args.io_workers),
+                ],
+                {},
+            ),
+            (
+                "cpu",
+                [
+                    "-Q",
+                    f"{config.CELERY_CPU_QUEUE},celery",
+                    "--concurrency",
+                    str(args.cpu_workers),
+                ],
+                SINGLE_THREADED_BLAS,
+            ),
+        ],
+    }
+
+
+class ImageServer(http.server.ThreadingHTTPServer):
+    """
+    Serves a JPEG for any media item's baseUrl, after `latency` seconds.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, images: list[bytes], latency: float):
+        super().__init__(("127.0.0.1", 0), ImageRequestHandler)
+        self.images = images
+        self.latency = latency
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address
+        return f"http://{host}:{port}"
+
+
+class ImageRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        # The same media item always gets the same image, whatever its size
+        media_item_id = self.path.split("=")[0]
+        image = self.server.images[zlib.crc32(media_item_id.encode()) % len(self.server.images)]
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(image)))
+        self.end_headers()
+        self.wfile.write(image)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def random_images(count: int, resolution: int) -> list[bytes]:
+    """
+    @return JPEGs of random noise, so each embeds differently
+    """
+    # Installed with mediapipe
+    import cv2
+
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, (resolution, resolution, 3), dtype=np.uint8)
+        _, image = cv2.imencode(".jpg", pixels)
+        images.append(image.tobytes())
+    return images
+
+
+def seed_media_items(repo: MediaItemsRepository, count: int, base_url: str) -> list[str]:
+    """
+    @return ids of the media items created, with baseUrls on the image server
+    """
+    now = datetime.datetime.now().astimezone()
+    ids = [f"benchmark-{i:06d}" for i in range(count)]
+    repo.bulk_create_or_update(
+        {
+            "id": id,
+            "baseUrl": f"{base_url}/{id}",
+            # Fresh, so nothing asks Google to refresh them
+            "baseUrlFetchedAt": now,
+            "fetchedAt": now,
+            "syncPosition": position,
+            "mimeType": "image/jpeg",
+            "filename": f"{id}.jpg",
+            "mediaMetadata": {"width": "4032", "height": "3024"},
+            "deletedAt": None,
+        }
+        for position, id in enumerate(ids)
+    )
+    return ids
+
+
+def start_workers(profiles: list, checkpoint_path: str) -> list[tuple[str, subprocess.Popen]]:
+    """
+    @return (hostname, process) of each worker started
+    """
+    workers = []
+    for name, worker_args, env in profiles:
+        hostname = f"benchmark-{name}@{socket.gethostname()}"
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "celery",
+                "--app",
+                "app.tasks",
+                "worker",
+                *worker_args,
+                "--hostname",
+                hostname,
+                "--loglevel",
+                "WARNING",
+                "--without-gossip",
+                "--without-mingle",
+                "--without-heartbeat",
+            ],
+            # Every worker shares the checkpoint, as in production
+            env=os.environ | env | {"CHECKPOINT_PATH": checkpoint_path},
+        )
+        workers.append((hostname, process))
+    return workers
+
+
+def wait_ready(workers: list[tuple[str, subprocess.Popen]], timeout: float) -> None:
+    hostnames = [hostname for hostname, _ in workers]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for hostname, process in workers:
+            if process.poll() is not None:
+                raise RuntimeError(f"Worker {hostname} exited with {process.returncode}")
+        replies = celery_app.control.ping(destination=hostnames, timeout=1)
+        if len(replies) == len(hostnames):
+            return
+    raise TimeoutError(f"Workers not ready after {timeout}s: {hostnames}")
+
+
+def stop_workers(workers: list[tuple[str, subprocess.Popen]]) -> None:
+    for _, process in workers:
+        # Warm shutdown
+        process.terminate()
+    for _, process in workers:
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run_chunks(chunks: list[tuple[int, list[str]]], total_chunks: int, args) -> float:
+    """
+    Download and embed chunks in download_chunk | embed_chunk chains.
+
+    @return seconds until every chunk was embedded
+    """
+    options = {"resolution": args.resolution, "chunk_size": args.chunk_size}
+    workflow = celery.group(
+        tasks.download_chunk.s(USER_ID, chunk_index, chunk_ids, total_chunks, **options)
+        | tasks.embed_chunk.s(USER_ID, chunk_index, chunk_ids, total_chunks, **options)
+        for chunk_index, chunk_ids in chunks
+    )
+
+    start = time.perf_counter()
+    statuses = workflow.apply_async().get(timeout=args.timeout)
+    seconds = time.perf_counter() - start
+
+    errors = [status for status in statuses if "error" in status]
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {len(statuses)} chunks failed: {errors[0]}")
+    embedded = sum(status["embedded"] for status in statuses)
+    expected = sum(len(chunk_ids) for _, chunk_ids in chunks)
+    if embedded != expected:
+        raise RuntimeError(f"Embedded {embedded} of {expected} media items")
+    return seconds
+
+
+def benchmark(profiles: list, media_item_ids: list[str], args) -> float:
+    """
+    @return seconds to download and embed args.chunks chunks on workers
+    started with profiles, after warming them up
+    """
+    chunk_ids = [
+        media_item_ids[start:start + args.chunk_size]
+        for start in range(0, len(media_item_ids), args.chunk_size)
+    ]
+    chunks = list(enumerate(chunk_ids))
+    # Warm up chunks come after the timed ones, so they don't share a
+    #   checkpoint with them
+    timed_chunks, warm_up_chunks = chunks[:args.chunks], chunks[args.chunks:]
+
+    # A fresh checkpoint for each setup, so every chunk is downloaded
+    with tempfile.TemporaryDirectory() as checkpoint_path:
+        workers = start_workers(profiles, checkpoint_path)
+        try:
+            wait_ready(workers, args.timeout)
+            # Load the embedding model in the cpu worker's processes
+            run_chunks(warm_up_chunks, len(chunks), args)
+            return run_chunks(timed_chunks, len(chunks), args)
+        finally:
+            stop_workers(workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=16)
+    parser.add_argument("--chunk-size", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per download")
+    parser.add_argument("--resolution", type=int, default=250)
+    parser.add_argument("--cpu-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--io-workers", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    server = ImageServer(random_images(16, args.resolution), args.latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    repo = MediaItemsRepository(user_id=USER_ID)
+    # One warm up chunk per cpu worker process
+    num_chunks = args.chunks + args.cpu_workers
+    media_item_ids = seed_media_items(repo, num_chunks * args.chunk_size, server.url)
+    print(
+        f"{args.chunks} chunks of {args.chunk_size} images, {args.latency:.2f}s "
+        f"per download, {args.cpu_workers} CPU workers, {args.io_workers} I/O workers\n"
+    )
+
+    results = {}
+    try:
+        for name, profiles in worker_profiles(args).items():
+            results[name] = benchmark(profiles, media_item_ids, args)
+    finally:
+        repo.delete(media_item_ids)
+        server.shutdown()
+
+    for name, seconds in results.items():
+        print(f"{name:<16} {seconds:6.2f}s  {args.chunks / seconds:6.2f} chunks/s")
+    single_seconds, split_seconds = results.values()
+    print(f"\nThe io and cpu queues are {single_seconds / split_seconds:.2f}x the throughput")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,25 +10,104 @@ GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 GOOGLE_AUTH_URI = "https://accounts.google.com/o/oauth2/auth"
 GOOGLE_TOKEN_URI = "https://oauth2.googleapis.com/token"
+# Base URL of the Photos Library API, e.g. a local fake for tests
+PHOTOS_API_BASE_URL = os.environ.get(
+    "PHOTOS_API_BASE_URL", "https://photoslibrary.googleapis.com/v1"
+)
+# Photos API requests each worker process makes per second (0 for no limit),
+#   and how many mediaItems:batchGet requests it makes at once
+PHOTOS_API_REQUESTS_PER_SECOND = float(
+    os.environ.get("PHOTOS_API_REQUESTS_PER_SECOND", 10)
+)
+PHOTOS_API_BATCH_GET_CONCURRENCY = int(
+    os.environ.get("PHOTOS_API_BATCH_GET_CONCURRENCY", 8)
+)
 
 REDIS_HOST = os.environ.get("REDIS_HOST")
 
+# Refresh OAuth tokens this long before they expire, so requests (e.g. during
+#   bulk fetches) don't stall on a 401. Must exceed google-auth's own
+#   threshold (3m45s), or sessions refresh without saving the new token
+OAUTH_TOKEN_REFRESH_MARGIN_SECONDS = float(
+    os.environ.get("OAUTH_TOKEN_REFRESH_MARGIN_SECONDS", 300)
+)
+# How long one worker may hold a user's token refresh lock, which other
+#   workers wait for before reusing the token it saved
+OAUTH_TOKEN_REFRESH_LOCK_SECONDS = float(
+    os.environ.get("OAUTH_TOKEN_REFRESH_LOCK_SECONDS", 30)
+)
+
 MONGODB_URI = os.environ.get("MONGODB_URI")
 DATABASE = os.environ.get("DATABASE")
+# Connection pool settings for the shared MongoClient (see app.models.mongo_client)
+MONGODB_MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", 50))
+MONGODB_MIN_POOL_SIZE = int(os.environ.get("MONGODB_MIN_POOL_SIZE", 0))
+MONGODB_MAX_IDLE_TIME_MS = int(os.environ.get("MONGODB_MAX_IDLE_TIME_MS", 300_000))
+MEDIA_ITEMS_BULK_WRITE_BATCH_SIZE = int(
+    os.environ.get("MEDIA_ITEMS_BULK_WRITE_BATCH_SIZE", 1000)
+)
+# Documents per round trip when streaming media items for detection, and
+#   whether to decode them lazily as raw BSON (see detection_media_items)
+MEDIA_ITEMS_CURSOR_BATCH_SIZE = int(
+    os.environ.get("MEDIA_ITEMS_CURSOR_BATCH_SIZE", 2000)
+)
+MEDIA_ITEMS_RAW_BSON = os.environ.get("MEDIA_ITEMS_RAW_BSON", "0") == "1"
 
 IMAGE_STORE_PATH = os.environ.get("IMAGE_STORE_PATH", "/tmp")
 TEMP_PATH = "tmp/"
+# Progress of chunked duplicate detection runs, kept until a run completes so
+#   a restarted task can resume (see ProcessDuplicatesCheckpoint)
+CHECKPOINT_PATH = os.environ.get(
+    "CHECKPOINT_PATH", os.path.join(TEMP_PATH, "checkpoints")
+)
+# Embed the chunks of a detection run and compare chunk pairs in subtasks
+#   spread across workers, rather than all in the process_duplicates task.
+#   CHECKPOINT_PATH must be on storage shared by every worker.
+PROCESS_DUPLICATES_FAN_OUT = os.environ.get("PROCESS_DUPLICATES_FAN_OUT", "0") == "1"
 PUBLIC_IMAGE_FOLDER = os.environ.get("PUBLIC_IMAGE_FOLDER")
+# "files" stores one file per image, "pack" appends images to large pack files
+#   (served through /api/images/, so point PUBLIC_IMAGE_FOLDER there)
+IMAGE_STORE_BACKEND = os.environ.get("IMAGE_STORE_BACKEND", "files")
+IMAGE_PACK_MAX_BYTES = int(os.environ.get("IMAGE_PACK_MAX_BYTES", 1_000_000_000))
+# Persist the list of stored images so it doesn't need a directory listing
+#   (useful on network filesystems where the image store is only written by us)
+IMAGE_STORE_MANIFEST = os.environ.get("IMAGE_STORE_MANIFEST", "0") == "1"
 
 CLIENT_HOST = os.environ.get("CLIENT_HOST")
+# Credentials, API clients and user info each process caches per user, and
+#   for how long. Other processes see saved credentials within the TTL.
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 1024))
+AUTH_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_CACHE_TTL_SECONDS", 300))
+# Number of rendered task results responses each server process caches
+TASK_RESULTS_CACHE_SIZE = int(os.environ.get("TASK_RESULTS_CACHE_SIZE", 16))
+# Responses smaller than this are sent uncompressed, see compress_response
+RESPONSE_COMPRESSION_MIN_BYTES = int(
+    os.environ.get("RESPONSE_COMPRESSION_MIN_BYTES", 1024)
+)
+GZIP_COMPRESSION_LEVEL = int(os.environ.get("GZIP_COMPRESSION_LEVEL", 6))
+BROTLI_COMPRESSION_QUALITY = int(os.environ.get("BROTLI_COMPRESSION_QUALITY", 5))
 
 RESPONSE_FAILURE_RETRY_SECONDS = int(
     os.environ.get("RESPONSE_FAILURE_RETRY_SECONDS", 1)
 )
 RESPONSE_429_RETRY_SECONDS = int(os.environ.get("RESPONSE_429_RETRY_SECONDS", 30))
+# baseUrls expire about an hour after they're fetched. Older ones are
+#   refreshed in bulk before downloading images rather than failing each
+#   download.
+MEDIA_ITEM_BASE_URL_MAX_AGE_SECONDS = int(
+    os.environ.get("MEDIA_ITEM_BASE_URL_MAX_AGE_SECONDS", 50 * 60)
+)
 
-PROCESS_DUPLICATE_SUBTASK_POLL_INTERVAL = int(
-    os.environ.get("PROCESS_DUPLICATE_SUBTASK_POLL_INTERVAL", 3)
+# Most often a task's progress is written to the result backend, apart from
+#   step transitions which are always written
+PROGRESS_PUBLISH_INTERVAL_SECONDS = float(
+    os.environ.get("PROGRESS_PUBLISH_INTERVAL_SECONDS", 1.0)
 )
 
+# Queues for network-bound tasks (downloading images) and CPU-bound tasks
+#   (embedding, comparing and detection), so each can be consumed by workers
+#   suited to it. See "Worker profiles" in the README.
+CELERY_IO_QUEUE = os.environ.get("CELERY_IO_QUEUE", "io")
+CELERY_CPU_QUEUE = os.environ.get("CELERY_CPU_QUEUE", "cpu")
+
 CELERY_WORKER_LOG_PATH = os.path.join("log", "celery_worker.log")
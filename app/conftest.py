@@ -1,6 +1,7 @@
 import pytest
 
 from app import create_flask_app, FLASK_APP
+from app.lib import google_api_client
 
 
 @pytest.fixture(scope="session")
@@ -24,6 +25,51 @@ def celery_config():
     }
 
 
+@pytest.fixture(autouse=True)
+def clear_auth_caches():
+    # Process-level caches would otherwise leak mocked values between tests
+    yield
+    for cache in (
+        google_api_client.credentials_cache,
+        google_api_client.clients_cache,
+        google_api_client.user_info_cache,
+    ):
+        cache.clear()
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the few Redis commands RedisLock uses. Keys don't
+    expire.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value.encode()
+        return True
+
+    def exists(self, key):
+        return int(key in self.values)
+
+    def eval(self, script, num_keys, key, token):
+        # RELEASE_SCRIPT
+        if self.values.get(key) == token.encode():
+            del self.values[key]
+            return 1
+        return 0
+
+
+@pytest.fixture
+def fake_redis(mocker):
+    fake = FakeRedis()
+    mocker.patch("app.lib.redis_lock.get_client", return_value=fake)
+    return fake
+
+
 @pytest.fixture
 def credentials():
     return {
@@ -9,7 +9,7 @@ from tqdm import trange
 
 from typing import Optional
 
-from app.lib.media_items_image_store import MediaItemsImageStore
+from app.lib.media_items_image_store import ImageStore, MediaItemsImageStore
 from app import config
 
 # Heavy dependencies (torch, mediapipe) are imported lazily inside
@@ -30,7 +30,7 @@ class DuplicateImageDetector:
         media_items: list[dict],
         threshold: float = 0.99,
         logger=logging.getLogger(),
-        image_store: Optional[MediaItemsImageStore] = None,
+        image_store: Optional[ImageStore] = None,
     ):
         self.media_items = media_items
         self.threshold = threshold
@@ -137,12 +137,10 @@ class DuplicateImageDetector:
                     )
                 
                 for media_item in batch_items:
-                    storage_path = self._get_storage_path(media_item)
-
                     mp_image = None
                     try:
-                        mp_image = mp.Image.create_from_file(storage_path)
-                    except RuntimeError as error:
+                        mp_image = self._load_image(mp, media_item)
+                    except (RuntimeError, FileNotFoundError) as error:
                         logging.warning(
                             f"Skipping invalid image file:\n"
                             f"error: {error}\n"
@@ -361,5 +359,28 @@ class DuplicateImageDetector:
         pairs_list = sorted(pairs_list, key=lambda x: x[0], reverse=True)
         return pairs_list
 
+    def _load_image(self, mp, media_item):
+        if isinstance(self.image_store, MediaItemsImageStore):
+            return mp.Image.create_from_file(self._get_storage_path(media_item))
+
+        # Other stores (e.g. packed images) have no file per image, so decode
+        #   the image's bytes
+        try:
+            import cv2
+        except ImportError as error:
+            raise RuntimeError(
+                "opencv is required to decode packed images. Install it with `pip install opencv-contrib-python`"
+            ) from error
+
+        data = self.image_store.read_image(media_item["storageFilename"])
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise RuntimeError(f"Unable to decode {media_item['storageFilename']}")
+
+        return mp.Image(
+            image_format=mp.ImageFormat.SRGB,
+            data=cv2.cvtColor(image, cv2.COLOR_BGR2RGB),
+        )
+
     def _get_storage_path(self, media_item) -> str:
         return self.image_store.get_storage_path(media_item["storageFilename"])
@@ -1,11 +1,15 @@
 import copy
+import datetime
 import logging
 from typing import Callable
 import google.oauth2.credentials
 import google.auth.transport.requests
 import requests
 from requests.adapters import HTTPAdapter
+import redis
 from urllib3.util.retry import Retry
+from app.lib import redis_lock
+from app.lib.ttl_cache import TTLCache
 from app.models.credentials_repository import CredentialsRepository
 from app import config
 
@@ -21,16 +25,44 @@ class InsufficientScopesError(Exception):
     """Raised when an API response indicates the stored token lacks required scopes."""
 
 
+# Per user caches, so hot endpoints (e.g. /auth/me) don't read credentials,
+#   build a session or call the userinfo API on every request. Invalidated
+#   by save_credentials, see invalidate_cached_credentials.
+credentials_cache = TTLCache(config.AUTH_CACHE_SIZE, config.AUTH_CACHE_TTL_SECONDS)
+clients_cache = TTLCache(config.AUTH_CACHE_SIZE, config.AUTH_CACHE_TTL_SECONDS)
+user_info_cache = TTLCache(config.AUTH_CACHE_SIZE, config.AUTH_CACHE_TTL_SECONDS)
+
+
+def invalidate_cached_credentials(user_id: str) -> None:
+    credentials_cache.invalidate(user_id)
+    clients_cache.invalidate(user_id)
+    user_info_cache.invalidate(user_id)
+
+
 class GoogleApiClient:
     @classmethod
     def from_user_id(cls, user_id: str, *args, **kwargs):
-        credentials_repo = CredentialsRepository(user_id)
-        credentials = credentials_repo.get()
-        if not credentials:
-            raise ValueError(f"No credentials found for user_id: {user_id}")
+        credentials = credentials_cache.get(user_id)
+        if credentials is None:
+            credentials = CredentialsRepository(user_id).get()
+            if not credentials:
+                raise ValueError(f"No credentials found for user_id: {user_id}")
+            credentials_cache.set(user_id, credentials)
 
         return cls(credentials, *args, **kwargs | {"user_id": user_id})
 
+    @classmethod
+    def cached_from_user_id(cls, user_id: str):
+        """
+        Like from_user_id, but reuses a client (and its session) created for
+        the user within AUTH_CACHE_TTL_SECONDS.
+        """
+        client = clients_cache.get(user_id)
+        if type(client) is not cls:
+            client = cls.from_user_id(user_id)
+            clients_cache.set(user_id, client)
+        return client
+
     @classmethod
     def credentials_to_dict(
         cls, credentials: google.oauth2.credentials.Credentials
@@ -42,6 +74,8 @@ class GoogleApiClient:
             "token": credentials.token,
             "refresh_token": credentials.refresh_token,
             "scopes": credentials.scopes,
+            # Naive UTC, like google-auth
+            "expiry": credentials.expiry,
         }
 
     def __init__(
@@ -93,6 +127,28 @@ class GoogleApiClient:
 
         return self._refresh_credentials_if_invalid(func)
 
+    def cached_user_info(self):
+        """
+        @return user info fetched within AUTH_CACHE_TTL_SECONDS, or fetch it
+        """
+        user_info = user_info_cache.get(self.user_id) if self.user_id else None
+        if user_info is None:
+            user_info = self.get_user_info()
+            user_info_cache.set(user_info["id"], user_info)
+        return user_info
+
+    def get_fresh_token(self) -> str:
+        """
+        @return an access token that won't expire for at least
+        OAUTH_TOKEN_REFRESH_MARGIN_SECONDS, refreshing it first if needed,
+        e.g. to hand to the browser
+        """
+        expiry = self.credentials_obj.expiry
+        # Credentials saved before we stored their expiry may have expired
+        if expiry is None or self._expires_soon(expiry):
+            self._refresh_and_save_credentials(self.credentials_obj.token)
+        return self.credentials_obj.token
+
     def get_user_id(self):
         if not self.user_id:
             self.get_user_info()
@@ -122,6 +178,13 @@ class GoogleApiClient:
 
         @return return value of func()
         """
+        # Without a user_id, credentials were just granted and saving them
+        #   would fetch user info, i.e. call this again
+        if self.user_id and self._expires_soon(self.credentials_obj.expiry):
+            self.logger.info("Credentials expire soon; refreshing credentials")
+            self._refresh_and_save_credentials(self.credentials_obj.token)
+
+        token = self.credentials_obj.token
         try:
             return func()
         except requests.exceptions.HTTPError as error:
@@ -131,8 +194,7 @@ class GoogleApiClient:
             # If unauthorized, refresh and retry
             if status == 401:
                 self.logger.info("401 Unauthorized received; refreshing credentials")
-                self.refresh_credentials()
-                self.save_credentials()
+                self._refresh_and_save_credentials(token)
                 return func()
 
             # For other HTTP errors (like 403), log details for debugging
@@ -185,11 +247,84 @@ class GoogleApiClient:
 
             raise error
 
+    def _expires_soon(self, expiry: datetime.datetime = None) -> bool:
+        if expiry is None:
+            return False
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        margin = datetime.timedelta(seconds=config.OAUTH_TOKEN_REFRESH_MARGIN_SECONDS)
+        return expiry - margin <= now
+
+    def _refresh_and_save_credentials(self, stale_token: str):
+        """
+        Replace `stale_token` with a new token, refreshing it at most once
+        across workers: whoever holds the user's refresh lock refreshes and
+        saves it, while the others wait and then reuse the saved token.
+
+        Refreshes without the lock when Redis isn't available.
+        """
+        if self.credentials_obj.token != stale_token and not self._expires_soon(
+            self.credentials_obj.expiry
+        ):
+            # Another thread sharing this client already refreshed it
+            return
+
+        client = redis_lock.get_client() if self.user_id else None
+        lock = None
+        if client is not None:
+            lock = redis_lock.RedisLock(
+                client,
+                f"oauth_token_refresh:{self.user_id}",
+                config.OAUTH_TOKEN_REFRESH_LOCK_SECONDS,
+            )
+            try:
+                if not lock.acquire():
+                    lock.wait_released(
+                        timeout=config.OAUTH_TOKEN_REFRESH_LOCK_SECONDS,
+                        poll_interval=0.1,
+                    )
+                    lock = None
+            except redis.RedisError as error:
+                self.logger.warning(f"Refreshing credentials without lock: {error}")
+                lock = None
+
+        try:
+            if client is not None and self._use_saved_credentials(stale_token):
+                self.logger.info("Reusing credentials refreshed by another worker")
+                return
+            self.refresh_credentials()
+            self.save_credentials()
+        finally:
+            if lock is not None:
+                try:
+                    lock.release()
+                except redis.RedisError as error:
+                    self.logger.warning(f"Failed to release refresh lock: {error}")
+
+    def _use_saved_credentials(self, stale_token: str) -> bool:
+        """
+        Use the saved credentials if they've been refreshed since `stale_token`.
+
+        @return whether they were used
+        """
+        saved = CredentialsRepository(self.user_id).get()
+        if (
+            not saved
+            or saved["token"] == stale_token
+            or self._expires_soon(saved.get("expiry"))
+        ):
+            return False
+
+        self.credentials_obj.token = saved["token"]
+        self.credentials_obj.expiry = saved.get("expiry")
+        invalidate_cached_credentials(self.user_id)
+        return True
+
     def save_credentials(self):
         credentials_as_dict = self.credentials_as_dict()
         if not self.credentials_repo:
             self.credentials_repo = CredentialsRepository(self.get_user_id())
         self.credentials_repo.set(credentials_as_dict)
+        invalidate_cached_credentials(self.get_user_id())
 
     def __configure_requests_session(self, session):
         # Automatically raise errors
@@ -1,10 +1,105 @@
 import datetime
+import logging
 import time
-from typing import Callable
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
 
+import requests
+from app import config
 from app.lib.google_api_client import GoogleApiClient
+from app.lib.rate_limiter import RateLimiter
 from app.models.media_items_repository import MediaItemsRepository
 
+# Shared by every client in the process, so concurrent requests (e.g.
+#   batchGet chunks, or store_images tasks in a threads pool) stay within the
+#   Photos API quota together
+photos_api_rate_limiter = RateLimiter(
+    config.PHOTOS_API_REQUESTS_PER_SECOND,
+    burst=config.PHOTOS_API_BATCH_GET_CONCURRENCY,
+)
+
+
+def base_url_expired(media_item: dict, now: datetime.datetime) -> bool:
+    """
+    @return whether the media item's baseUrl was fetched from the Photos API
+    more than MEDIA_ITEM_BASE_URL_MAX_AGE_SECONDS before `now`, which must be
+    timezone aware
+    """
+    # Media items from clients (e.g. the Chrome extension) weren't fetched
+    #   from the Photos API, so batchGet can't refresh them either
+    fetched_at = media_item.get("fetchedAt")
+    if fetched_at is None or any(
+        media_item.get(f) for f in MediaItemsRepository.source_fields
+    ):
+        return False
+
+    fetched_at = max(fetched_at, media_item.get("baseUrlFetchedAt") or fetched_at)
+    if fetched_at.tzinfo is None:
+        # MongoDB returns naive UTC datetimes
+        fetched_at = fetched_at.replace(tzinfo=datetime.timezone.utc)
+    max_age = datetime.timedelta(seconds=config.MEDIA_ITEM_BASE_URL_MAX_AGE_SECONDS)
+    return now - fetched_at > max_age
+
+
+def refresh_expired_base_urls(
+    user_id: str, media_items: list[dict], logger: logging.Logger = logging
+) -> int:
+    """
+    Refresh the expired baseUrls of media items about to be downloaded,
+    without creating a client when none have expired.
+
+    @return number of media items refreshed
+    """
+    now = datetime.datetime.now().astimezone()
+    expired = [m for m in media_items if base_url_expired(m, now)]
+    if not expired:
+        return 0
+
+    client = GooglePhotosClient.from_user_id(user_id, logger=logger)
+    return client.refresh_base_urls(expired)
+
+
+
+def fetch_original_sizes(
+    user_id: str, media_items: list[dict], logger: logging.Logger = logging
+) -> dict[str, int]:
+    """
+    Look up the size in bytes of each media item's original, which the Photos
+    API doesn't return with its metadata, from the Content-Length of its full
+    resolution (`=d`) download. Only the headers are requested.
+
+    @return size of each media item whose original's size was found, by id
+    """
+    refresh_expired_base_urls(user_id, media_items, logger)
+
+    def original_size(media_item: dict) -> Optional[int]:
+        try:
+            response = requests.head(
+                f"{media_item['baseUrl']}=d", timeout=5, allow_redirects=True
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException as error:
+            logger.warning(
+                "Failed to get the original size of media_item %s: %s",
+                media_item["id"],
+                error,
+            )
+            return None
+        length = response.headers.get("Content-Length")
+        return int(length) if length else None
+
+    if not media_items:
+        return {}
+    with ThreadPoolExecutor(
+        max_workers=min(config.PHOTOS_API_BATCH_GET_CONCURRENCY, len(media_items))
+    ) as executor:
+        sizes = executor.map(original_size, media_items)
+        return {
+            media_item["id"]: size
+            for media_item, size in zip(media_items, sizes)
+            if size is not None
+        }
 
 class GooglePhotosClient(GoogleApiClient):
     def __init__(
@@ -20,7 +115,11 @@ class GooglePhotosClient(GoogleApiClient):
     def local_media_items_count(self):
         return self.repo.count()
 
-    def fetch_media_items(self, callback: Callable[[dict], None] = None):
+    def fetch_media_items(
+        self,
+        callback: Callable[[dict], None] = None,
+        batch_size: Optional[int] = None,
+    ):
         next_page_token = None
         item_count = 0
         # The Photos API caps pageSize at 100; request only the fields we need to
@@ -29,12 +128,28 @@ class GooglePhotosClient(GoogleApiClient):
             "pageSize": 100,
             "fields": "mediaItems(id,baseUrl,filename,mediaMetadata,mimeType),nextPageToken",
         }
+        batch_size = batch_size or config.MEDIA_ITEMS_BULK_WRITE_BATCH_SIZE
 
         self.logger.info("Fetching mediaItems...")
         last_log_time = time.time()
-        # Keep track of every ID we've seen so we can clear out any media
-        #   items that no longer exist at the end of the fetch
-        all_ids = set()
+        # Every media item fetched is marked as seen in this sync, so we can
+        #   clear out any media items that no longer exist at the end
+        sync_generation = uuid.uuid4().hex
+        num_written = 0
+        # Media items waiting to be written in one bulk write
+        pending_media_items = []
+
+        def flush_pending_media_items():
+            nonlocal num_written
+            num_written += self.repo.sync_media_items(
+                pending_media_items, sync_generation, batch_size=batch_size
+            )
+            # Only hand items to the callback once they're stored, since it may
+            #   start subtasks that read them back
+            if callback:
+                for media_item_json in pending_media_items:
+                    callback(media_item_json)
+            pending_media_items.clear()
 
         while True:
             if next_page_token:
@@ -46,8 +161,9 @@ class GooglePhotosClient(GoogleApiClient):
             )
 
             def func():
+                photos_api_rate_limiter.acquire()
                 return self.session.get(
-                    "https://photoslibrary.googleapis.com/v1/mediaItems",
+                    f"{config.PHOTOS_API_BASE_URL}/mediaItems",
                     params=request_data,
                 ).json()
 
@@ -60,11 +176,13 @@ class GooglePhotosClient(GoogleApiClient):
                     # local copy as soon as we get the URLs so we don't have to
                     # refresh them later for long-running tasks.
 
-                    all_ids.add(media_item_json["id"])
-                    self.repo.create_or_update(
+                    fetched_at = datetime.datetime.now().astimezone()
+                    pending_media_items.append(
                         media_item_json
                         | {
-                            "fetchedAt": datetime.datetime.now().astimezone(),
+                            "fetchedAt": fetched_at,
+                            "baseUrlFetchedAt": fetched_at,
+                            "syncPosition": item_count,
                             "deletedAt": None,
                         }
                     )
@@ -75,23 +193,25 @@ class GooglePhotosClient(GoogleApiClient):
                         self.logger.info(f"Fetched {item_count:,} mediaItems so far")
                         last_log_time = time.time()
 
-                    if callback:
-                        callback(media_item_json)
+                if len(pending_media_items) >= batch_size:
+                    flush_pending_media_items()
 
             next_page_token = resp_json.get("nextPageToken", None)
             if not next_page_token:
                 break
 
-        repo_ids = self.repo.all_ids()
-        ids_to_delete = repo_ids - all_ids
-        count_ids_to_delete = len(ids_to_delete)
-        if count_ids_to_delete > 0:
+        flush_pending_media_items()
+
+        num_deleted = self.repo.delete_unsynced(sync_generation)
+        if num_deleted > 0:
             self.logger.info(
-                f"Deleting {count_ids_to_delete} local mediaItems not found during fetch"
+                f"Deleted {num_deleted} local mediaItems not found during fetch"
             )
-            self.repo.delete(ids_to_delete)
 
-        self.logger.info(f"Done fetching mediaItems, {item_count:,} total")
+        self.logger.info(
+            f"Done fetching mediaItems, {item_count:,} total, "
+            f"{item_count - num_written:,} unchanged"
+        )
 
     def _chunked(self, iterable, n):
         """Yield successive n-sized chunks from iterable."""
@@ -106,31 +226,66 @@ class GooglePhotosClient(GoogleApiClient):
 
     def get_media_items_by_ids(self, ids: list[str]) -> dict:
         """
-        Fetch media items by their IDs using the batchGet endpoint.
+        Fetch media items by their IDs using the batchGet endpoint, requesting
+        chunks of them concurrently within the shared rate limit.
         Returns dict mapping mediaItemId -> mediaItem dict.
         """
         results: dict = {}
-        # Use a conservative chunk size (50)
-        for chunk in self._chunked(ids, 50):
-            body = {"mediaItemIds": chunk}
+        # batchGet accepts at most 50 ids
+        chunks = list(self._chunked(ids, 50))
+        if not chunks:
+            return results
 
-            def func():
-                return self.session.post(
-                    "https://photoslibrary.googleapis.com/v1/mediaItems:batchGet",
-                    json=body,
-                ).json()
+        with ThreadPoolExecutor(
+            max_workers=min(config.PHOTOS_API_BATCH_GET_CONCURRENCY, len(chunks))
+        ) as executor:
+            for resp_json in executor.map(self._batch_get_media_items, chunks):
+                for entry in resp_json.get("mediaItemResults", []):
+                    media_item = entry.get("mediaItem")
+                    if media_item:
+                        results[media_item["id"]] = media_item
+                    else:
+                        status = entry.get("status")
+                        self.logger.warning("batchGet returned no mediaItem for entry: %s", status)
 
-            resp_json = self._refresh_credentials_if_invalid(func)
+        return results
 
-            for entry in resp_json.get("mediaItemResults", []):
-                media_item = entry.get("mediaItem")
-                if media_item:
-                    results[media_item["id"]] = media_item
-                else:
-                    status = entry.get("status")
-                    self.logger.warning("batchGet returned no mediaItem for entry: %s", status)
+    def refresh_base_urls(self, media_items: list[dict]) -> int:
+        """
+        Fetch new baseUrls for media items with batchGet, updating them in
+        place and in the repository. Media items batchGet doesn't return keep
+        their baseUrl.
 
-        return results
+        @return number of media items refreshed
+        """
+        fetched_map = self.get_media_items_by_ids([m["id"] for m in media_items])
+        fetched_at = datetime.datetime.now().astimezone()
+
+        updates = []
+        for media_item in media_items:
+            fetched = fetched_map.get(media_item["id"])
+            if fetched is None:
+                continue
+            attributes = {"baseUrl": fetched["baseUrl"], "baseUrlFetchedAt": fetched_at}
+            media_item |= attributes
+            updates.append((media_item["id"], attributes))
+
+        if updates:
+            self.repo.bulk_update(updates)
+        self.logger.info(
+            f"Refreshed expired baseUrls of {len(updates)} of {len(media_items)} media items"
+        )
+        return len(updates)
+
+    def _batch_get_media_items(self, ids: list[str]) -> dict:
+        def func():
+            photos_api_rate_limiter.acquire()
+            return self.session.post(
+                f"{config.PHOTOS_API_BASE_URL}/mediaItems:batchGet",
+                json={"mediaItemIds": ids},
+            ).json()
+
+        return self._refresh_credentials_if_invalid(func)
 
     def get_local_media_items(self):
         return self.repo.all()
@@ -0,0 +1,64 @@
+import os
+import threading
+from typing import Optional
+import app.config
+from app.lib.media_items_image_store import ImageStore, MediaItemsImageStore
+from app.lib.packed_media_items_image_store import PackedMediaItemsImageStore
+
+_lock = threading.Lock()
+# Stores shared by every task in this process, by backend and options
+_stores: dict[tuple, ImageStore] = {}
+_pid = os.getpid()
+
+
+def create_image_store(use_manifest: Optional[bool] = None, **kwargs) -> ImageStore:
+    """
+    @return an image store of the configured IMAGE_STORE_BACKEND
+
+    Stores are shared by every task in the process that stores images in the
+    same path, so each subtask reuses the index of stored images instead of
+    listing the whole directory or reading the whole pack index again.
+
+    @param use_manifest only applies to the files backend, see
+        MediaItemsImageStore
+    """
+    global _pid
+    if os.getpid() != _pid:
+        # Forked, e.g. a prefork worker process. Don't share the parent's.
+        with _lock:
+            _stores.clear()
+            _pid = os.getpid()
+
+    backend = app.config.IMAGE_STORE_BACKEND
+    key = _store_key(backend, use_manifest, kwargs)
+    with _lock:
+        store = _stores.get(key)
+        if store is None or not store.is_valid():
+            if backend == "pack":
+                store = PackedMediaItemsImageStore(**kwargs)
+            else:
+                store = MediaItemsImageStore(use_manifest=use_manifest, **kwargs)
+            _stores[key] = store
+        return store
+
+
+def clear() -> None:
+    """
+    Forget every shared store, e.g. between tests.
+    """
+    with _lock:
+        _stores.clear()
+
+
+def _store_key(backend: str, use_manifest: Optional[bool], kwargs: dict) -> tuple:
+    if backend == "pack":
+        # Packed stores don't use manifests
+        use_manifest = None
+    base_path = kwargs.get("base_path") or app.config.IMAGE_STORE_PATH
+    options = {k: v for k, v in kwargs.items() if k != "base_path"}
+    return (
+        backend,
+        os.path.abspath(os.path.expanduser(base_path)),
+        use_manifest,
+        tuple(sorted(options.items())),
+    )
@@ -1,18 +1,24 @@
 import logging
 import os
+import threading
 import time
+from abc import ABC, abstractmethod
 import app.config
 from typing import Optional
 import requests
 
 
-class MediaItemsImageStore:
-    """Stores images on the filesystem.
-    When and if hosted publicly, encapsulating here will make it easy
-    to move to a cloud storage provider like S3.
+class ImageStore(ABC):
+    """Downloads and stores the images of media items, read back by
+    storage filename. Subclasses decide where images are stored.
     """
 
-    def __init__(self, resolution=250, base_path: Optional[str] = None, download_original: bool = False):
+    def __init__(
+        self,
+        resolution=250,
+        base_path: Optional[str] = None,
+        download_original: bool = False,
+    ):
         self.resolution = resolution
         self.base_path = base_path
         self.download_original = download_original
@@ -25,36 +31,129 @@ class MediaItemsImageStore:
                 raise PermissionError(f"Image store path not writable: {self.base_path}")
 
     def store_image(self, media_item) -> str:
-        url = self._image_url(media_item)
-        path = self._storage_path(media_item)
+        storage_filename = self._storage_filename(media_item)
         # If we already have a local copy, don't download it again
-        if not os.path.isfile(path):
-            attempts = 3
-            success = False
-            while not success:
-                try:
-                    response = requests.get(url, timeout=5)
-                    response.raise_for_status()
-                    with open(path, "wb") as file:
-                        file.write(response.content)
-                    success = True
-                except requests.exceptions.RequestException as error:
-                    attempts -= 1
-                    sleep_time = app.config.RESPONSE_FAILURE_RETRY_SECONDS
-                    if error.response is not None and error.response.status_code == 429:
-                        sleep_time = app.config.RESPONSE_429_RETRY_SECONDS
-                    logging.warning(
-                        f"Received {error} downloading image\n"
-                        f"media_item: {media_item}\n"
-                        f"url: {url}\n"
-                        f"attempts left: {attempts}\n"
-                        f"sleeping for {sleep_time} seconds before retrying"
-                    )
-                    time.sleep(sleep_time)
-                    if attempts <= 0:
-                        raise error
-
-        return self._storage_filename(media_item)
+        if not self._is_stored(storage_filename):
+            content = self._download_image(media_item)
+            self._write_image(storage_filename, content)
+
+        return storage_filename
+
+    def is_valid(self) -> bool:
+        """
+        Return whether the store still matches what's stored, so it can be
+        reused, e.g. its directory wasn't deleted since.
+        """
+        return True
+
+    @abstractmethod
+    def missing(self, media_items) -> list:
+        """
+        Return the media items that don't have a stored image yet.
+        """
+
+    @abstractmethod
+    def read_image(self, storage_filename: str):
+        """
+        Return a stored image's bytes, as bytes or a bytes-like view.
+        """
+
+    @abstractmethod
+    def image_size(self, storage_filename: str) -> int:
+        """
+        Return a stored image's size in bytes.
+        """
+
+    def _download_image(self, media_item) -> bytes:
+        url = self._image_url(media_item)
+        attempts = 3
+        while True:
+            try:
+                response = requests.get(url, timeout=5)
+                response.raise_for_status()
+                return response.content
+            except requests.exceptions.RequestException as error:
+                attempts -= 1
+                sleep_time = app.config.RESPONSE_FAILURE_RETRY_SECONDS
+                if error.response is not None and error.response.status_code == 429:
+                    sleep_time = app.config.RESPONSE_429_RETRY_SECONDS
+                logging.warning(
+                    f"Received {error} downloading image\n"
+                    f"media_item: {media_item}\n"
+                    f"url: {url}\n"
+                    f"attempts left: {attempts}\n"
+                    f"sleeping for {sleep_time} seconds before retrying"
+                )
+                time.sleep(sleep_time)
+                if attempts <= 0:
+                    raise error
+
+    @abstractmethod
+    def _is_stored(self, storage_filename: str) -> bool:
+        pass
+
+    @abstractmethod
+    def _write_image(self, storage_filename: str, content: bytes) -> None:
+        pass
+
+    def _storage_filename(self, media_item) -> str:
+        # These are all JPEG images (baseUrl for movies is a thumbnail)
+        if self.download_original:
+            return f"{media_item['id']}-original.jpg"
+        return f"{media_item['id']}-{self.resolution}.jpg"
+
+    def _image_url(self, media_item) -> str:
+        if self.download_original:
+            # Request the original image (no size query)
+            return f"{media_item['baseUrl']}"
+        return f"{media_item['baseUrl']}=w{self.resolution}-h{self.resolution}"
+
+
+class MediaItemsImageStore(ImageStore):
+    """Stores images on the filesystem, one file per media item.
+    When and if hosted publicly, encapsulating here will make it easy
+    to move to a cloud storage provider like S3.
+    """
+
+    # Optional list of stored filenames, one per line, so the index of stored
+    #   images can be loaded without listing the directory
+    MANIFEST_FILENAME = ".manifest"
+
+    def __init__(
+        self,
+        resolution=250,
+        base_path: Optional[str] = None,
+        download_original: bool = False,
+        use_manifest: Optional[bool] = None,
+    ):
+        super().__init__(
+            resolution=resolution,
+            base_path=base_path,
+            download_original=download_original,
+        )
+        self.use_manifest = (
+            app.config.IMAGE_STORE_MANIFEST if use_manifest is None else use_manifest
+        )
+        # Filenames of stored images, loaded on first use and kept up to date
+        #   on writes so we don't stat every image on every run. Shared by the
+        #   threads of tasks reusing this store, see create_image_store.
+        self._stored_filenames: Optional[set[str]] = None
+        self._stored_filenames_lock = threading.Lock()
+        # One of them, to check the images weren't deleted since, see is_valid
+        self._sample_filename: Optional[str] = None
+
+    def is_valid(self) -> bool:
+        # Images are only deleted along with their directory (e.g. a
+        #   checkpoint's chunk images), so one missing image means they all are
+        if self._sample_filename is not None:
+            return os.path.isfile(self.get_storage_path(self._sample_filename))
+        return os.path.isdir(os.path.dirname(self._manifest_path()))
+
+    def missing(self, media_items) -> list:
+        stored_filenames = self._get_stored_filenames()
+        return [
+            m for m in media_items if self._storage_filename(m) not in stored_filenames
+        ]
 
     def get_storage_path(self, storage_filename: str) -> str:
         base = self.base_path if self.base_path else app.config.IMAGE_STORE_PATH
@@ -63,12 +162,75 @@ class MediaItemsImageStore:
             storage_filename,
         )
 
+    def read_image(self, storage_filename: str) -> bytes:
+        with open(self.get_storage_path(storage_filename), "rb") as image_file:
+            return image_file.read()
 
-    def _storage_filename(self, media_item) -> str:
-        # These are all JPEG images (baseUrl for movies is a thumbnail)
-        if self.download_original:
-            return f"{media_item['id']}-original.jpg"
-        return f"{media_item['id']}-{self.resolution}.jpg"
+    def image_size(self, storage_filename: str) -> int:
+        return os.path.getsize(self.get_storage_path(storage_filename))
+
+    def _is_stored(self, storage_filename: str) -> bool:
+        stored_filenames = self._get_stored_filenames()
+        if storage_filename in stored_filenames:
+            return True
+
+        # Another worker may have stored it since we loaded the index. Only
+        #   images we're about to download get this extra check.
+        if os.path.isfile(self.get_storage_path(storage_filename)):
+            stored_filenames.add(storage_filename)
+            return True
+
+        return False
+
+    def _write_image(self, storage_filename: str, content: bytes) -> None:
+        # Write to a temporary file first so an interrupted download never
+        #   leaves a truncated image that looks stored
+        path = self.get_storage_path(storage_filename)
+        with open(f"{path}.tmp", "wb") as file:
+            file.write(content)
+        os.replace(f"{path}.tmp", path)
+
+        self._get_stored_filenames().add(storage_filename)
+        if self._sample_filename is None:
+            self._sample_filename = storage_filename
+        if self.use_manifest:
+            with open(self._manifest_path(), "a") as manifest_file:
+                manifest_file.write(f"{storage_filename}\n")
+
+    def _get_stored_filenames(self) -> set[str]:
+        with self._stored_filenames_lock:
+            if self._stored_filenames is None:
+                self._stored_filenames = self._load_stored_filenames()
+                self._sample_filename = next(iter(self._stored_filenames), None)
+            return self._stored_filenames
+
+    def _load_stored_filenames(self) -> set[str]:
+        manifest_path = self._manifest_path()
+        if self.use_manifest and os.path.isfile(manifest_path):
+            with open(manifest_path) as manifest_file:
+                return {line.rstrip("\n") for line in manifest_file if line.strip()}
+
+        # A single directory listing instead of a stat per image
+        try:
+            with os.scandir(os.path.dirname(manifest_path)) as entries:
+                stored_filenames = {
+                    entry.name
+                    for entry in entries
+                    if entry.name.endswith(".jpg") and entry.is_file()
+                }
+        except FileNotFoundError:
+            stored_filenames = set()
+
+        if self.use_manifest:
+            tmp_manifest_path = f"{manifest_path}.tmp"
+            with open(tmp_manifest_path, "w") as manifest_file:
+                manifest_file.writelines(f"{f}\n" for f in sorted(stored_filenames))
+            os.replace(tmp_manifest_path, manifest_path)
+
+        return stored_filenames
+
+    def _manifest_path(self) -> str:
+        return self.get_storage_path(self.MANIFEST_FILENAME)
 
     def _storage_path(self, media_item) -> str:
         base = self.base_path if self.base_path else app.config.IMAGE_STORE_PATH
@@ -76,9 +238,3 @@ class MediaItemsImageStore:
             base,
             self._storage_filename(media_item),
         )
-
-    def _image_url(self, media_item) -> str:
-        if self.download_original:
-            # Request the original image (no size query)
-            return f"{media_item['baseUrl']}"
-        return f"{media_item['baseUrl']}=w{self.resolution}-h{self.resolution}"
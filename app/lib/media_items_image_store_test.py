@@ -105,3 +105,62 @@ def test_get_storage_path(mocker, storable_media_item, image_store):
     result = image_store.get_storage_path("test.jpg")
 
     assert result == "/tmp/test.jpg"
+
+
+def test_missing(mocker, media_item, tmp_path):
+    """It should return only media items without a stored image, listing the directory once."""
+    (tmp_path / "image1-250.jpg").write_bytes(b"test")
+    image_store = MediaItemsImageStore(base_path=str(tmp_path))
+    p = mocker.spy(os, "scandir")
+
+    result = image_store.missing(
+        [media_item | {"id": "image1"}, media_item | {"id": "image2"}]
+    )
+    image_store.missing([media_item | {"id": "image1"}])
+
+    assert [m["id"] for m in result] == ["image2"]
+    assert p.call_count == 1
+
+
+def test_missing__updated_on_store(mocker, storable_media_item, tmp_path):
+    """Images stored through the store should no longer be reported missing."""
+    image_store = MediaItemsImageStore(base_path=str(tmp_path))
+    p = mocker.patch.object(requests, "get")
+    p.return_value = requests.models.Response()
+    p.return_value.status_code = 200
+    p.return_value._content = b"test"
+
+    assert len(image_store.missing([storable_media_item])) == 1
+    image_store.store_image(storable_media_item)
+
+    assert image_store.missing([storable_media_item]) == []
+
+
+def test_missing__manifest(mocker, storable_media_item, tmp_path):
+    """With a manifest, it should load stored filenames from it instead of listing the directory."""
+    (tmp_path / ".manifest").write_text("image1-250.jpg\n")
+    image_store = MediaItemsImageStore(base_path=str(tmp_path), use_manifest=True)
+    p = mocker.spy(os, "scandir")
+
+    assert image_store.missing([storable_media_item]) == []
+    p.assert_not_called()
+
+
+def test_create_image_store__shared(mocker, tmp_path, storable_media_item):
+    """Stores for the same path should be shared until their images are deleted."""
+    from app.lib import image_stores
+
+    mocker.patch("app.config.IMAGE_STORE_BACKEND", "files")
+    mocker.patch.object(MediaItemsImageStore, "_download_image", return_value=b"image")
+    image_stores.clear()
+    store = image_stores.create_image_store(base_path=str(tmp_path / "images"))
+    store.store_image(storable_media_item)
+
+    assert image_stores.create_image_store(base_path=str(tmp_path / "images")) is store
+    assert image_stores.create_image_store(base_path=str(tmp_path / "other")) is not store
+
+    # e.g. a checkpoint's chunk images, deleted once embedded
+    shutil.rmtree(tmp_path / "images")
+    new_store = image_stores.create_image_store(base_path=str(tmp_path / "images"))
+    assert new_store is not store
+    assert new_store.missing([storable_media_item]) == [storable_media_item]
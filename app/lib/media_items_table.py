@@ -0,0 +1,119 @@
+import datetime
+from array import array
+from typing import Iterable, Mapping, Optional
+import numpy as np
+
+# Missing creation times, as stored in the int64 view of creation_times
+_NAT = np.datetime64("NaT", "s").astype(np.int64)
+
+
+class MediaItemsTable:
+    """
+    Compact, columnar view of the media items being checked for duplicates.
+
+    Rather than a dict per media item, ids are concatenated into a single
+    buffer (sliced by `id`), and dimensions, sizes and creation times are
+    NumPy arrays. Media items are referred to everywhere else by their integer
+    index in the table.
+    """
+
+    def __init__(
+        self,
+        id_data: bytes,
+        id_offsets: np.ndarray,
+        widths: np.ndarray,
+        heights: np.ndarray,
+        creation_times: np.ndarray,
+        sizes: np.ndarray,
+    ):
+        self._id_data = id_data
+        self._id_offsets = id_offsets
+        self.widths = widths
+        self.heights = heights
+        self.creation_times = creation_times
+        # Size in bytes, or 0 if unknown
+        self.sizes = sizes
+
+    @classmethod
+    def from_media_items(cls, media_items: Iterable[Mapping]) -> "MediaItemsTable":
+        """
+        Build a table from media item documents, reading them one at a time.
+        """
+        id_data = bytearray()
+        id_offsets = array("q", [0])
+        widths = array("I")
+        heights = array("I")
+        creation_times = array("q")
+        sizes = array("Q")
+
+        for media_item in media_items:
+            media_metadata = media_item.get("mediaMetadata") or {}
+            id_data += media_item["id"].encode()
+            id_offsets.append(len(id_data))
+            widths.append(int(media_metadata.get("width") or 0))
+            heights.append(int(media_metadata.get("height") or 0))
+            creation_times.append(_parse_creation_time(media_metadata.get("creationTime")))
+            sizes.append(int(media_item.get("size") or 0))
+
+        return cls(
+            bytes(id_data),
+            np.frombuffer(id_offsets, dtype=np.int64),
+            np.frombuffer(widths, dtype=np.uint32),
+            np.frombuffer(heights, dtype=np.uint32),
+            np.frombuffer(creation_times, dtype=np.int64).view("datetime64[s]"),
+            np.frombuffer(sizes, dtype=np.uint64),
+        )
+
+    def __len__(self) -> int:
+        return len(self._id_offsets) - 1
+
+    def id(self, index: int) -> str:
+        start, end = self._id_offsets[index], self._id_offsets[index + 1]
+        return self._id_data[start:end].decode()
+
+    def ids(self, start: int = 0, stop: Optional[int] = None) -> list[str]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        return [self.id(i) for i in range(start, stop)]
+
+    def original_index(self, indices: Iterable[int]) -> int:
+        """
+        Choose the original among a group of duplicates: the media item with
+        the largest dimensions, and of those the earliest created.
+
+        @return index of the original media item
+        """
+        indices = np.fromiter(indices, dtype=np.int64)
+        pixels = self.widths[indices].astype(np.int64) * self.heights[indices]
+        largest = indices[pixels == pixels.max()]
+
+        creation_times = self.creation_times[largest].view(np.int64)
+        # Media items without a creation time are never preferred
+        creation_times = np.where(
+            creation_times == _NAT, np.iinfo(np.int64).max, creation_times
+        )
+        return int(largest[np.argmin(creation_times)])
+
+    def reclaimable_bytes(self, indices: Iterable[int], original_index: int) -> int:
+        """
+        @return known size of the duplicates in a group, other than the original
+        """
+        indices = np.fromiter(indices, dtype=np.int64)
+        return int(self.sizes[indices[indices != original_index]].sum())
+
+
+def _parse_creation_time(value: Optional[str]) -> int:
+    """
+    @return seconds since the epoch for an RFC 3339 creationTime (e.g.
+    "2023-07-10T02:20:47Z"), or NaT if it's missing or can't be parsed
+    """
+    if not value:
+        return _NAT
+    try:
+        # fromisoformat doesn't accept "Z" or arbitrary fractional seconds
+        value = value.replace("Z", "+00:00")
+        if "." in value:
+            seconds, _, rest = value.partition(".")
+            value = seconds + rest.lstrip("0123456789")
+        return int(datetime.datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return _NAT
@@ -0,0 +1,353 @@
+import argparse
+import fcntl
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Optional
+import app.config
+from app.lib.media_items_image_store import ImageStore
+
+
+class PackedMediaItemsImageStore(ImageStore):
+    """Stores images appended to a few large pack files instead of one file
+    per media item.
+
+    Every image is appended to the active pack file and located through an
+    append-only index of (pack number, offset, length) records. Reads are
+    served from memory mapped packs, and `compact` rewrites the packs to
+    reclaim space held by deleted or overwritten images.
+
+    One store may be shared by the threads of a process (see
+    create_image_store), and the packs by processes, which notice compactions
+    by the index file being replaced.
+    """
+
+    INDEX_FILENAME = "images.idx"
+    LOCK_FILENAME = "images.lock"
+    PACK_FILENAME_FORMAT = "images-{generation:04d}-{number:05d}.pack"
+    PACK_FILENAME_PATTERN = re.compile(r"^images-(\d{4})-(\d{5})\.pack$")
+
+    # Index layout: a header (magic, generation) followed by records of
+    #   (name length, pack number, offset, length) and the name itself.
+    #   A record with a length of 0 is a tombstone for a deleted image.
+    INDEX_MAGIC = b"GPDPACK1"
+    INDEX_HEADER = struct.Struct("<8sI")
+    INDEX_RECORD = struct.Struct("<HIQI")
+
+    def __init__(self, *args, max_pack_bytes: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_pack_bytes = max_pack_bytes or app.config.IMAGE_PACK_MAX_BYTES
+
+        self.path = self.base_path if self.base_path else app.config.IMAGE_STORE_PATH
+        os.makedirs(self.path, exist_ok=True)
+        self.index_path = os.path.join(self.path, self.INDEX_FILENAME)
+        self.lock_path = os.path.join(self.path, self.LOCK_FILENAME)
+
+        self._generation = 0
+        self._entries: dict[str, tuple[int, int, int]] = {}
+        self._active_pack_number = 0
+        self._index_inode = None
+        self._index_offset = 0
+        self._maps: dict[int, mmap.mmap] = {}
+        # Guards the index state above between threads. Reentrant, since
+        #   writers hold it across refreshes.
+        self._state_lock = threading.RLock()
+
+        with self._lock():
+            if not os.path.isfile(self.index_path):
+                self._write_index_header(self.index_path, self._generation)
+        self._refresh_index()
+
+    def is_valid(self) -> bool:
+        # A recreated index (e.g. of a checkpoint's chunk images, deleted once
+        #   embedded) is shorter than what we've read, unless it's been
+        #   compacted, which _refresh_index handles
+        with self._state_lock:
+            try:
+                return os.path.getsize(self.index_path) >= self._index_offset
+            except FileNotFoundError:
+                return False
+
+    def missing(self, media_items) -> list:
+        # The pack index already knows every stored image
+        with self._state_lock:
+            self._refresh_index()
+            return [
+                m for m in media_items if self._storage_filename(m) not in self._entries
+            ]
+
+    def locate(self, storage_filename: str) -> Optional[tuple[str, int, int]]:
+        """
+        Return the (pack path, offset, length) byte range holding an image, or
+        None if it isn't stored.
+        """
+        with self._state_lock:
+            if os.stat(self.index_path).st_ino != self._index_inode:
+                # Another process compacted the packs, so their paths changed
+                self._refresh_index()
+            entry = self._entry(storage_filename)
+            if entry is None:
+                return None
+
+            number, offset, length = entry
+            return self._pack_path(self._generation, number), offset, length
+
+    def read_image(self, storage_filename: str) -> memoryview:
+        """
+        Return a zero-copy view of a stored image's bytes.
+        """
+        with self._state_lock:
+            try:
+                return self._read_image(storage_filename)
+            except FileNotFoundError:
+                # Another process compacted the packs between checking the
+                #   index and opening the pack, so read the new index
+                self._refresh_index()
+                return self._read_image(storage_filename)
+
+    def image_size(self, storage_filename: str) -> int:
+        with self._state_lock:
+            entry = self._entry(storage_filename)
+        if entry is None:
+            raise FileNotFoundError(f"Image not in pack store: {storage_filename}")
+        return entry[2]
+
+    def delete(self, storage_filenames: list[str]) -> None:
+        """
+        Mark images as deleted. Their bytes are reclaimed by `compact`.
+        """
+        with self._lock():
+            self._refresh_index()
+            with open(self.index_path, "ab") as index_file:
+                for storage_filename in storage_filenames:
+                    if storage_filename in self._entries:
+                        index_file.write(self._index_record(storage_filename, 0, 0, 0))
+                        del self._entries[storage_filename]
+            self._index_offset = os.path.getsize(self.index_path)
+
+    def compact(self) -> dict:
+        """
+        Rewrite all live images into a new generation of pack files, dropping
+        deleted and overwritten images, then remove the old packs.
+        """
+        with self._lock():
+            self._refresh_index()
+            old_generation = self._generation
+            old_pack_paths = self._existing_pack_paths(old_generation)
+            bytes_before = sum(os.path.getsize(p) for p in old_pack_paths)
+
+            generation = old_generation + 1
+            tmp_index_path = f"{self.index_path}.tmp"
+            self._write_index_header(tmp_index_path, generation)
+
+            entries = {}
+            number, pack_size = 0, 0
+            pack_file = open(self._pack_path(generation, number), "ab")
+            with open(tmp_index_path, "ab") as index_file:
+                for storage_filename, (old_number, offset, length) in sorted(
+                    self._entries.items(), key=lambda item: item[1]
+                ):
+                    if pack_size and pack_size + length > self.max_pack_bytes:
+                        pack_file.close()
+                        number, pack_size = number + 1, 0
+                        pack_file = open(self._pack_path(generation, number), "ab")
+
+                    view = memoryview(self._map(old_number, offset + length))
+                    pack_file.write(view[offset : offset + length])
+                    view.release()
+
+                    entries[storage_filename] = (number, pack_size, length)
+                    index_file.write(
+                        self._index_record(storage_filename, number, pack_size, length)
+                    )
+                    pack_size += length
+
+                pack_file.close()
+                index_file.flush()
+                os.fsync(index_file.fileno())
+
+            os.replace(tmp_index_path, self.index_path)
+            self._reset()
+            self._refresh_index()
+
+            for path in old_pack_paths:
+                os.remove(path)
+
+            bytes_after = sum(
+                os.path.getsize(p) for p in self._existing_pack_paths(generation)
+            )
+
+        logging.info(
+            f"Compacted image packs in {self.path}: {len(entries)} images, "
+            f"{bytes_before:,} -> {bytes_after:,} bytes"
+        )
+
+        return {
+            "images": len(entries),
+            "bytesBefore": bytes_before,
+            "bytesAfter": bytes_after,
+        }
+
+    def _read_image(self, storage_filename: str) -> memoryview:
+        entry = self._entry(storage_filename)
+        if entry is None:
+            raise FileNotFoundError(f"Image not in pack store: {storage_filename}")
+
+        number, offset, length = entry
+        return memoryview(self._map(number, offset + length))[offset : offset + length]
+
+    def _is_stored(self, storage_filename: str) -> bool:
+        with self._state_lock:
+            return self._entry(storage_filename) is not None
+
+    def _write_image(self, storage_filename: str, content: bytes) -> None:
+        with self._lock():
+            # Pick up writes from other processes so we append after them
+            self._refresh_index()
+
+            number = self._active_pack_number
+            pack_path = self._pack_path(self._generation, number)
+            pack_size = os.path.getsize(pack_path) if os.path.isfile(pack_path) else 0
+            if pack_size and pack_size + len(content) > self.max_pack_bytes:
+                number += 1
+                pack_path = self._pack_path(self._generation, number)
+                pack_size = 0
+
+            # Write the image before its index record, so a crash between the
+            #   two leaves unreferenced bytes rather than a dangling record
+            with open(pack_path, "ab") as pack_file:
+                offset = pack_file.tell()
+                pack_file.write(content)
+
+            with open(self.index_path, "ab") as index_file:
+                index_file.write(
+                    self._index_record(storage_filename, number, offset, len(content))
+                )
+                self._index_offset = index_file.tell()
+
+            self._entries[storage_filename] = (number, offset, len(content))
+            self._active_pack_number = number
+
+    def _entry(self, storage_filename: str) -> Optional[tuple[int, int, int]]:
+        entry = self._entries.get(storage_filename)
+        if entry is None:
+            # Another process may have stored it since we last read the index.
+            #   Compactions by other processes keep every stored image, and
+            #   read_image notices the packs were replaced.
+            self._refresh_index()
+            entry = self._entries.get(storage_filename)
+        return entry
+
+    def _refresh_index(self) -> None:
+        """
+        Read any index records appended since the last refresh, reloading the
+        whole index if it was replaced by a compaction.
+        """
+        with self._state_lock:
+            self._read_index()
+
+    def _read_index(self) -> None:
+        with open(self.index_path, "rb") as index_file:
+            inode = os.fstat(index_file.fileno()).st_ino
+            if inode != self._index_inode:
+                self._reset()
+                magic, self._generation = self.INDEX_HEADER.unpack(
+                    index_file.read(self.INDEX_HEADER.size)
+                )
+                if magic != self.INDEX_MAGIC:
+                    raise ValueError(f"Not an image pack index: {self.index_path}")
+                self._index_inode = inode
+                self._index_offset = self.INDEX_HEADER.size
+
+            index_file.seek(self._index_offset)
+            data = index_file.read()
+
+        position = 0
+        record_size = self.INDEX_RECORD.size
+        while position + record_size <= len(data):
+            name_length, number, offset, length = self.INDEX_RECORD.unpack_from(
+                data, position
+            )
+            name_end = position + record_size + name_length
+            if name_end > len(data):
+                # Partially written record, pick it up on the next refresh
+                break
+
+            storage_filename = data[position + record_size : name_end].decode()
+            if length:
+                self._entries[storage_filename] = (number, offset, length)
+                self._active_pack_number = max(self._active_pack_number, number)
+            else:
+                self._entries.pop(storage_filename, None)
+            position = name_end
+
+        self._index_offset += position
+
+    def _reset(self) -> None:
+        # Views handed out by read_image may still reference the old maps, so
+        #   drop our references and let them close once released
+        self._maps = {}
+        self._entries = {}
+        self._active_pack_number = 0
+        self._index_inode = None
+
+    def _map(self, number: int, min_size: int) -> mmap.mmap:
+        # Callers hold _state_lock, so the generation matches the entries
+        mapped = self._maps.get(number)
+        if mapped is None or len(mapped) < min_size:
+            # Packs grow as images are appended, so remap to cover new bytes
+            with open(self._pack_path(self._generation, number), "rb") as pack_file:
+                mapped = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[number] = mapped
+        return mapped
+
+    def _pack_path(self, generation: int, number: int) -> str:
+        return os.path.join(
+            self.path,
+            self.PACK_FILENAME_FORMAT.format(generation=generation, number=number),
+        )
+
+    def _existing_pack_paths(self, generation: int) -> list[str]:
+        paths = []
+        for filename in os.listdir(self.path):
+            match = self.PACK_FILENAME_PATTERN.match(filename)
+            if match and int(match.group(1)) == generation:
+                paths.append(os.path.join(self.path, filename))
+        return sorted(paths)
+
+    def _index_record(
+        self, storage_filename: str, number: int, offset: int, length: int
+    ) -> bytes:
+        name = storage_filename.encode()
+        return self.INDEX_RECORD.pack(len(name), number, offset, length) + name
+
+    def _write_index_header(self, path: str, generation: int) -> None:
+        with open(path, "wb") as index_file:
+            index_file.write(self.INDEX_HEADER.pack(self.INDEX_MAGIC, generation))
+
+    @contextmanager
+    def _lock(self):
+        """Serialize writers across processes and threads sharing the store."""
+        with self._state_lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+if __name__ == "__main__":
+    # Compact image packs, e.g.
+    #   python -m app.lib.packed_media_items_image_store compact /mnt/images/
+    parser = argparse.ArgumentParser(description="Maintain packed image stores")
+    parser.add_argument("command", choices=["compact"])
+    parser.add_argument("path", nargs="?", default=None)
+    cli_args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = PackedMediaItemsImageStore(base_path=cli_args.path)
+    print(store.compact())
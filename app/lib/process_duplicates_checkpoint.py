@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Optional
+import numpy as np
+import app.config
+
+
+class ProcessDuplicatesCheckpoint:
+    """
+    Durable progress of a chunked duplicate detection run, so a restarted
+    task continues from the last completed step instead of starting over.
+
+    A checkpoint is keyed by user and the options that affect its contents,
+    not by task id, so a new task with the same options picks it up. It holds:
+      - chunk-<i>-images/: downloaded images for chunk i, with a manifest of
+        downloaded items (kept until the chunk's embeddings are saved)
+      - chunk-<i>.json + chunk-<i>-embeddings.npy: completed chunk embeddings,
+        and the positions within the chunk of the media items embedded
+      - pair-<i>-<j>.npz: completed chunk pair comparisons
+
+    Chunk and pair files record a key derived from their inputs, so a chunk
+    whose media items changed since the checkpoint was written is redone.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def for_task(cls, user_id: str, options: dict) -> "ProcessDuplicatesCheckpoint":
+        key = cls._hash(json.dumps({"userId": user_id} | options, sort_keys=True))
+        return cls(os.path.join(app.config.CHECKPOINT_PATH, key))
+
+    @classmethod
+    def chunk_key(cls, media_item_ids: list[str]) -> str:
+        return cls._hash("\n".join(media_item_ids))
+
+    def chunk_images_path(self, chunk_index: int) -> str:
+        return os.path.join(self.path, f"chunk-{chunk_index}-images")
+
+    def chunk_embeddings_path(self, chunk_index: int) -> str:
+        return os.path.join(self.path, f"chunk-{chunk_index}-embeddings.npy")
+
+    def load_chunk(self, chunk_index: int, chunk_key: str) -> Optional[np.ndarray]:
+        """
+        Return the positions within the chunk of the media items embedded for
+        a completed chunk, or None if the chunk hasn't been completed with the
+        same media items.
+        """
+        chunk = self._read_json(self._chunk_path(chunk_index))
+        if chunk is None or chunk["key"] != chunk_key:
+            return None
+        if not os.path.isfile(self.chunk_embeddings_path(chunk_index)):
+            return None
+        return np.array(chunk["positions"], dtype=np.int64)
+
+    def save_chunk(
+        self,
+        chunk_index: int,
+        chunk_key: str,
+        positions: np.ndarray,
+        embeddings: np.ndarray,
+    ) -> None:
+        # Embeddings first: the chunk file marks the chunk as complete
+        with self._atomic_write(self.chunk_embeddings_path(chunk_index)) as file:
+            np.save(file, embeddings)
+        with self._atomic_write(self._chunk_path(chunk_index)) as file:
+            chunk = {"key": chunk_key, "positions": [int(p) for p in positions]}
+            file.write(json.dumps(chunk).encode())
+
+        shutil.rmtree(self.chunk_images_path(chunk_index), ignore_errors=True)
+
+    def load_pair(
+        self, i: int, j: int, pair_key: str
+    ) -> Optional[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Return the (a indices, b indices, scores) of similar items found when
+        comparing chunks i and j, or None if not compared yet.
+        """
+        path = self._pair_path(i, j)
+        if not os.path.isfile(path):
+            return None
+
+        with np.load(path) as pair:
+            if str(pair["key"]) != pair_key:
+                return None
+            return pair["a"], pair["b"], pair["scores"]
+
+    def has_pair(self, i: int, j: int, pair_key: str) -> bool:
+        """
+        Return whether chunks i and j have been compared, without loading
+        the comparison.
+        """
+        path = self._pair_path(i, j)
+        if not os.path.isfile(path):
+            return False
+
+        with np.load(path) as pair:
+            return str(pair["key"]) == pair_key
+
+    def save_pair(
+        self,
+        i: int,
+        j: int,
+        pair_key: str,
+        a: np.ndarray,
+        b: np.ndarray,
+        scores: np.ndarray,
+    ) -> None:
+        with self._atomic_write(self._pair_path(i, j)) as file:
+            np.savez(file, key=np.array(pair_key), a=a, b=b, scores=scores)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _chunk_path(self, chunk_index: int) -> str:
+        return os.path.join(self.path, f"chunk-{chunk_index}.json")
+
+    def _pair_path(self, i: int, j: int) -> str:
+        return os.path.join(self.path, f"pair-{i}-{j}.npz")
+
+    def _read_json(self, path: str) -> Optional[dict]:
+        if not os.path.isfile(path):
+            return None
+        with open(path) as file:
+            return json.load(file)
+
+    @contextmanager
+    def _atomic_write(self, path: str):
+        """
+        Write to a temporary file and move it into place on success, so a
+        crash or terminated task never leaves a partially written file.
+        """
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                yield file
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _hash(value: str) -> str:
+        return hashlib.sha256(value.encode()).hexdigest()[:24]
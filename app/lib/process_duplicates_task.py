@@ -1,18 +1,26 @@
 import copy
 import datetime
 import logging
-import time
-import os
-from typing import Literal, Optional
-import celery.result
+from typing import NoReturn, Optional
+import celery
+from celery.exceptions import Ignore
+import numpy as np
 import requests
 import app.config
 from app.lib.duplicate_image_detector import DuplicateImageDetector
-from app.lib.google_photos_client import GooglePhotosClient
+from app.lib.google_photos_client import (
+    GooglePhotosClient,
+    fetch_original_sizes,
+    refresh_expired_base_urls,
+)
 from app import CELERY_APP as celery_app
 from app.models.media_items_repository import MediaItemsRepository
-from app.lib.media_items_image_store import MediaItemsImageStore
-from enum import Enum
+from app.lib.image_stores import create_image_store
+from app.lib.media_items_image_store import ImageStore
+from app.lib.media_items_table import MediaItemsTable
+from app.lib.process_duplicates_checkpoint import ProcessDuplicatesCheckpoint
+from app.lib.progress_publisher import ProgressPublisher
+from app.lib.similarity_edges import SimilarityEdges
 
 
 class Steps:
@@ -22,26 +30,6 @@ class Steps:
     all = [FETCH_MEDIA_ITEMS, PROCESS_DUPLICATES]
 
 
-class Subtask:
-    class Type(Enum):
-        STORE_IMAGES = "store_images"
-
-    types = [Type.STORE_IMAGES]
-    type_type = Literal[Type.STORE_IMAGES]
-
-    def __init__(self, type: type_type, result: celery.result.AsyncResult):
-        self._type = type
-        self._result = result
-
-    @property
-    def type(self):
-        return self._type
-
-    @property
-    def result(self):
-        return self._result
-
-
 class DailyLimitExceededError(Exception):
     pass
 
@@ -52,6 +40,9 @@ class SubtasksFailedError(Exception):
 
 class ProcessDuplicatesTask:
     SUBTASK_BATCH_SIZE = 100
+    # Stages of chunked detection that are run in subtasks, in order, when
+    #   PROCESS_DUPLICATES_FAN_OUT is enabled
+    FAN_OUT_SUBTASKS = ["embed_chunk", "compare_chunks"]
 
     def __init__(
         self,
@@ -85,9 +76,19 @@ class ProcessDuplicatesTask:
             step: {"startedAt": None, "completedAt": None} for step in Steps.all
         }
 
-        # Initialize subtasks structure for async results
-        self.fetched_media_item_ids: list[dict] = []
-        self.subtasks: list[Subtask] = []
+        # Log lines and download progress update meta far more often than it
+        #   needs writing to the result backend
+        self.progress = ProgressPublisher(
+            self._publish_meta,
+            min_interval=app.config.PROGRESS_PUBLISH_INTERVAL_SECONDS,
+        )
+
+        # Fetched media item ids, and batches of them to store images for in
+        #   store_images subtasks
+        self.fetched_media_item_ids: list[str] = []
+        self.store_images_batches: list[list[str]] = []
+        # FAN_OUT_SUBTASKS this run has already been replaced with
+        self.fanned_out: list[str] = []
 
     def run(self):
         self.start_step(Steps.FETCH_MEDIA_ITEMS)
@@ -97,7 +98,7 @@ class ProcessDuplicatesTask:
             self.logger.info("Using extension-sourced photos, skipping API fetch")
             self.update_meta(
                 log_message="Using photos from Chrome Extension...",
-                currentOperation="Loading photos from extension"
+                current_operation="Loading photos from extension"
             )
             
             # Count photos from extension
@@ -120,7 +121,7 @@ class ProcessDuplicatesTask:
             self.complete_step(Steps.FETCH_MEDIA_ITEMS, count=media_items_count)
             self.update_meta(
                 log_message=f"Loaded {media_items_count} photos from extension. Starting duplicate detection...",
-                currentOperation="Starting duplicate analysis"
+                current_operation="Starting duplicate analysis"
             )
             self.start_step(Steps.PROCESS_DUPLICATES)
         # If using picker-sourced photos, skip API fetch
@@ -128,7 +129,7 @@ class ProcessDuplicatesTask:
             self.logger.info("Using picker-sourced photos, skipping API fetch")
             self.update_meta(
                 log_message="Using photos from Google Photos Picker...",
-                currentOperation="Loading selected photos"
+                current_operation="Loading selected photos"
             )
             
             # Count photos from picker
@@ -151,7 +152,7 @@ class ProcessDuplicatesTask:
             self.complete_step(Steps.FETCH_MEDIA_ITEMS, count=media_items_count)
             self.update_meta(
                 log_message=f"Loaded {media_items_count} selected photos. Starting duplicate detection...",
-                currentOperation="Starting duplicate analysis"
+                current_operation="Starting duplicate analysis"
             )
             self.start_step(Steps.PROCESS_DUPLICATES)
         else:
@@ -171,7 +172,6 @@ class ProcessDuplicatesTask:
                     # Create mongo indexes if they haven't been created yet
                     MediaItemsRepository.create_indexes()
                     self._fetch_media_items(client)
-                    self._await_subtask_completion()
             except Exception as e:
                 # If a subtask failed due to insufficient scopes, return a clear result
                 from app.lib.google_api_client import InsufficientScopesError
@@ -189,66 +189,131 @@ class ProcessDuplicatesTask:
                 # Re-raise other exceptions
                 raise
 
-            media_items_count = client.local_media_items_count()
-            self.meta["totalItems"] = media_items_count
-            self.complete_step(Steps.FETCH_MEDIA_ITEMS, count=media_items_count)
-            self.update_meta(log_message=f"Fetched {media_items_count} media items. Starting duplicate detection...")
-            self.start_step(Steps.PROCESS_DUPLICATES)
+            if self.store_images_batches:
+                self._store_images_then_detect_duplicates()
+
+            self._complete_fetch_step(client.local_media_items_count())
 
+        return self.detect_duplicates()
+
+    def detect_duplicates_after_subtasks(
+        self, subtask_statuses: list[dict], subtask_name: str
+    ):
+        """
+        Continue from the subtasks this run was replaced with (see
+        _replace_with_subtasks), once they've all finished.
+
+        @param subtask_statuses returned by each subtask
+        @param subtask_name of the subtasks, e.g. "store_images"
+        """
+        errors = [status["error"] for status in subtask_statuses if "error" in status]
+        self.logger.info(
+            f"{len(subtask_statuses)} {subtask_name} subtasks finished "
+            f"({len(errors)} failed)"
+        )
+
+        if errors:
+            self.logger.error(f"{len(errors)} subtasks failed")
+            if "insufficient_scopes" in errors:
+                # If any subtask failed due to insufficient scopes, surface that
+                self.logger.error("Subtask failed due to insufficient scopes")
+                self.update_meta(log_message="Insufficient scopes; ask user to re-authorize")
+                return {"error": "insufficient_scopes", "user_id": self.user_id}
+            num_successful = len(subtask_statuses) - len(errors)
+            if "daily_limit_exceeded" in errors:
+                raise DailyLimitExceededError(
+                    f"Successfully completed {num_successful} of {len(subtask_statuses)} "
+                    f"{subtask_name} subtasks before exceeding daily baseUrl "
+                    f"request quota. Restart tomorrow to resume. "
+                    f"For more details on quota usage, visit "
+                    f"https://console.cloud.google.com/apis/api/photoslibrary.googleapis.com/quotas"
+                )
+            raise SubtasksFailedError(
+                f"{len(errors)} of {len(subtask_statuses)} subtasks failed. "
+                f"View {app.config.CELERY_WORKER_LOG_PATH} for more details. "
+                f"Restart to try again."
+            )
+
+        if subtask_name == "store_images":
+            self._complete_fetch_step(MediaItemsRepository(user_id=self.user_id).count())
+        if subtask_name in self.FAN_OUT_SUBTASKS:
+            # Anything these subtasks (or earlier fanned out ones) left undone
+            #   is done in this task rather than fanned out again
+            self.fanned_out = self.FAN_OUT_SUBTASKS[
+                : self.FAN_OUT_SUBTASKS.index(subtask_name) + 1
+            ]
+        return self.detect_duplicates()
+
+    def detect_duplicates(self):
+        """
+        Find duplicates among the fetched media items.
+        """
         # Determine default chunk size if not set
         if not self.chunk_size:
             # Default to 500 items per chunk for reasonable memory usage
             self.chunk_size = app.config.CHUNK_SIZE_DEFAULT if hasattr(app.config, "CHUNK_SIZE_DEFAULT") else 500
 
+        source_field = None
+        if self.extension_source:
+            source_field = "extensionSource"
+        elif self.picker_source:
+            source_field = "pickerSource"
+
+        # Stream only the fields detection needs into a compact table. Videos
+        #   are skipped by the query, since we don't get video length from
+        #   metadata and size is not a good enough indicator of similarity.
+        repo = MediaItemsRepository(user_id=self.user_id)
+        media_items = MediaItemsTable.from_media_items(
+            repo.detection_media_items(source_field)
+        )
         self.logger.info(
-            f"Processing duplicates for {media_items_count:,} media items..."
+            f"Processing duplicates for {len(media_items):,} media items..."
         )
 
-        media_items = list(client.get_local_media_items())
-
-        # Skip videos for now. We don't get video length from metadata and size
-        #   is not a good enough indicator of similarity; treat items as photos
-        #   unless they explicitly contain 'video' metadata.
-        media_items = list(filter(lambda m: "video" not in m.get("mediaMetadata", {}), media_items))
-
         # If a chunk_size is provided, process embeddings in chunks to avoid
         # storing the entire library at once. Otherwise, use the existing
         # embedding flow.
         if self.chunk_size:
-            similarity_map = self._chunked_similarity_map(media_items)
-            groups = self._groups_from_similarity_map(similarity_map, media_items)
+            pairs = self._chunked_similar_pairs(media_items, repo)
+            similarity_edges = SimilarityEdges.from_pairs(pairs, media_items.id)
+            groups = self._groups_from_pairs(pairs, len(media_items))
         else:
+            id_map = repo.get_id_map(media_items.ids())
             duplicate_detector = DuplicateImageDetector(
-                media_items,
+                [id_map[id] for id in media_items.ids()],
                 logger=self.logger,
                 threshold=self.similarity_threshold,
+                image_store=create_image_store(
+                    resolution=self.resolution,
+                    base_path=self.image_store_path,
+                    download_original=self.download_original,
+                ),
+            )
+            similarity_edges = SimilarityEdges.from_similarity_map(
+                duplicate_detector.calculate_similarity_map()
             )
-            similarity_map = duplicate_detector.calculate_similarity_map()
             groups = duplicate_detector.calculate_groups()
 
+        # Only duplicates count towards reclaimable bytes, so only look up
+        #   their sizes
+        self._update_sizes(media_items, repo, groups)
+
         result = {
-            "similarityMap": similarity_map,
+            "similarityEdges": similarity_edges.to_json(),
             "groups": [],
         }
 
         for group_index, media_item_indices in enumerate(groups):
-            group_media_items = [media_items[i] for i in media_item_indices]
-
-            group_dimensions = [
-                int(m["mediaMetadata"]["width"]) * int(m["mediaMetadata"]["height"])
-                for m in group_media_items
-            ]
-
-            # Choose the media item with largest dimensions as the original
-            #   (we don't get created/uploaded times from the AP).
-            largest = group_dimensions.index(max(group_dimensions))
-            original_media_item_id = group_media_items[largest]["id"]
+            original_index = media_items.original_index(media_item_indices)
 
             result["groups"].append(
                 {
                     "id": str(group_index),
-                    "mediaItemIds": [m["id"] for m in group_media_items],
-                    "originalMediaItemId": original_media_item_id,
+                    "mediaItemIds": [media_items.id(i) for i in media_item_indices],
+                    "originalMediaItemId": media_items.id(original_index),
+                    "reclaimableBytes": media_items.reclaimable_bytes(
+                        media_item_indices, original_index
+                    ),
                 }
             )
 
@@ -256,211 +321,482 @@ class ProcessDuplicatesTask:
 
         return result
 
-    def _chunked_similarity_map(self, media_items: list[dict]) -> dict:
-        """Compute similarity map by processing images in chunks and comparing
-        embeddings across chunk pairs to limit memory usage."""
-        import numpy as np
-        import json
-        import shutil
-
-        task_id = getattr(self.task, "request", None)
-        task_id = getattr(task_id, "id", None) or str(time.time_ns())
-        embeddings_dir = os.path.join(app.config.TEMP_PATH, f"embeddings-{task_id}")
-        os.makedirs(embeddings_dir, exist_ok=True)
+    def _chunked_similar_pairs(
+        self, media_items: MediaItemsTable, repo: MediaItemsRepository
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find similar media items by processing images in chunks and
+        comparing embeddings across chunk pairs to limit memory usage.
+
+        Downloaded images, chunk embeddings and chunk pair comparisons are
+        checkpointed as they complete, so a restarted task resumes from the
+        last completed step. With PROCESS_DUPLICATES_FAN_OUT, chunks are
+        embedded in embed_chunk subtasks and chunk pairs compared in
+        compare_chunks subtasks instead, which this task is replaced with in
+        turn. This task then only reduces the pairs they found.
+
+        @return (a indices, b indices, scores) of each similar pair, with
+        indices into `media_items`"""
+        checkpoint = ProcessDuplicatesCheckpoint.for_task(
+            self.user_id, self._checkpoint_options()
+        )
 
-        chunk_paths = []  # list of (chunk_index, ids_path, emb_path)
+        # (chunk_index, chunk_key, indices, emb_path) of each embedded chunk
+        chunks = []
+        # (chunk_index, chunk_start, chunk_ids) of each chunk to embed
+        pending_chunks = []
         total_chunks = (len(media_items) + self.chunk_size - 1) // self.chunk_size
 
         # Partition media_items into chunks
-        for idx in range(0, len(media_items), self.chunk_size):
-            chunk = media_items[idx : idx + self.chunk_size]
-            chunk_index = idx // self.chunk_size
-            
+        for chunk_index, chunk_start in enumerate(
+            range(0, len(media_items), self.chunk_size)
+        ):
+            chunk_ids = media_items.ids(chunk_start, chunk_start + self.chunk_size)
+            chunk_key = checkpoint.chunk_key(chunk_ids)
+
+            stored_positions = checkpoint.load_chunk(chunk_index, chunk_key)
+            if stored_positions is None:
+                pending_chunks.append((chunk_index, chunk_start, chunk_ids))
+                continue
+
             self.logger.info(
-                f"Processing chunk {chunk_index + 1}/{total_chunks} "
-                f"({len(chunk)} items)"
+                f"Resuming from checkpoint for chunk {chunk_index + 1}/{total_chunks}"
             )
             self.update_meta(
-                log_message=f"Processing chunk {chunk_index + 1}/{total_chunks} "
-                           f"({len(chunk)} items)"
+                items_processed=self.meta.get("itemsProcessed", 0) + len(stored_positions)
             )
+            if len(stored_positions) > 0:
+                chunks.append(
+                    (
+                        chunk_index,
+                        chunk_key,
+                        chunk_start + stored_positions,
+                        checkpoint.chunk_embeddings_path(chunk_index),
+                    )
+                )
 
-            # Create a temporary directory for this chunk's images
-            images_dir = os.path.join(embeddings_dir, f"chunk-{chunk_index}-images")
-            os.makedirs(images_dir, exist_ok=True)
+        if pending_chunks and self._fans_out("embed_chunk"):
+            import app.tasks
 
-            # Use MediaItemsImageStore to store images to images_dir
-            image_store = MediaItemsImageStore(
-                resolution=self.resolution,
-                base_path=images_dir,
-                download_original=self.download_original,
+            self.update_meta(
+                log_message=f"Computing embeddings for {len(pending_chunks)} chunks in subtasks...",
+                current_operation="Computing embeddings",
             )
+            # Each chunk's images are downloaded on the I/O queue, then
+            #   embedded on the CPU queue
+            self._replace_with_subtasks(
+                "embed_chunk",
+                [
+                    app.tasks.download_chunk.s(
+                        self.user_id,
+                        chunk_index,
+                        chunk_ids,
+                        total_chunks,
+                        **self._continuation_options(),
+                    )
+                    | app.tasks.embed_chunk.s(
+                        self.user_id,
+                        chunk_index,
+                        chunk_ids,
+                        total_chunks,
+                        **self._continuation_options(),
+                    )
+                    for chunk_index, _, chunk_ids in pending_chunks
+                ],
+            )
+
+        for chunk_index, chunk_start, chunk_ids in pending_chunks:
+            stored_positions = self._embed_chunk(
+                checkpoint, repo, chunk_index, chunk_ids, total_chunks
+            )
+            if len(stored_positions) > 0:
+                chunks.append(
+                    (
+                        chunk_index,
+                        checkpoint.chunk_key(chunk_ids),
+                        chunk_start + stored_positions,
+                        checkpoint.chunk_embeddings_path(chunk_index),
+                    )
+                )
+        chunks.sort(key=lambda chunk: chunk[0])
+
+        # Now compute pairwise similarities across chunk pairs, only j >= i
+        #   to avoid duplicating work
+        chunk_pairs = [
+            (chunk_i, chunk_j)
+            for n, chunk_i in enumerate(chunks)
+            for chunk_j in chunks[n:]
+        ]
+
+        if self._fans_out("compare_chunks"):
+            pending_pairs = [
+                (i, j, self._pair_key(key_i, key_j))
+                for (i, key_i, _, _), (j, key_j, _, _) in chunk_pairs
+                if not checkpoint.has_pair(i, j, self._pair_key(key_i, key_j))
+            ]
+            if pending_pairs:
+                import app.tasks
 
-            # Store images and set storageFilename on media items
-            stored_chunk = []
-            for idx, m in enumerate(chunk):
-                try:
-                    if idx % 10 == 0:  # Update every 10 images
-                        processed = self.meta.get("itemsProcessed", 0) + idx
-                        self.update_meta(
-                            log_message=f"Downloading images: chunk {chunk_index + 1}/{total_chunks}, "
-                                       f"{idx + 1}/{len(chunk)} images ({processed}/{self.meta.get('totalItems', 0)} total)",
-                            current_operation=f"Downloading images (chunk {chunk_index + 1}/{total_chunks})",
-                            items_processed=processed
+                self.update_meta(
+                    log_message=f"Comparing {len(pending_pairs)} chunk pairs in subtasks...",
+                    current_operation="Comparing image similarities",
+                )
+                self._replace_with_subtasks(
+                    "compare_chunks",
+                    [
+                        app.tasks.compare_chunks.s(
+                            self.user_id, i, j, pair_key, **self._continuation_options()
                         )
-                    filename = image_store.store_image(m)
-                    # Clone media item dict so we don't mutate original
-                    mi = dict(m)
-                    mi["storageFilename"] = filename
-                    stored_chunk.append(mi)
-                except Exception as e:
-                    self.logger.warning("Failed to store image for media_item %s: %s", m.get("id"), e)
-                    continue
-            
-            # Update items processed after chunk download
-            new_processed = self.meta.get("itemsProcessed", 0) + len(stored_chunk)
-            self.update_meta(items_processed=new_processed)
+                        for i, j, pair_key in pending_pairs
+                    ],
+                )
 
-            if len(stored_chunk) == 0:
-                continue
+        pairs_a, pairs_b, pairs_scores = [], [], []
+        total_comparisons = len(chunk_pairs)
+        comparison_count = 0
 
-            # Compute embeddings for this chunk
+        self.logger.info(
+            f"Computing pairwise similarities across {len(chunks)} chunks "
+            f"({total_comparisons} comparisons)"
+        )
+        self.update_meta(
+            log_message=f"Computing similarities: {len(chunks)} chunks, "
+                       f"{total_comparisons} comparisons"
+        )
+
+        emb_i_norm, emb_i_index = None, None
+        for (i, key_i, indices_i, emb_i_path), (j, key_j, indices_j, emb_j_path) in chunk_pairs:
+            comparison_count += 1
+            progress_pct = int((comparison_count / total_comparisons) * 100)
+            self.logger.info(
+                f"Comparing chunks {i} vs {j} ({comparison_count}/{total_comparisons}, {progress_pct}%)"
+            )
             self.update_meta(
-                log_message=f"Computing embeddings: chunk {chunk_index + 1}/{total_chunks} "
-                           f"({len(stored_chunk)} images)",
-                current_operation=f"Computing embeddings (chunk {chunk_index + 1}/{total_chunks})"
+                log_message=f"Comparing chunks: {comparison_count}/{total_comparisons} ({progress_pct}%)",
+                current_operation=f"Comparing image similarities ({progress_pct}%)"
+            )
+
+            pair_key = self._pair_key(key_i, key_j)
+            pair = checkpoint.load_pair(i, j, pair_key)
+            if pair is None:
+                if emb_i_index != i:
+                    emb_i_norm, emb_i_index = _normalized_embeddings(emb_i_path), i
+                pair = self._similar_positions(emb_i_norm, emb_j_path, same_chunk=i == j)
+                checkpoint.save_pair(i, j, pair_key, *pair)
+
+            # Convert positions within the chunks to media item indices
+            a_indices, b_indices, scores = pair
+            pairs_a.append(indices_i[a_indices])
+            pairs_b.append(indices_j[b_indices])
+            pairs_scores.append(np.asarray(scores))
+
+        # All done, the checkpoint is no longer needed
+        checkpoint.clear()
+
+        if not pairs_a:
+            return (
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0),
             )
-            detector = DuplicateImageDetector(stored_chunk, logger=self.logger, threshold=self.similarity_threshold, image_store=image_store)
-            detector._calculate_embeddings()
+        return np.concatenate(pairs_a), np.concatenate(pairs_b), np.concatenate(pairs_scores)
 
-            # Save embeddings to disk as numpy for later pairwise comparison
-            emb_np = detector.embeddings.numpy()
-            emb_path = os.path.join(embeddings_dir, f"chunk-{chunk_index}-embeddings.npy")
-            np.save(emb_path, emb_np)
+    def download_chunk(self, chunk_index: int, chunk_ids: list[str], total_chunks: int) -> dict:
+        """
+        Download the images of one chunk of a chunked detection run into its
+        checkpoint, ahead of embed_chunk, e.g. in a download_chunk subtask on
+        the I/O queue.
 
-            # Save media ids mapping
-            ids_path = os.path.join(embeddings_dir, f"chunk-{chunk_index}-ids.json")
-            with open(ids_path, "w") as f:
-                json.dump([m["id"] for m in stored_chunk], f)
+        @return status of the chunk, with the number of images stored
+        """
+        checkpoint = ProcessDuplicatesCheckpoint.for_task(
+            self.user_id, self._checkpoint_options()
+        )
+        _, stored_positions, _ = self._store_chunk_images(
+            checkpoint,
+            MediaItemsRepository(user_id=self.user_id),
+            chunk_index,
+            chunk_ids,
+            total_chunks,
+        )
+        return {"chunkIndex": chunk_index, "stored": len(stored_positions)}
 
-            # Optionally delete images to save disk (we keep embeddings)
-            try:
-                shutil.rmtree(images_dir)
-            except Exception:
-                pass
+    def embed_chunk(self, chunk_index: int, chunk_ids: list[str], total_chunks: int) -> dict:
+        """
+        Download and embed the images of one chunk of a chunked detection
+        run into its checkpoint, e.g. in an embed_chunk subtask. The
+        checkpoint must be on storage shared with the task running detection.
 
-            chunk_paths.append((chunk_index, ids_path, emb_path))
+        @return status of the chunk, with the number of media items embedded
+        """
+        checkpoint = ProcessDuplicatesCheckpoint.for_task(
+            self.user_id, self._checkpoint_options()
+        )
+        stored_positions = self._embed_chunk(
+            checkpoint,
+            MediaItemsRepository(user_id=self.user_id),
+            chunk_index,
+            chunk_ids,
+            total_chunks,
+        )
+        return {"chunkIndex": chunk_index, "embedded": len(stored_positions)}
 
-        # Now compute pairwise similarities across chunk pairs
-        from collections import defaultdict
+    def _embed_chunk(
+        self,
+        checkpoint: ProcessDuplicatesCheckpoint,
+        repo: MediaItemsRepository,
+        chunk_index: int,
+        chunk_ids: list[str],
+        total_chunks: int,
+    ) -> np.ndarray:
+        """
+        Store images for a chunk, then save their embeddings to the checkpoint.
 
-        similarity_map = defaultdict(dict)
-        total_comparisons = len(chunk_paths) * (len(chunk_paths) + 1) // 2
-        comparison_count = 0
-        
+        @return positions within the chunk of the media items embedded
+        """
         self.logger.info(
-            f"Computing pairwise similarities across {len(chunk_paths)} chunks "
-            f"({total_comparisons} comparisons)"
+            f"Processing chunk {chunk_index + 1}/{total_chunks} "
+            f"({len(chunk_ids)} items)"
         )
         self.update_meta(
-            log_message=f"Computing similarities: {len(chunk_paths)} chunks, "
-                       f"{total_comparisons} comparisons"
+            log_message=f"Processing chunk {chunk_index + 1}/{total_chunks} "
+                       f"({len(chunk_ids)} items)"
         )
 
-        for i, ids_i_path, emb_i_path in chunk_paths:
-            ids_i = json.load(open(ids_i_path))
-            # Use memory mapping for large embeddings to reduce memory usage
-            emb_i = np.load(emb_i_path, mmap_mode='r')
-            # Normalize emb_i (create a copy for normalization to avoid modifying mmap)
-            emb_i_norm = emb_i / np.linalg.norm(emb_i, axis=1, keepdims=True)
-
-            for j, ids_j_path, emb_j_path in chunk_paths:
-                # Only compute j >= i to avoid duplicating work
-                if j < i:
-                    continue
-                
-                comparison_count += 1
-                progress_pct = int((comparison_count / total_comparisons) * 100)
-                self.logger.info(
-                    f"Comparing chunks {i} vs {j} ({comparison_count}/{total_comparisons}, {progress_pct}%)"
-                )
-                self.update_meta(
-                    log_message=f"Comparing chunks: {comparison_count}/{total_comparisons} ({progress_pct}%)",
-                    current_operation=f"Comparing image similarities ({progress_pct}%)"
-                )
-                
-                ids_j = json.load(open(ids_j_path))
-                # Use memory mapping for large embeddings
-                emb_j = np.load(emb_j_path, mmap_mode='r')
-                emb_j_norm = emb_j / np.linalg.norm(emb_j, axis=1, keepdims=True)
-
-                # Vectorized cosine similarity computation
-                scores = emb_i_norm @ emb_j_norm.T
-
-                # Use vectorized operations to find pairs above threshold
-                # This is much faster than nested loops
-                above_threshold = scores >= self.similarity_threshold
-                
-                # Get indices where similarity is above threshold
-                a_indices, b_indices = np.where(above_threshold)
-                
-                # Filter out self-comparisons in same chunk
-                if i == j:
-                    mask = a_indices != b_indices
-                    a_indices = a_indices[mask]
-                    b_indices = b_indices[mask]
-                
-                # Add pairs to similarity map
-                for a_ind, b_ind in zip(a_indices, b_indices):
-                    id_a = ids_i[a_ind]
-                    id_b = ids_j[b_ind]
-                    score = float(scores[a_ind, b_ind])
-                    similarity_map[id_a][id_b] = score
-                    similarity_map[id_b][id_a] = score
-
-        # Cleanup embeddings if desired
-        try:
-            shutil.rmtree(embeddings_dir)
-        except Exception:
-            pass
-
-        return dict(similarity_map)
-
-    def _groups_from_similarity_map(self, similarity_map: dict, media_items: list[dict]) -> list:
-        """Generate groups (connected components) from the similarity map.
-
-        Returns a list of groups where each group is a list of indices into `media_items`.
+        image_store, stored_positions, stored_chunk = self._store_chunk_images(
+            checkpoint, repo, chunk_index, chunk_ids, total_chunks
+        )
+
+        chunk_key = checkpoint.chunk_key(chunk_ids)
+        stored_positions = np.array(stored_positions, dtype=np.int64)
+        if len(stored_chunk) == 0:
+            checkpoint.save_chunk(
+                chunk_index, chunk_key, stored_positions, np.zeros((0, 0))
+            )
+            return stored_positions
+
+        # Compute embeddings for this chunk
+        self.update_meta(
+            log_message=f"Computing embeddings: chunk {chunk_index + 1}/{total_chunks} "
+                       f"({len(stored_chunk)} images)",
+            current_operation=f"Computing embeddings (chunk {chunk_index + 1}/{total_chunks})"
+        )
+        detector = DuplicateImageDetector(stored_chunk, logger=self.logger, threshold=self.similarity_threshold, image_store=image_store)
+        detector._calculate_embeddings()
+
+        # Save embeddings for later pairwise comparison (this also
+        #   deletes the chunk's images; we keep embeddings)
+        checkpoint.save_chunk(
+            chunk_index, chunk_key, stored_positions, detector.embeddings.numpy()
+        )
+        return stored_positions
+
+    def _store_chunk_images(
+        self,
+        checkpoint: ProcessDuplicatesCheckpoint,
+        repo: MediaItemsRepository,
+        chunk_index: int,
+        chunk_ids: list[str],
+        total_chunks: int,
+    ) -> tuple[ImageStore, list[int], list[dict]]:
+        """
+        Store the images of a chunk in the checkpoint. Images already stored
+        (e.g. by a download_chunk subtask) aren't downloaded again.
+
+        @return the chunk's image store, and the position in the chunk and
+        {id, storageFilename} of each stored media item
+        """
+        # Images for this chunk are kept in the checkpoint (along with a
+        #   manifest of downloaded items) until its embeddings are saved
+        image_store = create_image_store(
+            resolution=self.resolution,
+            base_path=checkpoint.chunk_images_path(chunk_index),
+            download_original=self.download_original,
+            use_manifest=True,
+        )
+
+        # baseUrls are only needed to download this chunk's images, so
+        #   fetch them now rather than holding them for every media item
+        chunk_media_items = repo.get_id_map(chunk_ids)
+        # Chunks are downloaded long after media items are fetched on big
+        #   libraries, so their baseUrls may have expired by now
+        refresh_expired_base_urls(
+            self.user_id,
+            image_store.missing(list(chunk_media_items.values())),
+            self.logger,
+        )
+
+        # Store images, keeping the position in the chunk and
+        #   storageFilename of each stored media item
+        stored_positions = []
+        stored_chunk = []
+        for idx, media_item_id in enumerate(chunk_ids):
+            m = chunk_media_items.get(media_item_id)
+            if m is None:
+                # Deleted since the detection run started
+                continue
+            try:
+                if idx % 10 == 0:  # Update every 10 images
+                    processed = self.meta.get("itemsProcessed", 0) + idx
+                    self.update_meta(
+                        log_message=f"Downloading images: chunk {chunk_index + 1}/{total_chunks}, "
+                                   f"{idx + 1}/{len(chunk_ids)} images ({processed}/{self.meta.get('totalItems', 0)} total)",
+                        current_operation=f"Downloading images (chunk {chunk_index + 1}/{total_chunks})",
+                        items_processed=processed
+                    )
+                filename = image_store.store_image(m)
+                stored_positions.append(idx)
+                stored_chunk.append({"id": media_item_id, "storageFilename": filename})
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 429:
+                    # Out of baseUrl quota; every remaining download would
+                    #   fail too. Stop here, keeping the checkpoint.
+                    raise DailyLimitExceededError(
+                        f"Exceeded daily baseUrl request quota while downloading "
+                        f"images for chunk {chunk_index + 1} of {total_chunks}. "
+                        f"Restart tomorrow to resume from the last checkpoint. "
+                        f"For more details on quota usage, visit "
+                        f"https://console.cloud.google.com/apis/api/photoslibrary.googleapis.com/quotas"
+                    ) from e
+                self.logger.warning("Failed to store image for media_item %s: %s", m.get("id"), e)
+                continue
+            except Exception as e:
+                self.logger.warning("Failed to store image for media_item %s: %s", m.get("id"), e)
+                continue
+
+        if self.download_original:
+            # The stored images are the originals, so record their sizes for
+            #   reclaimableBytes rather than looking them up, see _update_sizes
+            repo.bulk_update(
+                (m["id"], {"size": image_store.image_size(m["storageFilename"])})
+                for m in stored_chunk
+            )
+
+        # Update items processed after chunk download
+        new_processed = self.meta.get("itemsProcessed", 0) + len(stored_chunk)
+        self.update_meta(items_processed=new_processed)
+
+        return image_store, stored_positions, stored_chunk
+
+    def compare_chunks(self, i: int, j: int, pair_key: str) -> dict:
+        """
+        Compare the embeddings of chunks i and j of a chunked detection run,
+        saving the similar pairs found to its checkpoint, e.g. in a
+        compare_chunks subtask.
+
+        @return status of the comparison, with the number of similar pairs
+        """
+        checkpoint = ProcessDuplicatesCheckpoint.for_task(
+            self.user_id, self._checkpoint_options()
+        )
+        pair = self._similar_positions(
+            _normalized_embeddings(checkpoint.chunk_embeddings_path(i)),
+            checkpoint.chunk_embeddings_path(j),
+            same_chunk=i == j,
+        )
+        checkpoint.save_pair(i, j, pair_key, *pair)
+        return {"chunks": [i, j], "pairs": len(pair[0])}
+
+    def _similar_positions(
+        self, emb_i_norm: np.ndarray, emb_j_path: str, same_chunk: bool
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        @return (a positions in chunk i, b positions in chunk j, scores) of
+        each pair at least similarity_threshold similar
+        """
+        emb_j_norm = _normalized_embeddings(emb_j_path)
+
+        # Vectorized cosine similarity computation
+        scores = emb_i_norm @ emb_j_norm.T
+
+        # Use vectorized operations to find pairs above threshold
+        # This is much faster than nested loops
+        above_threshold = scores >= self.similarity_threshold
+
+        # Get indices where similarity is above threshold
+        a_indices, b_indices = np.where(above_threshold)
+
+        # Filter out self-comparisons in same chunk
+        if same_chunk:
+            mask = a_indices != b_indices
+            a_indices = a_indices[mask]
+            b_indices = b_indices[mask]
+
+        return a_indices, b_indices, scores[a_indices, b_indices]
+
+    def _pair_key(self, key_i: str, key_j: str) -> str:
+        return f"{key_i}:{key_j}:{self.similarity_threshold}"
+
+    def _fans_out(self, subtask_name: str) -> bool:
+        """
+        @return whether to replace this run with subtask_name subtasks
+        """
+        return (
+            app.config.PROCESS_DUPLICATES_FAN_OUT
+            and subtask_name not in self.fanned_out
+        )
+
+    def _checkpoint_options(self) -> dict:
+        """
+        Options that determine which images and embeddings a run produces.
+        Runs with the same options share (and resume from) a checkpoint.
+        """
+        return {
+            "extensionSource": self.extension_source,
+            "pickerSource": self.picker_source,
+            "resolution": self.resolution,
+            "downloadOriginal": self.download_original,
+            "chunkSize": self.chunk_size,
+            "imageStoreBackend": app.config.IMAGE_STORE_BACKEND,
+        }
+
+    def _update_sizes(
+        self, media_items: MediaItemsTable, repo: MediaItemsRepository, groups: list
+    ) -> None:
+        """
+        Read the sizes of the originals of the media items in groups into the
+        table, looking up and recording those that aren't known yet.
+        """
+        indices = sorted({i for group in groups for i in group})
+        id_map = repo.get_id_map([media_items.id(i) for i in indices])
+        unknown = [m for m in id_map.values() if not m.get("size")]
+        if unknown:
+            sizes = fetch_original_sizes(self.user_id, unknown, self.logger)
+            repo.bulk_update((id, {"size": size}) for id, size in sizes.items())
+            for id, size in sizes.items():
+                id_map[id]["size"] = size
+        for i in indices:
+            media_item = id_map.get(media_items.id(i)) or {}
+            media_items.sizes[i] = int(media_item.get("size") or 0)
+
+    def _groups_from_pairs(
+        self, pairs: tuple[np.ndarray, np.ndarray, np.ndarray], num_media_items: int
+    ) -> list:
+        """Generate groups (connected components) from similar pairs.
+
+        Returns a list of groups where each group is a list of media item indices.
         This keeps the output consistent with `DuplicateImageDetector.calculate_groups`.
         """
-        # Union-Find (Disjoint Set) to build connected components
-        parent = {}
+        # Union-Find (Disjoint Set) over media item indices
+        parent = np.arange(num_media_items)
 
         def find(x):
-            parent.setdefault(x, x)
-            if parent[x] != x:
-                parent[x] = find(parent[x])
-            return parent[x]
-
-        def union(a, b):
+            root = x
+            while parent[root] != root:
+                root = parent[root]
+            # Path compression
+            while parent[x] != root:
+                parent[x], x = root, parent[x]
+            return root
+
+        a_indices, b_indices, _ = pairs
+        for a, b in zip(a_indices.tolist(), b_indices.tolist()):
             ra, rb = find(a), find(b)
             if ra != rb:
                 parent[rb] = ra
 
-        # Map media ids to indices
-        media_id_to_index = {m["id"]: idx for idx, m in enumerate(media_items)}
-
-        for a, neigh in similarity_map.items():
-            if a not in media_id_to_index:
-                continue
-            for b in neigh.keys():
-                if b not in media_id_to_index:
-                    continue
-                union(media_id_to_index[a], media_id_to_index[b])
-
         groups_map = {}
-        for node in parent.keys():
-            root = find(node)
-            groups_map.setdefault(root, []).append(node)
+        for node in np.unique(np.concatenate([a_indices, b_indices])).tolist():
+            groups_map.setdefault(find(node), []).append(node)
 
         # Filter groups with at least 2 members and return lists of indices
         groups = []
@@ -485,7 +821,8 @@ class ProcessDuplicatesTask:
         total_items=None,
     ):
         """
-        Update local meta, then call celery method to update task state.
+        Update local meta, then publish it as the task state. Updates other
+        than step transitions may be coalesced, see ProgressPublisher.
         """
         if log_message:
             self.meta["logMessage"] = log_message
@@ -506,12 +843,23 @@ class ProcessDuplicatesTask:
             if count:
                 self.meta["steps"][complete_step_name]["count"] = count
 
+        self.progress.update(
+            self.meta, force=bool(start_step_name or complete_step_name)
+        )
+
+    def flush_meta(self) -> None:
+        """
+        Publish any coalesced meta update. Call once the task is done.
+        """
+        self.progress.flush()
+
+    def _publish_meta(self, meta: dict) -> None:
         self.task.update_state(
             # If we don't pass a state, it gets updated to blank.
             # Let's use PROGRESS to differentiate from PENDING.
             state="PROGRESS",
             # `meta` field comes through as the `info` field on task async result.
-            meta={"meta": self.meta},
+            meta={"meta": meta},
         )
 
     def get_meta(self):
@@ -543,86 +891,95 @@ class ProcessDuplicatesTask:
         # When chunked processing is enabled, we'll not schedule the usual
         # store_images subtasks for the full dataset upfront. Chunked
         # processing stores images per-chunk in temporary directories.
-        if self.chunk_size:
-            # Just record fetched ids; chunked stage will handle storing
-            # and processing later.
-            self.subtasks.append(Subtask(Subtask.Type.STORE_IMAGES, None))
-        else:
-            import app.tasks
-            store_images_result = app.tasks.store_images.delay(
-                self.user_id,
-                media_item_ids,
-                self.resolution,
-                download_original=self.download_original,
-                image_store_path=self.image_store_path,
-                chunk_size=self.chunk_size,
-            )
-            self.subtasks.append(Subtask(Subtask.Type.STORE_IMAGES, store_images_result))
+        if not self.chunk_size:
+            self.store_images_batches.append(media_item_ids)
 
         self.fetched_media_item_ids = []
 
-        self.fetched_media_item_ids = []
+    def _store_images_then_detect_duplicates(self):
+        """
+        Replace this task with a store_images subtask per batch of fetched
+        media items, followed by duplicate detection.
+        """
+        import app.tasks
+
+        num_media_items = sum(len(batch) for batch in self.store_images_batches)
+        self.update_meta(
+            log_message=(
+                f"Storing images for {num_media_items} media items in "
+                f"{len(self.store_images_batches)} subtasks..."
+            ),
+            current_operation="Storing images",
+        )
+        self._replace_with_subtasks(
+            "store_images",
+            [
+                app.tasks.store_images.s(
+                    self.user_id,
+                    media_item_ids,
+                    self.resolution,
+                    download_original=self.download_original,
+                    image_store_path=self.image_store_path,
+                    chunk_size=self.chunk_size,
+                )
+                for media_item_ids in self.store_images_batches
+            ],
+        )
 
-    def _await_subtask_completion(self):
+    def _replace_with_subtasks(
+        self, subtask_name: str, subtasks: list[celery.Signature]
+    ) -> NoReturn:
         """
-        Wait for all subtasks to complete.
+        Replace this task with a chord of subtasks followed by
+        detect_duplicates. The result backend counts the subtasks as they
+        finish, and starts detect_duplicates with their statuses as soon as the
+        last one does, so no worker waits on them. detect_duplicates takes over
+        this task's id, so its progress and result are this task's.
+
+        Raises celery.exceptions.Ignore once the chord is started.
         """
-        # If chunked processing is enabled, we don't create actual store image
-        # subtasks for the whole dataset; skip waiting in that case.
-        if self.chunk_size:
-            return
+        import app.tasks
 
-        while True:
-            subtask_classes = {s.type.name for s in self.subtasks}
-            subtask_results = [s.result for s in self.subtasks]
-            num_completed = [r.ready() for r in subtask_results].count(True)
-            num_successful = [r.successful() for r in subtask_results].count(True)
-            failed_subtasks = [s for s in self.subtasks if s.result.failed()]
-            num_failed = len(failed_subtasks)
-            num_total = len(self.subtasks)
-
-            if num_failed > 0:
-                self.logger.error(f"{num_failed} subtasks failed")
-                subtask_errors = [
-                    s.result.get(disable_sync_subtasks=False, propagate=False)
-                    for s in failed_subtasks
-                ]
-                from app.lib.google_api_client import InsufficientScopesError
+        self.flush_meta()
+        workflow = celery.chord(
+            subtasks,
+            app.tasks.detect_duplicates.s(
+                self.user_id,
+                subtask_name=subtask_name,
+                meta=self.get_meta(),
+                **self._continuation_options(),
+            ),
+        )
+        self.task.replace(workflow)
+        # replace raises Ignore itself, unless the task is run eagerly
+        raise Ignore("Replaced by subtasks")
 
-                if any(
-                    isinstance(e, InsufficientScopesError)
-                    for e in subtask_errors
-                ):
-                    # If any subtask failed due to insufficient scopes, surface that
-                    self.logger.error("Subtask failed due to insufficient scopes")
-                    raise InsufficientScopesError("One or more subtasks failed due to insufficient authentication scopes")
-
-                if any(
-                    isinstance(e, requests.exceptions.HTTPError)
-                    and "429 Client Error" in str(e)
-                    for e in subtask_errors
-                ):
-                    raise DailyLimitExceededError(
-                        f"Successfully completed {num_successful} of {num_completed} "
-                        f"subtasks to store images before exceeding daily baseUrl "
-                        f"request quota. Restart tomorrow to resume. "
-                        f"For more details on quota usage, visit "
-                        f"https://console.cloud.google.com/apis/api/photoslibrary.googleapis.com/quotas"
-                    )
-                else:
-                    raise SubtasksFailedError(
-                        f"{num_failed} of {num_total} subtasks failed. "
-                        f"View {app.config.CELERY_WORKER_LOG_PATH} for more details. "
-                        f"Restart to try again."
-                    )
+    def _continuation_options(self) -> dict:
+        """
+        Options subtasks and detect_duplicates need to carry on this run.
+        """
+        return {
+            "extension_source": self.extension_source,
+            "picker_source": self.picker_source,
+            "resolution": self.resolution,
+            "similarity_threshold": self.similarity_threshold,
+            "download_original": self.download_original,
+            "image_store_path": self.image_store_path,
+            "chunk_size": self.chunk_size,
+        }
 
-            if num_completed == num_total:
-                # All done.
-                break
-            else:
-                message = (
-                    f"Waiting for {', '.join(subtask_classes)} subtasks to complete... "
-                    f"({num_completed} / {num_total})"
-                )
-                self.logger.info(message)
-                time.sleep(app.config.PROCESS_DUPLICATE_SUBTASK_POLL_INTERVAL)
+    def _complete_fetch_step(self, media_items_count: int):
+        self.meta["totalItems"] = media_items_count
+        self.complete_step(Steps.FETCH_MEDIA_ITEMS, count=media_items_count)
+        self.update_meta(log_message=f"Fetched {media_items_count} media items. Starting duplicate detection...")
+        self.start_step(Steps.PROCESS_DUPLICATES)
+
+
+def _normalized_embeddings(path: str) -> np.ndarray:
+    """
+    @return embeddings saved at path, scaled to unit length
+    """
+    # Use memory mapping for large embeddings to reduce memory usage
+    embeddings = np.load(path, mmap_mode="r")
+    # Normalizing creates a copy, leaving the mmap unmodified
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
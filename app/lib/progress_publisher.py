@@ -0,0 +1,75 @@
+import threading
+import time
+from typing import Callable
+
+
+class ProgressPublisher:
+    """
+    Coalesces progress updates of a task, so that frequent updates (e.g. one
+    per log line) become at most one write to the result backend every
+    `min_interval` seconds.
+
+    Updates are written immediately when forced (e.g. on step transitions)
+    or when `min_interval` has passed since the last write. Otherwise the
+    latest update is held until the next update that may be written, or
+    `flush`, which must be called once the task is done.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[dict], None],
+        min_interval: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.publish = publish
+        self.min_interval = min_interval
+        self.clock = clock
+
+        self.num_updates = 0
+        self.num_writes = 0
+        self._pending = None
+        self._last_write = None
+        # Reentrant, in case publishing logs to a handler that updates progress
+        self._lock = threading.RLock()
+
+    @property
+    def num_saved_writes(self) -> int:
+        """
+        @return number of updates that didn't need their own write
+        """
+        return self.num_updates - self.num_writes
+
+    def update(self, meta: dict, force: bool = False) -> bool:
+        """
+        @return whether the update was written
+        """
+        with self._lock:
+            self.num_updates += 1
+            self._pending = meta
+            now = self.clock()
+            if (
+                force
+                or self._last_write is None
+                or now - self._last_write >= self.min_interval
+            ):
+                self._write(now)
+                return True
+            return False
+
+    def flush(self) -> bool:
+        """
+        Write the latest update, if it hasn't been yet.
+
+        @return whether an update was written
+        """
+        with self._lock:
+            if self._pending is None:
+                return False
+            self._write(self.clock())
+            return True
+
+    def _write(self, now: float) -> None:
+        meta, self._pending = self._pending, None
+        self.publish(meta)
+        self.num_writes += 1
+        self._last_write = now
@@ -0,0 +1,58 @@
+import threading
+import time
+from typing import Callable
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how often an API is called, shared by the threads
+    of a process. Up to `burst` calls may be made at once, then `rate` calls
+    per second on average.
+
+    Limits are per process, so the rate across every worker process is at most
+    `rate` times the number of processes.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        @param rate calls per second, or 0 for no limit
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+
+        self._tokens = float(burst)
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Wait until a call may be made.
+
+        @return seconds waited
+        """
+        if not self.rate:
+            return 0.0
+
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            # Take the token now, even if it's only available after waiting,
+            #   so callers queue up behind each other rather than all waking
+            #   for the same token
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait:
+            self.sleep(wait)
+        return wait
@@ -0,0 +1,80 @@
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+import redis
+from app import config
+
+_lock = threading.Lock()
+_client: Optional[redis.Redis] = None
+
+# Deletes the lock only if it's still ours, i.e. it didn't expire and get
+#   acquired by someone else meanwhile
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def get_client() -> Optional[redis.Redis]:
+    """
+    @return the shared Redis client, or None when REDIS_HOST isn't configured
+    """
+    global _client
+
+    if not config.REDIS_HOST:
+        return None
+    with _lock:
+        if _client is None:
+            _client = redis.Redis.from_url(f"redis://{config.REDIS_HOST}")
+        return _client
+
+
+class RedisLock:
+    """
+    Lock shared by every process using the same Redis, held for at most
+    `ttl_seconds` in case its holder dies before releasing it.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        key: str,
+        ttl_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.client = client
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.token = uuid.uuid4().hex
+
+    def acquire(self) -> bool:
+        """
+        @return whether the lock was acquired, without waiting
+        """
+        return bool(
+            self.client.set(
+                self.key, self.token, nx=True, px=int(self.ttl_seconds * 1000)
+            )
+        )
+
+    def release(self) -> None:
+        self.client.eval(RELEASE_SCRIPT, 1, self.key, self.token)
+
+    def wait_released(self, timeout: float, poll_interval: float) -> bool:
+        """
+        Wait for whoever holds the lock to release it.
+
+        @return whether it was released within `timeout` seconds
+        """
+        deadline = self.clock() + timeout
+        while self.client.exists(self.key):
+            if self.clock() >= deadline:
+                return False
+            self.sleep(poll_interval)
+        return True
@@ -0,0 +1,114 @@
+import gzip
+import typing as t
+import flask
+from flask.json.provider import DefaultJSONProvider
+from app import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content types worth compressing, the rest (e.g. images) already are
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain", "text/css"}
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes with orjson when it's installed, and
+    otherwise falls back to the standard library like DefaultJSONProvider.
+
+    Output matches DefaultJSONProvider's apart from whitespace and escaping
+    (orjson writes UTF-8 rather than ASCII escapes): keys are sorted, and
+    dates and other types it doesn't know are encoded by `default`.
+    """
+
+    def dumps(self, obj: t.Any, **kwargs: t.Any) -> str:
+        if orjson is None or not self._orjson_compatible(kwargs):
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj, **kwargs).decode()
+
+    def response(self, *args: t.Any, **kwargs: t.Any) -> flask.Response:
+        if orjson is None:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        dump_args = {}
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            dump_args["indent"] = 2
+        # Skip decoding to str and encoding back to bytes
+        return self._app.response_class(
+            self._orjson_dumps(obj, **dump_args) + b"\n", mimetype=self.mimetype
+        )
+
+    def _orjson_compatible(self, kwargs: dict) -> bool:
+        """
+        @return whether orjson supports every json.dumps option in kwargs
+        """
+        return set(kwargs) <= {"default", "sort_keys", "indent", "separators"} and (
+            kwargs.get("indent") in (None, 2)
+        )
+
+    def _orjson_dumps(self, obj: t.Any, **kwargs: t.Any) -> bytes:
+        option = (
+            orjson.OPT_NON_STR_KEYS
+            # Encode dates like DefaultJSONProvider (HTTP dates), not ISO 8601
+            | orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_SERIALIZE_NUMPY
+        )
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option)
+
+
+def compress_response(response: flask.Response) -> flask.Response:
+    """
+    after_request handler compressing large enough responses with brotli
+    (when installed) or gzip, whichever the client accepts and prefers.
+
+    A strong ETag gets the encoding appended, since the compressed body is a
+    different representation. Requests revalidating that ETag get a 304
+    without compressing the body again.
+    """
+    response.vary.add("Accept-Encoding")
+
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+
+    encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+    encoding = flask.request.accept_encodings.best_match(encodings)
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if len(body) < config.RESPONSE_COMPRESSION_MIN_BYTES:
+        return response
+
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        etag = f"{etag}-{encoding}"
+        response.set_etag(etag)
+        if etag in flask.request.if_none_match:
+            return response.make_conditional(flask.request)
+
+    if encoding == "br":
+        body = brotli.compress(body, quality=config.BROTLI_COMPRESSION_QUALITY)
+    else:
+        body = gzip.compress(body, compresslevel=config.GZIP_COMPRESSION_LEVEL)
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    return response
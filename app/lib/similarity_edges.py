@@ -0,0 +1,137 @@
+from typing import Callable, Iterable, Mapping
+import numpy as np
+
+# Scores are stored as integers out of SCORE_SCALE, which fits in a uint16
+SCORE_SCALE = 10_000
+
+
+class SimilarityEdges:
+    """
+    Compact form of a similarity map. Instead of a dict of dicts keyed by
+    media item ids, with each pair in both directions, media item ids are
+    stored once in an id table, and each similar pair once as the indices
+    (i < j) of its media items in the table and its quantised score.
+
+    The JSON form is {"ids", "i", "j", "scores", "scoreScale"}, where the
+    similarity of ids[i[k]] and ids[j[k]] is scores[k] / scoreScale.
+    """
+
+    def __init__(self, ids: list[str], i: np.ndarray, j: np.ndarray, scores: np.ndarray):
+        self.ids = ids
+        self.i = i
+        self.j = j
+        self.scores = scores
+
+    @classmethod
+    def from_pairs(
+        cls,
+        pairs: tuple[np.ndarray, np.ndarray, np.ndarray],
+        id_of: Callable[[int], str],
+    ) -> "SimilarityEdges":
+        """
+        @param pairs (a, b, scores) arrays of similar pairs, by any integer
+        index (e.g. in a MediaItemsTable)
+        @param id_of media item id of an index in pairs
+        """
+        a, b, scores = _canonical_pairs(*pairs)
+        # Only media items in a pair need to be in the id table
+        indices, inverse = np.unique(np.concatenate([a, b]), return_inverse=True)
+        return cls(
+            [id_of(int(index)) for index in indices],
+            inverse[: len(a)].astype(np.uint32),
+            inverse[len(a) :].astype(np.uint32),
+            _quantise(scores),
+        )
+
+    @classmethod
+    def from_id_pairs(cls, id_pairs: Iterable[tuple[str, str, float]]) -> "SimilarityEdges":
+        """
+        @param id_pairs (media_item_id1, media_item_id2, score) of similar
+        pairs, in either or both directions
+        """
+        index_of = {}
+        a, b, scores = [], [], []
+        for id_a, id_b, score in id_pairs:
+            a.append(index_of.setdefault(id_a, len(index_of)))
+            b.append(index_of.setdefault(id_b, len(index_of)))
+            scores.append(score)
+
+        a, b, scores = _canonical_pairs(
+            np.array(a, dtype=np.int64), np.array(b, dtype=np.int64), np.array(scores)
+        )
+        return cls(
+            list(index_of),
+            a.astype(np.uint32),
+            b.astype(np.uint32),
+            _quantise(scores),
+        )
+
+    @classmethod
+    def from_similarity_map(cls, similarity_map: Mapping) -> "SimilarityEdges":
+        """
+        @param similarity_map dict of dict[media_item_id1][media_item_id2] = score
+        """
+        return cls.from_id_pairs(
+            (id_a, id_b, score)
+            for id_a, scores in similarity_map.items()
+            for id_b, score in scores.items()
+        )
+
+    @classmethod
+    def from_json(cls, data: Mapping) -> "SimilarityEdges":
+        scores = np.array(data["scores"], dtype=np.float64)
+        if data.get("scoreScale", SCORE_SCALE) != SCORE_SCALE:
+            scores = scores * SCORE_SCALE / data["scoreScale"]
+        return cls(
+            list(data["ids"]),
+            np.array(data["i"], dtype=np.uint32),
+            np.array(data["j"], dtype=np.uint32),
+            np.rint(scores).astype(np.uint16),
+        )
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def id_pairs(self) -> Iterable[tuple[str, str, float]]:
+        """
+        @return (media_item_id1, media_item_id2, score) of each similar pair
+        """
+        for i, j, score in zip(self.i.tolist(), self.j.tolist(), self.scores.tolist()):
+            yield self.ids[i], self.ids[j], score / SCORE_SCALE
+
+    def to_json(self) -> dict:
+        return {
+            "ids": self.ids,
+            "i": self.i.tolist(),
+            "j": self.j.tolist(),
+            "scores": self.scores.tolist(),
+            "scoreScale": SCORE_SCALE,
+        }
+
+    def to_similarity_map(self) -> dict:
+        """
+        @return dict of dict[media_item_id1][media_item_id2] = score
+        """
+        similarity_map = {}
+        for id_a, id_b, score in self.id_pairs():
+            similarity_map.setdefault(id_a, {})[id_b] = score
+            similarity_map.setdefault(id_b, {})[id_a] = score
+        return similarity_map
+
+
+def _canonical_pairs(
+    a: np.ndarray, b: np.ndarray, scores: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    @return pairs ordered so a < b, without self pairs or repeats
+    """
+    a, b = np.minimum(a, b), np.maximum(a, b)
+    keep = a != b
+    a, b, scores = a[keep], b[keep], scores[keep]
+    _, first = np.unique(np.stack([a, b]), axis=1, return_index=True)
+    first.sort()
+    return a[first], b[first], scores[first]
+
+
+def _quantise(scores: np.ndarray) -> np.ndarray:
+    return np.rint(np.clip(scores, 0, 1) * SCORE_SCALE).astype(np.uint16)
@@ -2,7 +2,8 @@ import logging
 import time
 from typing import Optional
 
-from app.lib.media_items_image_store import MediaItemsImageStore
+import app.config
+from app.lib.image_stores import create_image_store
 from app.models.media_items_repository import MediaItemsRepository
 
 
@@ -34,9 +35,12 @@ class StoreImagesTask:
             image_store_args["base_path"] = image_store_path
         if download_original:
             image_store_args["download_original"] = True
-        self.image_store = MediaItemsImageStore(**image_store_args)
+        self.image_store = create_image_store(**image_store_args)
 
-    def run(self):
+    def run(self) -> dict:
+        """
+        @return counts of media items whose images were stored and failed
+        """
         media_item_id_map = self.repo.get_id_map(self.media_item_ids)
 
         # If any media items are missing from the local repo, attempt to fetch
@@ -50,14 +54,14 @@ class StoreImagesTask:
 
                 client = GooglePhotosClient.from_user_id(self.user_id, logger=self.logger)
                 fetched_map = client.get_media_items_by_ids(missing_ids)
-                for mid, media_item in fetched_map.items():
-                    self.repo.create_or_update(
-                        media_item
-                        | {
-                            "fetchedAt": __import__("datetime").datetime.now().astimezone(),
-                            "deletedAt": None,
-                        }
-                    )
+                self.repo.bulk_create_or_update(
+                    media_item
+                    | {
+                        "fetchedAt": __import__("datetime").datetime.now().astimezone(),
+                        "deletedAt": None,
+                    }
+                    for media_item in fetched_map.values()
+                )
                 # Rebuild id map to include newly fetched items
                 media_item_id_map = self.repo.get_id_map(self.media_item_ids)
             except ValueError as e:
@@ -65,7 +69,7 @@ class StoreImagesTask:
                 raise
             except InsufficientScopesError as e:
                 self.logger.error("Insufficient scopes for user %s: %s", self.user_id, e)
-                # Re-raise so caller (_await_subtask_completion or run) can handle
+                # Re-raise so the store_images task can report it
                 raise
             except Exception as e:
                 self.logger.error("Error fetching missing media items for user %s: %s", self.user_id, e)
@@ -75,12 +79,38 @@ class StoreImagesTask:
         num_total = len(self.media_item_ids)
         last_log_time = time.time()
 
+        missing_media_items = self.image_store.missing(
+            [media_item_id_map[i] for i in self.media_item_ids if i in media_item_id_map]
+        )
+        num_missing = len(missing_media_items)
+
+        # Import here to avoid circular imports at module load
+        from app.lib.google_photos_client import refresh_expired_base_urls
+
+        # Refresh expired baseUrls in bulk up front, rather than letting each
+        #   download fail, retry, and delete the media item
+        refresh_expired_base_urls(self.user_id, missing_media_items, self.logger)
+
+        self.logger.info(
+            f"Downloading images for {num_missing} of {num_total} media items"
+        )
+
+        # Write storageFilenames in bulk rather than one update per image
+        pending_updates = []
+        failed_ids = []
+
         for media_item_id in self.media_item_ids:
             media_item = media_item_id_map[media_item_id]
 
             try:
                 storage_filename = self.image_store.store_image(media_item)
-                self.repo.update(media_item_id, {"storageFilename": storage_filename})
+                attributes = {"storageFilename": storage_filename}
+                if self.download_original:
+                    # Counted towards the bytes duplicates take up. Otherwise
+                    #   the stored image is a thumbnail, and the original's
+                    #   size is looked up for duplicates only.
+                    attributes["size"] = self.image_store.image_size(storage_filename)
+                pending_updates.append((media_item_id, attributes))
             except Exception as error:
                 # Displaying and processing mediaItems requires we have an actual
                 #   image file to work with (referenced by storageFilename). If
@@ -92,10 +122,14 @@ class StoreImagesTask:
                     f"Received {error} storing image, deleting mediaItem\n"
                     f"media_item: {media_item}\n"
                 )
-                self.repo.delete([media_item_id])
+                failed_ids.append(media_item_id)
 
             num_completed += 1
 
+            if len(pending_updates) >= app.config.MEDIA_ITEMS_BULK_WRITE_BATCH_SIZE:
+                self.repo.bulk_update(pending_updates)
+                pending_updates = []
+
             # Log every 3 seconds
             if last_log_time < time.time() - 3:
                 self.logger.info(
@@ -103,4 +137,11 @@ class StoreImagesTask:
                 )
                 last_log_time = time.time()
 
+        if pending_updates:
+            self.repo.bulk_update(pending_updates)
+        if failed_ids:
+            self.repo.delete(failed_ids)
+
         self.logger.info(f"Done storing images for {num_total} media items")
+
+        return {"stored": num_total - len(failed_ids), "failed": len(failed_ids)}
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+from app.lib import redis_lock
+
+
+class TaskResultsCache:
+    """
+    In-process LRU cache of rendered task results responses, so repeated
+    requests for a finished task's results don't redo the Mongo lookups and
+    JSON encoding. Each entry has a strong ETag derived from its body.
+
+    Entries are per user and keyed on the user's version (see `version`),
+    which `invalidate` bumps in Redis whenever something they render changes
+    (e.g. a media item is marked deleted), so every server process sees it.
+    """
+
+    VERSION_KEY_FORMAT = "task_results_version:{user_id}"
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[bytes, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def version(self, user_id: str) -> Optional[bytes]:
+        """
+        @return the version of the user's results shared by every process, or
+            None when Redis isn't configured, for `get` and `set` keys to
+            include
+        """
+        client = redis_lock.get_client()
+        if client is None:
+            return None
+        return client.get(self.VERSION_KEY_FORMAT.format(user_id=user_id))
+
+    def get(self, user_id: str, key: Hashable) -> Optional[tuple[bytes, str]]:
+        """
+        @return (body, etag) of a cached response, or None
+        """
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is not None:
+                self._entries.move_to_end((user_id, key))
+            return entry
+
+    def set(self, user_id: str, key: Hashable, body: bytes) -> str:
+        """
+        @return the etag of the cached response
+        """
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        with self._lock:
+            self._entries[(user_id, key)] = (body, etag)
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+    def invalidate(self, user_id: str) -> None:
+        client = redis_lock.get_client()
+        if client is not None:
+            # Other processes only see the version change
+            client.incr(self.VERSION_KEY_FORMAT.format(user_id=user_id))
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[entry_key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -1,5 +1,4 @@
-import pymongo
-from app import config
+from app.models import mongo_client
 
 
 class CredentialsRepository:
@@ -11,6 +10,7 @@ class CredentialsRepository:
         "token",
         "refresh_token",
         "scopes",
+        "expiry",
     ]
 
     def __init__(self, user_id: str):
@@ -19,8 +19,7 @@ class CredentialsRepository:
 
         self.user_id = user_id
 
-        client = pymongo.MongoClient(config.MONGODB_URI)
-        self.db = client[config.DATABASE]
+        self.db = mongo_client.get_database()
         self.collection = self.db.credentials
 
     def get(self):
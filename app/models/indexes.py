@@ -0,0 +1,288 @@
+import argparse
+import logging
+import sys
+from typing import Optional
+import pymongo
+import pymongo.database
+from pymongo import IndexModel
+from app.models import mongo_client
+
+# Indexes for every query shape the repositories and server.py run. Every
+#   query is scoped to a user, so userId leads each compound index.
+INDEXES = {
+    "media_items": [
+        # get_id_map, update, delete, sync_media_items and the create_or_update
+        #   upserts
+        IndexModel(
+            [("userId", pymongo.ASCENDING), ("id", pymongo.ASCENDING)],
+            unique=True,
+            name="media_items_user_id_id_idx",
+        ),
+        # all and detection_media_items (in listing order), count, all_ids and
+        #   delete_unsynced
+        IndexModel(
+            [("userId", pymongo.ASCENDING), ("syncPosition", pymongo.ASCENDING)],
+            name="media_items_user_id_sync_position_idx",
+        ),
+        # Recent media items
+        IndexModel(
+            [("userId", pymongo.ASCENDING), ("fetchedAt", pymongo.ASCENDING)],
+            name="media_items_user_id_fetched_at_idx",
+        ),
+        # Extension and picker photo counts and selection
+        IndexModel(
+            [("userId", pymongo.ASCENDING), ("extensionSource", pymongo.ASCENDING)],
+            name="media_items_user_id_extension_source_idx",
+        ),
+        IndexModel(
+            [("userId", pymongo.ASCENDING), ("pickerSource", pymongo.ASCENDING)],
+            name="media_items_user_id_picker_source_idx",
+        ),
+    ],
+    "media_item_counts": [
+        IndexModel(
+            [("userId", pymongo.ASCENDING), ("source", pymongo.ASCENDING)],
+            unique=True,
+            name="media_item_counts_user_id_source_idx",
+        ),
+    ],
+    "task_results": [
+        IndexModel(
+            [("userId", pymongo.ASCENDING), ("taskId", pymongo.ASCENDING)],
+            unique=True,
+            name="task_results_user_id_task_id_idx",
+        ),
+    ],
+    "task_result_groups": [
+        IndexModel(
+            [
+                ("userId", pymongo.ASCENDING),
+                ("taskId", pymongo.ASCENDING),
+                ("position", pymongo.ASCENDING),
+            ],
+            unique=True,
+            name="task_result_groups_user_id_task_id_position_idx",
+        ),
+        # Pages of groups sorted by size or reclaimable bytes (groups_page)
+        IndexModel(
+            [
+                ("userId", pymongo.ASCENDING),
+                ("taskId", pymongo.ASCENDING),
+                ("size", pymongo.DESCENDING),
+                ("position", pymongo.ASCENDING),
+            ],
+            name="task_result_groups_user_id_task_id_size_idx",
+        ),
+        IndexModel(
+            [
+                ("userId", pymongo.ASCENDING),
+                ("taskId", pymongo.ASCENDING),
+                ("reclaimableBytes", pymongo.DESCENDING),
+                ("position", pymongo.ASCENDING),
+            ],
+            name="task_result_groups_user_id_task_id_reclaimable_bytes_idx",
+        ),
+    ],
+    "task_result_edges": [
+        IndexModel(
+            [
+                ("userId", pymongo.ASCENDING),
+                ("taskId", pymongo.ASCENDING),
+                ("a", pymongo.ASCENDING),
+                ("b", pymongo.ASCENDING),
+            ],
+            name="task_result_edges_user_id_task_id_a_b_idx",
+        ),
+    ],
+    "credentials": [
+        IndexModel(
+            [("userId", pymongo.ASCENDING)],
+            unique=True,
+            name="credentials_user_id_idx",
+        ),
+    ],
+}
+
+# Indexes created by earlier versions. They're on `user_id`, which no query
+#   uses, and the unique one wrongly prevents two users sharing a media item id.
+LEGACY_INDEXES = {
+    "media_items": ["media_items_id_user_id_idx", "media_items_user_id_idx"],
+}
+
+# (collection, filter, sort) for each query the repositories and server.py
+#   run, checked by verify_query_plans
+QUERY_SHAPES = {
+    "media_items.get_id_map": (
+        "media_items",
+        {"id": {"$in": ["id1", "id2"]}, "userId": "user"},
+        None,
+    ),
+    "media_items.update": ("media_items", {"id": "id1", "userId": "user"}, None),
+    "media_items.delete_unsynced": (
+        "media_items",
+        {"userId": "user", "syncGeneration": {"$ne": "generation"}},
+        None,
+    ),
+    "media_items.all": ("media_items", {"userId": "user"}, [("syncPosition", 1)]),
+    "media_items.recent": (
+        "media_items",
+        {"userId": "user", "storageFilename": {"$exists": True}},
+        [("fetchedAt", -1)],
+    ),
+    "media_items.extension_source": (
+        "media_items",
+        {"userId": "user", "extensionSource": True},
+        None,
+    ),
+    "media_items.picker_source": (
+        "media_items",
+        {"userId": "user", "pickerSource": True},
+        None,
+    ),
+    "media_items.detection": (
+        "media_items",
+        {"userId": "user", "mediaMetadata.video": {"$exists": False}},
+        [("syncPosition", 1)],
+    ),
+    "media_items.detection_extension_source": (
+        "media_items",
+        {
+            "userId": "user",
+            "mediaMetadata.video": {"$exists": False},
+            "extensionSource": True,
+        },
+        [("syncPosition", 1)],
+    ),
+    "media_item_counts.source_count": (
+        "media_item_counts",
+        {"userId": "user", "source": "extensionSource"},
+        None,
+    ),
+    "task_results.get": ("task_results", {"taskId": "task", "userId": "user"}, None),
+    "task_result_groups.groups": (
+        "task_result_groups",
+        {"taskId": "task", "userId": "user"},
+        [("position", 1)],
+    ),
+    "task_result_groups.groups_page_by_size": (
+        "task_result_groups",
+        {
+            "taskId": "task",
+            "userId": "user",
+            "$or": [{"size": {"$lt": 3}}, {"size": 3, "position": {"$gt": 10}}],
+        },
+        [("size", -1), ("position", 1)],
+    ),
+    "task_result_groups.groups_page_by_reclaimable_bytes": (
+        "task_result_groups",
+        {"taskId": "task", "userId": "user"},
+        [("reclaimableBytes", -1), ("position", 1)],
+    ),
+    "task_result_edges.similarity_map": (
+        "task_result_edges",
+        {
+            "taskId": "task",
+            "userId": "user",
+            "a": {"$in": ["id1", "id2"]},
+            "b": {"$in": ["id1", "id2"]},
+        },
+        None,
+    ),
+    "credentials.get": ("credentials", {"userId": "user"}, None),
+}
+
+
+def ensure_indexes(db: Optional[pymongo.database.Database] = None) -> dict:
+    """
+    Create any missing indexes in INDEXES and drop LEGACY_INDEXES. Safe to run
+    repeatedly, e.g. on every deploy.
+
+    @return names of the indexes created and dropped, per collection
+    """
+    db = db if db is not None else mongo_client.get_database()
+    summary = {}
+
+    for collection_name, index_models in INDEXES.items():
+        collection = db[collection_name]
+        existing = collection.index_information()
+
+        dropped = []
+        for name in LEGACY_INDEXES.get(collection_name, []):
+            if name in existing:
+                collection.drop_index(name)
+                dropped.append(name)
+                logging.info(f"Dropped legacy index {collection_name}.{name}")
+
+        missing = [m for m in index_models if m.document["name"] not in existing]
+        created = collection.create_indexes(missing) if missing else []
+        for name in created:
+            logging.info(f"Created index {collection_name}.{name}")
+
+        summary[collection_name] = {"created": created, "dropped": dropped}
+
+    return summary
+
+
+def verify_query_plans(db: Optional[pymongo.database.Database] = None) -> dict:
+    """
+    Explain each query in QUERY_SHAPES.
+
+    @return the stages of each query's winning plan that scan a whole
+    collection (COLLSCAN), keyed by query name. Empty if every query uses an
+    index.
+    """
+    db = db if db is not None else mongo_client.get_database()
+    failures = {}
+
+    for query_name, (collection_name, filter, sort) in QUERY_SHAPES.items():
+        cursor = db[collection_name].find(filter)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()["queryPlanner"]["winningPlan"]
+
+        stages = _plan_stages(winning_plan)
+        logging.info(f"Query plan for {query_name}: {' <- '.join(stages)}")
+        if "COLLSCAN" in stages:
+            failures[query_name] = stages
+
+    return failures
+
+
+def _plan_stages(plan: dict) -> list[str]:
+    """
+    @return stage names of a query plan, from the root down
+    """
+    stages = [plan["stage"]] if "stage" in plan else []
+    children = plan.get("inputStages", [])
+    if "inputStage" in plan:
+        children = [plan["inputStage"]] + children
+    # Newer servers wrap the classic plan, e.g. in slot-based execution
+    if "queryPlan" in plan:
+        children = [plan["queryPlan"]] + children
+    for child in children:
+        stages += _plan_stages(child)
+    return stages
+
+
+if __name__ == "__main__":
+    # Create indexes, e.g. at deploy time:
+    #   python -m app.models.indexes
+    # Then check that every repository query uses an index:
+    #   python -m app.models.indexes --verify
+    parser = argparse.ArgumentParser(description="Manage MongoDB indexes")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Fail if any repository query does a collection scan",
+    )
+    cli_args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(ensure_indexes())
+
+    if cli_args.verify:
+        collection_scans = verify_query_plans()
+        if collection_scans:
+            print(f"Queries doing a collection scan: {collection_scans}")
+            sys.exit(1)
+        print("All queries use an index")
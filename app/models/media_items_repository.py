@@ -1,11 +1,17 @@
 # import pprint
 # import json
+import hashlib
+import json
 import logging
 import os
-from typing import Union
+from itertools import islice
+from typing import Iterable, Iterator, Mapping, Optional, Union
 import pymongo
+from bson.codec_options import CodecOptions
 from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
 from app import config
+from app.models import indexes, mongo_client
 
 
 class MediaItemsRepository:
@@ -22,12 +28,38 @@ class MediaItemsRepository:
         "productUrl",
         "baseUrl",
         "storageFilename",  # Locally stored filename per MediaItemsImageStore
-        "size",  # Size in bytes
+        "size",  # Size in bytes of the original, known for duplicates
         "deletedAt",  # When the media item was deleted by our app
         "userUrl",  # User-facing URL of the media item. productUrl is generated for our app and eventually expires.
         "fetchedAt",  # Datetime representing when the media item was fetched from Google Photos
+        "baseUrlFetchedAt",  # When baseUrl was last fetched, by a sync or batchGet
+        "fingerprint",  # Hash of the fetched fields, see sync_media_items
+        "syncGeneration",  # Last sync the media item was seen in
+        "syncPosition",  # Position the Photos API listed it at in that sync
     ]
 
+    # Fetched fields that make a media item changed when they differ.
+    #   baseUrls are left out, since they're regenerated on every fetch.
+    fingerprint_fields = ["filename", "mediaMetadata", "mimeType", "productUrl"]
+    # Fetched fields written even for unchanged media items: fresh baseUrls,
+    #   and the listing order
+    sync_refreshed_fields = ["baseUrl", "baseUrlFetchedAt", "syncPosition"]
+
+    # Flags marking media items received from a client rather than fetched
+    #   from the Photos API, see bulk_upsert_source_items
+    source_fields = ["extensionSource", "pickerSource"]
+
+    # The only fields duplicate detection reads, see detection_media_items.
+    #   baseUrls are read per chunk, only when downloading images.
+    detection_projection = {
+        "_id": 0,
+        "id": 1,
+        "mediaMetadata.width": 1,
+        "mediaMetadata.height": 1,
+        "mediaMetadata.creationTime": 1,
+        "size": 1,
+    }
+
     @classmethod
     def create_indexes(cls):
         # If DATABASE is not configured (e.g., in tests), skip creating indexes.
@@ -35,8 +67,7 @@ class MediaItemsRepository:
             logging.info("Skipping index creation because DATABASE is not configured")
             return
 
-        instance = cls("1")
-        instance._create_indexes()
+        indexes.ensure_indexes()
 
     def __init__(self, user_id: str):
         if not user_id:
@@ -44,9 +75,9 @@ class MediaItemsRepository:
 
         self.user_id = user_id
 
-        client = pymongo.MongoClient(config.MONGODB_URI)
-        self.db = client[config.DATABASE]
+        self.db = mongo_client.get_database()
         self.collection = self.db.media_items
+        self.counts_collection = self.db.media_item_counts
 
     def get_id_map(self, ids):
         result = self.collection.find(
@@ -58,12 +89,7 @@ class MediaItemsRepository:
         return {item["id"]: item for item in result}
 
     def create_or_update(self, attributes: dict):
-        attr = {
-            k: v
-            for (k, v) in attributes.items()
-            if k in MediaItemsRepository.attribute_names
-        }
-        attr |= {"userId": self.user_id}
+        attr = self._create_or_update_attributes(attributes)
 
         return self.collection.update_one(
             {"id": attr["id"], "userId": self.user_id},
@@ -71,9 +97,187 @@ class MediaItemsRepository:
             upsert=True,
         )
 
+    def bulk_create_or_update(
+        self, media_items: Iterable[dict], batch_size: Optional[int] = None
+    ) -> int:
+        """
+        Upsert many media items with one unordered bulk write per batch.
+
+        @return number of media items written
+        """
+
+        def operation(attributes):
+            attr = self._create_or_update_attributes(attributes)
+            return pymongo.UpdateOne(
+                {"id": attr["id"], "userId": self.user_id},
+                {"$set": attr},
+                upsert=True,
+            )
+
+        results = self._bulk_write(map(operation, media_items), batch_size)
+        return sum(len(batch) for batch, _ in results)
+
+    def sync_media_items(
+        self,
+        media_items: list[dict],
+        sync_generation: str,
+        batch_size: Optional[int] = None,
+    ) -> int:
+        """
+        Upsert media items fetched in a sync, skipping the full write for
+        any whose fingerprint matches the stored one. Unchanged media items
+        only get the fields every sync refreshes: `sync_generation` (see
+        delete_unsynced), their syncPosition and their new baseUrl.
+
+        @return number of new or changed media items written
+        """
+        if not media_items:
+            return 0
+
+        fingerprints = {m["id"]: self.fingerprint(m) for m in media_items}
+        stored_fingerprints = {
+            item["id"]: item.get("fingerprint")
+            for item in self.collection.find(
+                {"id": {"$in": list(fingerprints)}, "userId": self.user_id},
+                projection={"id": 1, "fingerprint": 1, "_id": 0},
+            )
+        }
+        changed = [
+            m
+            for m in media_items
+            if stored_fingerprints.get(m["id"]) != fingerprints[m["id"]]
+        ]
+        unchanged = [
+            m
+            for m in media_items
+            if stored_fingerprints.get(m["id"]) == fingerprints[m["id"]]
+        ]
+        self._bulk_write(
+            (
+                pymongo.UpdateOne(
+                    {"id": m["id"], "userId": self.user_id},
+                    {
+                        "$set": {
+                            **{k: m.get(k) for k in self.sync_refreshed_fields},
+                            "syncGeneration": sync_generation,
+                            # Still in the library, so no longer deleted either
+                            "deletedAt": None,
+                        }
+                    },
+                )
+                for m in unchanged
+            ),
+            batch_size,
+        )
+        return self.bulk_create_or_update(
+            (
+                m
+                | {
+                    "fingerprint": fingerprints[m["id"]],
+                    "syncGeneration": sync_generation,
+                }
+                for m in changed
+            ),
+            batch_size=batch_size,
+        )
+
+    def delete_unsynced(self, sync_generation: str) -> int:
+        """
+        Delete media items not seen in `sync_generation`, i.e. no longer in
+        the library.
+
+        @return number of media items deleted
+        """
+        result = self.collection.delete_many(
+            {"userId": self.user_id, "syncGeneration": {"$ne": sync_generation}}
+        )
+        if result.deleted_count:
+            # Running source counts may include deleted media items, so
+            #   recount them on next use
+            self.counts_collection.delete_many({"userId": self.user_id})
+        return result.deleted_count
+
+    @classmethod
+    def fingerprint(cls, media_item: dict) -> str:
+        """
+        @return hash of the fields of a fetched media item that matter for
+        detecting changes
+        """
+        fields = {k: media_item.get(k) for k in cls.fingerprint_fields}
+        return hashlib.sha1(
+            json.dumps(fields, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def bulk_upsert_source_items(
+        self,
+        source_field: str,
+        documents: list[dict],
+        resync_count: bool = False,
+        batch_size: Optional[int] = None,
+    ) -> int:
+        """
+        Upsert a batch of media items received from a client (e.g. the Chrome
+        extension), flagged with `source_field`, and keep a running count of
+        that source's media items instead of counting them on every batch.
+
+        Only media items newly flagged with the source, whether inserted or
+        already stored (e.g. fetched from the Photos API), are added to the
+        count. Pass `resync_count` at the start of a session to recount from
+        scratch.
+
+        @return number of media items stored from the source
+        """
+        self._check_source_field(source_field)
+
+        ids = {document["id"] for document in documents}
+        if not resync_count:
+            already_flagged = {
+                item["id"]
+                for item in self.collection.find(
+                    {"userId": self.user_id, "id": {"$in": list(ids)}, source_field: True},
+                    projection={"id": 1, "_id": 0},
+                )
+            }
+
+        operations = (
+            pymongo.UpdateOne(
+                {"userId": self.user_id, "id": document["id"]},
+                {"$set": document | {"userId": self.user_id, source_field: True}},
+                upsert=True,
+            )
+            for document in documents
+        )
+        results = self._bulk_write(operations, batch_size)
+
+        counts = None
+        if not resync_count:
+            counts = self.counts_collection.find_one_and_update(
+                {"userId": self.user_id, "source": source_field},
+                {"$inc": {"count": len(ids - already_flagged)}},
+                return_document=pymongo.ReturnDocument.AFTER,
+            )
+        if counts is None:
+            return self._recount_source(source_field)
+
+        return counts["count"]
+
+    def source_count(self, source_field: str) -> int:
+        """
+        @return running count of media items stored from a client source,
+        counted once if no running count exists yet
+        """
+        self._check_source_field(source_field)
+
+        counts = self.counts_collection.find_one(
+            {"userId": self.user_id, "source": source_field}
+        )
+        if counts is not None:
+            return counts["count"]
+
+        return self._recount_source(source_field)
+
     def update(self, id: str, attributes: dict):
-        attribute_names = [n for n in MediaItemsRepository.attribute_names if n != "id"]
-        attr = {k: v for (k, v) in attributes.items() if k in attribute_names}
+        attr = self._update_attributes(attributes)
         self.collection.update_one(
             {"id": id, "userId": self.user_id},
             {"$set": attr},
@@ -81,6 +285,28 @@ class MediaItemsRepository:
 
         return self.collection.find_one({"id": id, "userId": self.user_id})
 
+    def bulk_update(
+        self,
+        updates: Iterable[tuple[str, dict]],
+        batch_size: Optional[int] = None,
+    ) -> int:
+        """
+        Update many media items, given as (id, attributes) pairs, with one
+        unordered bulk write per batch.
+
+        @return number of updates written
+        """
+
+        def operation(update):
+            id, attributes = update
+            return pymongo.UpdateOne(
+                {"id": id, "userId": self.user_id},
+                {"$set": self._update_attributes(attributes)},
+            )
+
+        results = self._bulk_write(map(operation, updates), batch_size)
+        return sum(len(batch) for batch, _ in results)
+
     def delete(self, ids: Union[list[str], set[str]]) -> None:
         self.collection.delete_many(
             {
@@ -88,18 +314,53 @@ class MediaItemsRepository:
                 "userId": self.user_id,
             }
         )
+        # Running source counts may include deleted media items, so recount
+        #   them on next use
+        self.counts_collection.delete_many({"userId": self.user_id})
 
     def all(self):
         return (
             self.collection.find({"userId": self.user_id})
-            # Order by fetchedAt, representing the order mediaItems were returned
-            #   from the Google Photos API
-            .sort("fetchedAt", 1)
+            # In the order the Google Photos API listed mediaItems in the last
+            #   sync
+            .sort("syncPosition", 1)
             # Prevent out of memory errors by allowing MongoDB to write to temp
             #   files (default memory limit is 100MB)
             .allow_disk_use(True)
         )
 
+    def detection_media_items(
+        self,
+        source_field: Optional[str] = None,
+        raw: Optional[bool] = None,
+        batch_size: Optional[int] = None,
+    ) -> Iterator[Mapping]:
+        """
+        Stream the photos to run duplicate detection on, with only the fields
+        detection needs, in the order the last sync listed them.
+
+        @param source_field only include media items received from this
+        client source (e.g. "extensionSource"), rather than all of them
+        @param raw decode documents lazily as RawBSONDocuments, defaults to
+        MEDIA_ITEMS_RAW_BSON
+        """
+        raw = config.MEDIA_ITEMS_RAW_BSON if raw is None else raw
+        collection = self.collection
+        if raw:
+            collection = collection.with_options(
+                codec_options=CodecOptions(document_class=RawBSONDocument)
+            )
+
+        return (
+            collection.find(
+                self._detection_filter(source_field),
+                projection=MediaItemsRepository.detection_projection,
+            )
+            .sort("syncPosition", 1)
+            .batch_size(batch_size or config.MEDIA_ITEMS_CURSOR_BATCH_SIZE)
+            .allow_disk_use(True)
+        )
+
     def count(self) -> int:
         return self.collection.count_documents({"userId": self.user_id})
 
@@ -110,23 +371,61 @@ class MediaItemsRepository:
         )
         return {item["id"] for item in result}
 
-    def _create_indexes(self) -> None:
-        index_info = self.collection.index_information()
-        logging.info(f"Existing indexes: {index_info}")
+    def _create_or_update_attributes(self, attributes: dict) -> dict:
+        attr = {
+            k: v
+            for (k, v) in attributes.items()
+            if k in MediaItemsRepository.attribute_names
+        }
+        attr |= {"userId": self.user_id}
+        return attr
 
-        index1_name = "media_items_id_user_id_idx"
-        if index1_name not in index_info:
-            self.collection.create_index(
-                [("id", pymongo.ASCENDING), "user_id"],
-                unique=True,
-                name=index1_name,
-            )
-            logging.info(f"Created index {index1_name}")
+    def _update_attributes(self, attributes: dict) -> dict:
+        attribute_names = [n for n in MediaItemsRepository.attribute_names if n != "id"]
+        return {k: v for (k, v) in attributes.items() if k in attribute_names}
 
-        index2_name = "media_items_user_id_idx"
-        if index2_name not in index_info:
-            self.collection.create_index(
-                "user_id",
-                name=index2_name,
-            )
-            logging.info(f"Created index {index2_name}")
+    def _bulk_write(
+        self, operations: Iterable, batch_size: Optional[int]
+    ) -> list[tuple[list, pymongo.results.BulkWriteResult]]:
+        """
+        @return (operations, result) for each batch written
+        """
+        batch_size = batch_size or config.MEDIA_ITEMS_BULK_WRITE_BATCH_SIZE
+        operations = iter(operations)
+        results = []
+        while True:
+            batch = list(islice(operations, batch_size))
+            if not batch:
+                break
+            # Unordered, so the server can apply the batch in parallel and one
+            #   failed write doesn't stop the rest
+            results.append((batch, self.collection.bulk_write(batch, ordered=False)))
+
+        return results
+
+    def _recount_source(self, source_field: str) -> int:
+        count = self.collection.count_documents(
+            {"userId": self.user_id, source_field: True}
+        )
+        self.counts_collection.update_one(
+            {"userId": self.user_id, "source": source_field},
+            {"$set": {"count": count}},
+            upsert=True,
+        )
+        return count
+
+    def _detection_filter(self, source_field: Optional[str]) -> dict:
+        filter = {
+            "userId": self.user_id,
+            # Skip videos for now. We don't get video length from metadata and
+            #   size is not a good enough indicator of similarity.
+            "mediaMetadata.video": {"$exists": False},
+        }
+        if source_field:
+            self._check_source_field(source_field)
+            filter[source_field] = True
+        return filter
+
+    def _check_source_field(self, source_field: str) -> None:
+        if source_field not in MediaItemsRepository.source_fields:
+            raise ValueError(f"Unknown media item source: {source_field}")
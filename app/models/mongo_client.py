@@ -0,0 +1,134 @@
+import os
+import threading
+import pymongo
+import pymongo.database
+from pymongo import monitoring
+from app import config
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Counts connection pool events for the shared clients, see `metrics`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {
+                "connectionsCreated": 0,
+                "connectionsClosed": 0,
+                "checkOuts": 0,
+                "checkOutFailures": 0,
+                "checkedOut": 0,
+                "poolsCleared": 0,
+            }
+
+    def _increment(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.counts[name] += delta
+
+    def connection_created(self, event):
+        self._increment(connectionsCreated=1)
+
+    def connection_closed(self, event):
+        self._increment(connectionsClosed=1)
+
+    def connection_checked_out(self, event):
+        self._increment(checkOuts=1, checkedOut=1)
+
+    def connection_checked_in(self, event):
+        self._increment(checkedOut=-1)
+
+    def connection_check_out_failed(self, event):
+        self._increment(checkOutFailures=1)
+
+    def pool_cleared(self, event):
+        self._increment(poolsCleared=1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+_lock = threading.Lock()
+_clients: dict[str, pymongo.MongoClient] = {}
+_pid = os.getpid()
+_metrics_listener = PoolMetricsListener()
+
+
+def get_client(uri: str = None) -> pymongo.MongoClient:
+    """
+    Return the process-wide MongoClient for `uri` (default MONGODB_URI),
+    creating it on first use. MongoClient is thread-safe and pools its own
+    connections, so every repository shares one instead of building its own.
+    """
+    uri = uri or config.MONGODB_URI
+    if os.getpid() != _pid:
+        # MongoClient isn't fork-safe; see _reset_after_fork
+        _reset_after_fork()
+
+    with _lock:
+        client = _clients.get(uri)
+        if client is None:
+            client = pymongo.MongoClient(
+                uri,
+                maxPoolSize=config.MONGODB_MAX_POOL_SIZE,
+                minPoolSize=config.MONGODB_MIN_POOL_SIZE,
+                maxIdleTimeMS=config.MONGODB_MAX_IDLE_TIME_MS,
+                event_listeners=[_metrics_listener],
+            )
+            _clients[uri] = client
+
+        return client
+
+
+def get_database() -> pymongo.database.Database:
+    return get_client()[config.DATABASE]
+
+
+def metrics() -> dict:
+    """
+    Connection pool metrics for the shared clients in this process, logged
+    after each detection run.
+    """
+    with _lock:
+        num_clients = len(_clients)
+
+    return {
+        "pid": os.getpid(),
+        "clients": num_clients,
+        "maxPoolSize": config.MONGODB_MAX_POOL_SIZE,
+    } | dict(_metrics_listener.counts)
+
+
+def _reset_after_fork():
+    """
+    Forget clients inherited from the parent process (e.g. celery prefork
+    workers), so the child creates its own. The parent's clients must not be
+    closed or used from the child.
+    """
+    global _lock, _pid
+    # The locks may have been held by another thread at fork time
+    _lock = threading.Lock()
+    _metrics_listener._lock = threading.Lock()
+    _clients.clear()
+    _metrics_listener.reset()
+    _pid = os.getpid()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,222 @@
+import base64
+import binascii
+import datetime
+import json
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+import pymongo
+from app import config
+from app.lib.similarity_edges import SimilarityEdges
+from app.models import mongo_client
+
+
+class TaskResultsRepository:
+    """
+    Repository for the results of process_duplicates tasks stored in MongoDB,
+    so the Celery result only needs to carry a pointer to them.
+
+    Each task's results are split across collections so they can be read in
+    parts:
+      - task_results: one summary document per task
+      - task_result_groups: one document per group of duplicates
+      - task_result_edges: one document per pair of similar media items
+    """
+
+    # Orders groups can be paged in, and the group field each sorts by.
+    #   "position" is the order groups were found in.
+    group_sorts = {
+        "position": "position",
+        "size": "size",
+        "reclaimable_bytes": "reclaimableBytes",
+    }
+
+    def __init__(self, user_id: str):
+        if not user_id:
+            raise ValueError("user_id is required")
+
+        self.user_id = user_id
+
+        self.db = mongo_client.get_database()
+        self.collection = self.db.task_results
+        self.groups_collection = self.db.task_result_groups
+        self.edges_collection = self.db.task_result_edges
+
+    def save(self, task_id: str, results: dict) -> dict:
+        """
+        Store results returned by ProcessDuplicatesTask.run, replacing any
+        previously stored for the task.
+
+        @return pointer to the stored results, to return as the task result
+        """
+        self.delete(task_id)
+
+        groups = (
+            {
+                "taskId": task_id,
+                "userId": self.user_id,
+                "position": position,
+                "id": group["id"],
+                "mediaItemIds": group["mediaItemIds"],
+                "originalMediaItemId": group["originalMediaItemId"],
+                "size": len(group["mediaItemIds"]),
+                "reclaimableBytes": group.get("reclaimableBytes", 0),
+            }
+            for position, group in enumerate(results["groups"])
+        )
+        num_groups = self._insert_many(self.groups_collection, groups)
+
+        if "similarityEdges" in results:
+            similarity_edges = SimilarityEdges.from_json(results["similarityEdges"])
+        else:
+            # Results from before similarity edges, with each pair both ways
+            similarity_edges = SimilarityEdges.from_similarity_map(results["similarityMap"])
+        edges = (
+            {"taskId": task_id, "userId": self.user_id, "a": a, "b": b, "score": score}
+            for a, b, score in similarity_edges.id_pairs()
+        )
+        num_edges = self._insert_many(self.edges_collection, edges)
+
+        # Written last, so a summary means the results are complete
+        self.collection.insert_one(
+            {
+                "taskId": task_id,
+                "userId": self.user_id,
+                "groupCount": num_groups,
+                "edgeCount": num_edges,
+                "createdAt": datetime.datetime.now().astimezone(),
+            }
+        )
+
+        return {"taskId": task_id, "groupCount": num_groups}
+
+    def get(self, task_id: str) -> Optional[dict]:
+        return self.collection.find_one({"taskId": task_id, "userId": self.user_id})
+
+    def groups(self, task_id: str) -> Iterator[dict]:
+        return self.groups_collection.find(
+            {"taskId": task_id, "userId": self.user_id},
+            projection={"_id": 0, "taskId": 0, "userId": 0},
+            sort=[("position", pymongo.ASCENDING)],
+        )
+
+    def groups_page(
+        self,
+        task_id: str,
+        page_size: int,
+        cursor: Optional[str] = None,
+        sort: str = "position",
+    ) -> tuple[list[dict], Optional[str]]:
+        """
+        Read one page of groups. Groups sorted by size or reclaimable bytes
+        are largest first, with ties in the order they were found.
+
+        @param cursor from the previous page, None for the first page
+        @return the page of groups, and the cursor for the next page (None
+        if this is the last page)
+        """
+        if sort not in TaskResultsRepository.group_sorts:
+            raise ValueError(f"Unknown group sort: {sort}")
+        field = TaskResultsRepository.group_sorts[sort]
+
+        filter = {"taskId": task_id, "userId": self.user_id}
+        if cursor is not None:
+            value, position = self._decode_cursor(cursor)
+            if field == "position":
+                filter["position"] = {"$gt": position}
+            else:
+                filter["$or"] = [
+                    {field: {"$lt": value}},
+                    {field: value, "position": {"$gt": position}},
+                ]
+
+        order = [("position", pymongo.ASCENDING)]
+        if field != "position":
+            order.insert(0, (field, pymongo.DESCENDING))
+
+        # Read one extra group to tell whether there's another page
+        groups = list(
+            self.groups_collection.find(
+                filter,
+                projection={"_id": 0, "taskId": 0, "userId": 0},
+                sort=order,
+                limit=page_size + 1,
+            )
+        )
+
+        next_cursor = None
+        if len(groups) > page_size:
+            groups = groups[:page_size]
+            last = groups[-1]
+            next_cursor = self._encode_cursor(last[field], last["position"])
+
+        return groups, next_cursor
+
+    def similarity_map(
+        self, task_id: str, media_item_ids: Optional[Iterable[str]] = None
+    ) -> dict:
+        """
+        @param media_item_ids only include pairs where both media items are
+        in this list
+        @return dict of dict[media_item_id1][media_item_id2] = score
+        """
+        similarity_map = {}
+        for edge in self._edges(task_id, media_item_ids):
+            similarity_map.setdefault(edge["a"], {})[edge["b"]] = edge["score"]
+            similarity_map.setdefault(edge["b"], {})[edge["a"]] = edge["score"]
+
+        return similarity_map
+
+    def similarity_edges(
+        self, task_id: str, media_item_ids: Optional[Iterable[str]] = None
+    ) -> SimilarityEdges:
+        """
+        Compact form of similarity_map.
+
+        @param media_item_ids only include pairs where both media items are
+        in this list
+        """
+        return SimilarityEdges.from_id_pairs(
+            (edge["a"], edge["b"], edge["score"])
+            for edge in self._edges(task_id, media_item_ids)
+        )
+
+    def delete(self, task_id: str) -> None:
+        filter = {"taskId": task_id, "userId": self.user_id}
+        # Summary first, so partially deleted results never look complete
+        self.collection.delete_many(filter)
+        self.groups_collection.delete_many(filter)
+        self.edges_collection.delete_many(filter)
+
+    def _encode_cursor(self, value, position: int) -> str:
+        return base64.urlsafe_b64encode(json.dumps([value, position]).encode()).decode()
+
+    def _decode_cursor(self, cursor: str) -> tuple:
+        try:
+            value, position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (binascii.Error, ValueError, TypeError) as error:
+            raise ValueError(f"Invalid cursor: {cursor}") from error
+        return value, position
+
+    def _edges(
+        self, task_id: str, media_item_ids: Optional[Iterable[str]] = None
+    ) -> Iterator[dict]:
+        filter = {"taskId": task_id, "userId": self.user_id}
+        if media_item_ids is not None:
+            media_item_ids = list(media_item_ids)
+            filter |= {"a": {"$in": media_item_ids}, "b": {"$in": media_item_ids}}
+
+        return self.edges_collection.find(
+            filter, projection={"_id": 0, "a": 1, "b": 1, "score": 1}
+        )
+
+    def _insert_many(self, collection, documents: Iterable[dict]) -> int:
+        documents = iter(documents)
+        num_inserted = 0
+        while True:
+            batch = list(islice(documents, config.MEDIA_ITEMS_BULK_WRITE_BATCH_SIZE))
+            if not batch:
+                break
+            collection.insert_many(batch, ordered=False)
+            num_inserted += len(batch)
+
+        return num_inserted
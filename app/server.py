@@ -1,16 +1,22 @@
 import math
 import pprint
+import time
 import urllib.parse
 import re
+import celery.states
 import flask
 from app import utils
 from app import tasks
 from app import config
 from app import server  # required for building URLs
 from app.lib.google_api_client import GoogleApiClient
+from app.lib.image_stores import create_image_store
 from app.lib.process_duplicates_task import DailyLimitExceededError, SubtasksFailedError
+from app.lib.similarity_edges import SimilarityEdges
+from app.lib.task_results_cache import TaskResultsCache
 from app import FLASK_APP as flask_app
 from app.models.media_items_repository import MediaItemsRepository
+from app.models.task_results_repository import TaskResultsRepository
 
 
 @flask_app.route("/auth/me")
@@ -21,8 +27,8 @@ def me():
     if not user_id:
         return unauthed_response, 401
 
-    client = GoogleApiClient.from_user_id(user_id)
-    user_info = client.get_user_info()
+    client = GoogleApiClient.cached_from_user_id(user_id)
+    user_info = client.cached_user_info()
 
     return flask.jsonify({"logged_in": True, "user_info": user_info})
 
@@ -105,6 +111,11 @@ def create_task():
         f"Creating task for user_id {user_id} with options: {task_args}"
     )
 
+    # Only the active task's results can be viewed, so drop the previous ones
+    previous_task_id = flask.session.get("active_task_id")
+    if previous_task_id:
+        TaskResultsRepository(user_id=user_id).delete(previous_task_id)
+
     result = tasks.process_duplicates.delay(user_id, **task_args)
     flask.session["active_task_id"] = result.id
 
@@ -126,20 +137,109 @@ def get_active_task():
     ):  # PENDING is the default return value of celery.result.AsyncResult, even if that task no longer exists
         return flask.jsonify({"error": "No active task found"}), 404
 
-    response = {"status": result.status}
-    if result.status in ["SUCCESS", "PROGRESS"]:
-        response["meta"] = result.info["meta"]
-    elif result.status == "FAILURE":
-        if any(isinstance(result.info, e) for e in expected_errors):
-            response["error"] = str(result.info)
+    return flask.jsonify(active_task_for_display(result.status, result.info))
+
+
+def active_task_for_display(status, info):
+    response = {"status": status}
+    if status in ["SUCCESS", "PROGRESS"]:
+        response["meta"] = info["meta"]
+    elif status == "FAILURE":
+        if any(isinstance(info, e) for e in expected_errors):
+            response["error"] = str(info)
     else:
         # Some other state we didn't explictly set.
         flask_app.logger.info(
             f"Excluding result info in active task response,\n\
-                status: {result.status}, info: {pprint.pformat(result.info)}"
+                status: {status}, info: {pprint.pformat(info)}"
         )
 
-    return flask.jsonify(response)
+    return response
+
+
+# Longest an active task events stream waits for an update before sending a
+#   comment, so proxies don't close it
+ACTIVE_TASK_EVENTS_KEEPALIVE_SECONDS = 15
+# Longest a stream stays open, after which the browser reconnects. Each open
+#   stream holds a server thread.
+ACTIVE_TASK_EVENTS_MAX_SECONDS = 300
+
+
+@flask_app.route("/api/active_task/events", methods=["GET"])
+def get_active_task_events():
+    """
+    Server-Sent Events stream of the active task's progress, instead of
+    polling /api/active_task. The first `task` event is what
+    /api/active_task returns, then each `delta` event has the status if it
+    changed and the fields of meta that changed. The stream ends once the
+    task is done, or after ACTIVE_TASK_EVENTS_MAX_SECONDS.
+    """
+    active_task_id = flask.session.get("active_task_id")
+    if active_task_id is None:
+        return flask.jsonify({"error": "No active task found"}), 404
+
+    return flask.Response(
+        flask.stream_with_context(active_task_events(active_task_id)),
+        mimetype="text/event-stream",
+        # Don't let nginx buffer events
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def active_task_events(task_id):
+    backend = tasks.process_duplicates.backend
+    # The Redis result backend publishes each state it stores for a task to a
+    #   channel named after the task's result key
+    pubsub = backend.client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(backend.get_key_for_task(task_id))
+    try:
+        # Read the current state after subscribing, so no update is missed
+        result = tasks.process_duplicates.AsyncResult(task_id)
+        if result.status == "PENDING":
+            # The task no longer exists, see get_active_task
+            yield server_sent_event("task", {"error": "No active task found"})
+            return
+
+        task = active_task_for_display(result.status, result.info)
+        yield server_sent_event("task", task)
+
+        deadline = time.monotonic() + ACTIVE_TASK_EVENTS_MAX_SECONDS
+        while task["status"] not in celery.states.READY_STATES:
+            if time.monotonic() >= deadline:
+                break
+
+            message = pubsub.get_message(timeout=ACTIVE_TASK_EVENTS_KEEPALIVE_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+
+            state = backend.decode_result(message["data"])
+            update = active_task_for_display(state["status"], state["result"])
+            delta = active_task_delta(task, update)
+            task = update
+            if delta:
+                yield server_sent_event("delta", delta)
+    finally:
+        pubsub.close()
+
+
+def active_task_delta(task, update):
+    """
+    @return the fields of update that differ from task, and of its meta
+    """
+    delta = {k: v for k, v in update.items() if k != "meta" and task.get(k) != v}
+    meta = task.get("meta") or {}
+    meta_delta = {
+        k: v for k, v in (update.get("meta") or {}).items() if meta.get(k) != v
+    }
+    if meta_delta:
+        delta["meta"] = meta_delta
+    return delta
+
+
+def server_sent_event(event, data):
+    data = flask.json.dumps(data, separators=(",", ":"))
+    return f"event: {event}\ndata: {data}\n\n"
 
 
 @flask_app.route("/api/active_task", methods=["DELETE"])
@@ -156,25 +256,144 @@ def cancel_active_task():
     return flask.Response(status=204)
 
 
+# Rendered results of finished tasks, see get_active_task_results
+task_results_cache = TaskResultsCache(config.TASK_RESULTS_CACHE_SIZE)
+
+# Pages of results, see get_active_task_results
+RESULTS_DEFAULT_PAGE_SIZE = 50
+RESULTS_MAX_PAGE_SIZE = 500
+# Forms the similarities between media items can be returned in: "map", a
+#   dict of dicts with each pair both ways, or "edges", the compact JSON form
+#   of SimilarityEdges
+RESULTS_SIMILARITY_FORMATS = ["map", "edges"]
+
+
 @flask_app.route("/api/active_task/results", methods=["GET"])
 def get_active_task_results():
+    """
+    Results of the active task. Pass any of `page_size`, `cursor` (the
+    `nextCursor` of the previous page) or `sort` ("position", "size" or
+    "reclaimable_bytes") to get one page of groups at a time, along with only
+    the media items and similarities within them. Pass `format=edges` to get
+    `similarityEdges` (see SimilarityEdges) instead of `similarityMap`.
+
+    Each group's `reclaimableBytes` is the size in Google Photos of the
+    originals of its media items other than `originalMediaItemId`, as reported
+    for their full resolution downloads. Media items whose size couldn't be
+    found count as 0.
+    """
     active_task_id = flask.session.get("active_task_id")
     if not active_task_id:
         return flask.jsonify({"error": "No active task found"}), 404
 
-    result = tasks.process_duplicates.AsyncResult(active_task_id)
-    response = {}
-    if result.status == "SUCCESS":
+    # A finished task's results only change when its media items are updated,
+    #   which bumps the version (see update_media_item), so serve them rendered
+    #   from the cache. Cached results are of a finished task, so unchanged
+    #   results don't need the task's state either.
+    user_id = flask.session.get("user_id")
+    version = task_results_cache.version(user_id)
+    cache_key = (active_task_id, version, tuple(sorted(flask.request.args.items())))
+    cached = task_results_cache.get(user_id, cache_key)
+    if cached is None:
+        result = tasks.process_duplicates.AsyncResult(active_task_id)
+        if result.status != "SUCCESS":
+            return flask.jsonify({})
+
         # If the task completed but returned an error payload, forward it.
         if isinstance(result.info, dict) and "error" in result.info:
             # return the error payload directly so the UI can act (e.g., re-auth)
             return flask.jsonify(result.info)
 
-        # Otherwise, assume normal results structure and format for display
-        results = task_results_for_display(result.info["results"])
-        response |= results
+        response = flask.make_response(task_results_response(result.info["results"]))
+        if response.status_code != 200:
+            return response
+        body = response.get_data()
+        cached = (body, task_results_cache.set(user_id, cache_key, body))
+
+    body, etag = cached
+    response = flask.Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # Have clients revalidate, so unchanged results are a 304
+    response.cache_control.no_cache = True
+    return response.make_conditional(flask.request)
+
+
+def task_results_response(results):
+    """
+    Render the results of a finished task for display.
+    """
+    args = flask.request.args
+    similarity_format = args.get("format", "map")
+    if similarity_format not in RESULTS_SIMILARITY_FORMATS:
+        return flask.jsonify({"error": "invalid_format", "message": similarity_format}), 400
+
+    if "taskId" in results:
+        # Stored by TaskResultsRepository, the task result only points to them
+        task_results_repo = TaskResultsRepository(user_id=flask.session["user_id"])
+        if any(arg in args for arg in ("page_size", "cursor", "sort")):
+            return task_results_page(task_results_repo, results, args, similarity_format)
+
+        results = {
+            "groups": list(task_results_repo.groups(results["taskId"])),
+        } | similarities_for_display(
+            task_results_repo, results["taskId"], similarity_format
+        )
+    elif similarity_format == "edges":
+        similarity_edges = SimilarityEdges.from_similarity_map(results["similarityMap"])
+        results = {
+            "groups": results["groups"],
+            "similarityEdges": similarity_edges.to_json(),
+        }
+
+    return flask.jsonify(task_results_for_display(results))
 
-    return flask.jsonify(response)
+
+def similarities_for_display(
+    task_results_repo, task_id, similarity_format, media_item_ids=None
+):
+    if similarity_format == "edges":
+        similarity_edges = task_results_repo.similarity_edges(task_id, media_item_ids)
+        return {"similarityEdges": similarity_edges.to_json()}
+
+    return {"similarityMap": task_results_repo.similarity_map(task_id, media_item_ids)}
+
+
+def task_results_page(task_results_repo, results, args, similarity_format):
+    try:
+        page_size = int(args.get("page_size", RESULTS_DEFAULT_PAGE_SIZE))
+        if not 0 < page_size <= RESULTS_MAX_PAGE_SIZE:
+            raise ValueError(f"page_size must be between 1 and {RESULTS_MAX_PAGE_SIZE}")
+    except ValueError as e:
+        return flask.jsonify({"error": "invalid_page_size", "message": str(e)}), 400
+
+    sort = args.get("sort", "position")
+    if sort not in TaskResultsRepository.group_sorts:
+        return flask.jsonify({"error": "invalid_sort", "message": sort}), 400
+
+    try:
+        groups, next_cursor = task_results_repo.groups_page(
+            results["taskId"], page_size, cursor=args.get("cursor"), sort=sort
+        )
+    except ValueError as e:
+        return flask.jsonify({"error": "invalid_cursor", "message": str(e)}), 400
+
+    media_item_ids = [id for g in groups for id in g["mediaItemIds"]]
+    page = task_results_for_display(
+        {"groups": groups}
+        | similarities_for_display(
+            task_results_repo, results["taskId"], similarity_format, media_item_ids
+        )
+    )
+
+    return flask.jsonify(
+        page
+        | {
+            # JSON objects don't keep the page's order
+            "groupIds": [g["id"] for g in groups],
+            "groupCount": results["groupCount"],
+            "nextCursor": next_cursor,
+        }
+    )
 
 
 @flask_app.route("/api/credentials", methods=["GET"])
@@ -212,6 +431,7 @@ def get_credentials():
 def update_media_item(id):
     repo = MediaItemsRepository(user_id=flask.session["user_id"])
     media_item = repo.update(id, flask.request.json)
+    task_results_cache.invalidate(flask.session["user_id"])
 
     return flask.jsonify(
         success=True,
@@ -219,6 +439,30 @@ def update_media_item(id):
     )
 
 
+@flask_app.route("/api/images/<storage_filename>", methods=["GET"])
+def get_packed_image(storage_filename):
+    """
+    Serve an image from the packed image store. Files backed stores are served
+    directly by nginx from /images/ instead.
+    """
+    if config.IMAGE_STORE_BACKEND != "pack":
+        return flask.jsonify({"error": "not_found"}), 404
+
+    # Shared by every request in this process, so pack files stay mapped
+    packed_image_store = create_image_store()
+    if packed_image_store.locate(storage_filename) is None:
+        return flask.jsonify({"error": "not_found"}), 404
+
+    image = packed_image_store.read_image(storage_filename)
+    response = flask.Response(bytes(image), mimetype="image/jpeg")
+    response.cache_control.public = True
+    response.cache_control.max_age = 86400
+
+    return response.make_conditional(
+        flask.request, accept_ranges=True, complete_length=len(image)
+    )
+
+
 @flask_app.route("/api/logout", methods=["POST"])
 def logout():
     flask.session.clear()
@@ -279,30 +523,23 @@ def extension_receive_photos():
     # Store photos in temporary collection for processing
     repo = MediaItemsRepository(user_id=user_id)
     
-    # Store each photo with extension source flag
-    for photo in photos:
-        photo_data = {
-            "userId": user_id,
+    # Upsert the whole batch in one bulk write, flagged with the extension source
+    #   so analysis can select these photos. Restart the running count with
+    #   the first batch of each upload.
+    photos_data = [
+        {
             "id": photo.get("id"),
             "productUrl": photo.get("productUrl"),
             "filename": photo.get("filename"),
             "baseUrl": photo.get("baseUrl"),
             "mimeType": photo.get("mimeType"),
             "mediaMetadata": photo.get("mediaMetadata", {}),
-            "extensionSource": True,  # Flag to indicate source
             "batchNumber": batch_number,
         }
-        
-        # Upsert to avoid duplicates
-        repo.collection.update_one(
-            {"userId": user_id, "id": photo.get("id")},
-            {"$set": photo_data},
-            upsert=True
-        )
-    
-    # Return progress
-    total_stored = repo.collection.count_documents(
-        {"userId": user_id, "extensionSource": True}
+        for photo in photos
+    ]
+    total_stored = repo.bulk_upsert_source_items(
+        "extensionSource", photos_data, resync_count=batch_number == 1
     )
     
     return flask.jsonify({
@@ -391,9 +628,7 @@ def extension_get_status():
     repo = MediaItemsRepository(user_id=user_id)
     
     # Count photos from extension
-    photo_count = repo.collection.count_documents(
-        {"userId": user_id, "extensionSource": True}
-    )
+    photo_count = repo.source_count("extensionSource")
     
     # Get task status if exists
     task = tasks.get_active_task(user_id)
@@ -415,8 +650,8 @@ def picker_get_token():
         return flask.jsonify({"error": "not_logged_in"}), 401
     
     try:
-        client = GoogleApiClient.from_user_id(user_id)
-        access_token = client.credentials_obj.token
+        client = GoogleApiClient.cached_from_user_id(user_id)
+        access_token = client.get_fresh_token()
         
         return flask.jsonify({
             "accessToken": access_token,
@@ -449,10 +684,11 @@ def picker_receive_photos():
     # Store photos in temporary collection for processing
     repo = MediaItemsRepository(user_id=user_id)
     
-    # Store each photo with picker source flag
-    for photo in photos:
-        photo_data = {
-            "userId": user_id,
+    # Upsert the whole batch in one bulk write, flagged with the picker source
+    #   so analysis can select these photos. Restart the running count with
+    #   the first batch of each upload.
+    photos_data = [
+        {
             "id": photo.get("id"),
             "filename": photo.get("name"),
             "baseUrl": photo.get("url"),
@@ -461,20 +697,12 @@ def picker_receive_photos():
                 "width": "0",  # Picker doesn't provide dimensions
                 "height": "0",
             },
-            "pickerSource": True,  # Flag to indicate source
             "batchNumber": batch_number,
         }
-        
-        # Upsert to avoid duplicates
-        repo.collection.update_one(
-            {"userId": user_id, "id": photo.get("id")},
-            {"$set": photo_data},
-            upsert=True
-        )
-    
-    # Return progress
-    total_stored = repo.collection.count_documents(
-        {"userId": user_id, "pickerSource": True}
+        for photo in photos
+    ]
+    total_stored = repo.bulk_upsert_source_items(
+        "pickerSource", photos_data, resync_count=batch_number == 1
     )
     
     return flask.jsonify({
@@ -561,7 +789,10 @@ def task_results_for_display(results):
     results_for_display["mediaItems"] = {
         id: media_item_for_display(media_items_id_map[id]) for id in media_item_ids
     }
-    results_for_display["similarityMap"] = results["similarityMap"]
+    if "similarityEdges" in results:
+        results_for_display["similarityEdges"] = results["similarityEdges"]
+    else:
+        results_for_display["similarityMap"] = results["similarityMap"]
 
     return results_for_display
 
@@ -1,14 +1,17 @@
 import logging, logging.handlers
 import os
 import celery
+import requests
 from celery.signals import after_task_publish, after_setup_logger
 from typing import Callable, Optional
 from app import CELERY_APP as celery_app
 from app.config import CELERY_WORKER_LOG_PATH
 
-from app.lib.process_duplicates_task import ProcessDuplicatesTask
+from app.lib.process_duplicates_task import DailyLimitExceededError, ProcessDuplicatesTask
 from app.lib.store_images_task import StoreImagesTask
+from app.models import mongo_client
 from app.models.media_items_repository import MediaItemsRepository
+from app.models.task_results_repository import TaskResultsRepository
 
 
 class TaskUpdaterLogHandler(logging.Handler):
@@ -82,6 +85,11 @@ def update_sent_state(sender=None, headers=None, **kwargs):
     # the task may not exist if sent using `send_task` which
     # sends tasks by name, so fall back to the default result backend
     # if that is the case.
+    # detect_duplicates takes over the id of the process_duplicates task
+    #   that started it, whose progress must not be reset
+    if sender == detect_duplicates.name:
+        return
+
     task = celery_app.tasks.get(sender)
     backend = task.backend if task else celery_app.backend
 
@@ -90,25 +98,84 @@ def update_sent_state(sender=None, headers=None, **kwargs):
 
 @celery.shared_task(bind=True)
 def process_duplicates(self: celery.Task, *args, **kwargs):
-    global is_stdout_handler_setup
-    if not is_stdout_handler_setup:
-        logging.getLogger("celery.redirected").addHandler(task_updater_log_handler)
-        is_stdout_handler_setup = True
+    task_instance = ProcessDuplicatesTask(
+        self,
+        logger=_setup_task_logger(),
+        *args,
+        **kwargs,
+    )
+    return _run_process_duplicates(self, task_instance, task_instance.run)
+
 
-    task_logger = celery.utils.log.get_task_logger(__name__)
+@celery.shared_task(bind=True)
+def detect_duplicates(
+    self: celery.Task,
+    subtask_statuses: list[dict],
+    *args,
+    subtask_name: str = "store_images",
+    meta: Optional[dict] = None,
+    **kwargs,
+):
+    """
+    Continuation of process_duplicates, run by the chord it's replaced with
+    once every subtask has finished.
 
+    @param subtask_statuses returned by each subtask
+    @param subtask_name of the subtasks, e.g. "store_images"
+    @param meta of the process_duplicates task so far
+    """
     task_instance = ProcessDuplicatesTask(
         self,
-        logger=task_logger,
+        logger=_setup_task_logger(),
         *args,
         **kwargs,
     )
+    if meta:
+        task_instance.meta = meta
+    return _run_process_duplicates(
+        self,
+        task_instance,
+        lambda: task_instance.detect_duplicates_after_subtasks(
+            subtask_statuses, subtask_name
+        ),
+    )
+
+
+def _setup_task_logger() -> logging.Logger:
+    global is_stdout_handler_setup
+    if not is_stdout_handler_setup:
+        logging.getLogger("celery.redirected").addHandler(task_updater_log_handler)
+        is_stdout_handler_setup = True
 
+    return celery.utils.log.get_task_logger(__name__)
+
+
+def _run_process_duplicates(
+    task: celery.Task,
+    task_instance: ProcessDuplicatesTask,
+    run: Callable[[], dict],
+) -> dict:
     def set_task_meta_log_message(message):
         task_instance.update_meta(log_message=message)
 
     task_updater_log_handler.set_handler(set_task_meta_log_message)
-    results = task_instance.run()
+    try:
+        results = run()
+    finally:
+        task_instance.flush_meta()
+        progress = task_instance.progress
+        logging.info(
+            f"Published {progress.num_writes} of {progress.num_updates} progress "
+            f"updates ({progress.num_saved_writes} coalesced)"
+        )
+        # e.g. to size MONGODB_MAX_POOL_SIZE for the worker's concurrency
+        logging.info(f"MongoDB connection pool: {mongo_client.metrics()}")
+    if "error" not in results:
+        # Results grow with the library, so keep them out of the result
+        #   backend and return a pointer to them instead
+        results = TaskResultsRepository(task_instance.user_id).save(
+            task.request.id, results
+        )
     # Celery replaces the `info` field with the return value of the task, so
     #   return the last meta update alongside our results
     final_meta = task_instance.get_meta()
@@ -139,4 +206,94 @@ def store_images(
         chunk_size=chunk_size,
         logger=task_logger,
     )
-    task_instance.run()
+    try:
+        return task_instance.run()
+    except Exception as error:
+        # Report failures as a status rather than raising, so the chord
+        #   still runs detect_duplicates, which decides how to surface them
+        task_logger.exception(f"Failed to store images: {error}")
+        return {"error": _subtask_error(error), "message": str(error)}
+
+
+@celery.shared_task(bind=True)
+def download_chunk(
+    self: celery.Task,
+    user_id: str,
+    chunk_index: int,
+    chunk_ids: list[str],
+    total_chunks: int,
+    **kwargs,
+):
+    task_updater_log_handler.set_handler(lambda x: None)
+    task_instance = ProcessDuplicatesTask(self, user_id, logger=task_logger, **kwargs)
+    try:
+        return task_instance.download_chunk(chunk_index, chunk_ids, total_chunks)
+    except Exception as error:
+        task_logger.exception(f"Failed to download chunk {chunk_index}: {error}")
+        return {"error": _subtask_error(error), "message": str(error)}
+    finally:
+        task_instance.flush_meta()
+
+
+@celery.shared_task(bind=True)
+def embed_chunk(
+    self: celery.Task,
+    download_status: dict,
+    user_id: str,
+    chunk_index: int,
+    chunk_ids: list[str],
+    total_chunks: int,
+    **kwargs,
+):
+    """
+    @param download_status returned by the download_chunk subtask before it
+    """
+    if "error" in download_status:
+        return download_status
+
+    task_updater_log_handler.set_handler(lambda x: None)
+    task_instance = ProcessDuplicatesTask(self, user_id, logger=task_logger, **kwargs)
+    try:
+        return task_instance.embed_chunk(chunk_index, chunk_ids, total_chunks)
+    except Exception as error:
+        task_logger.exception(f"Failed to embed chunk {chunk_index}: {error}")
+        return {"error": _subtask_error(error), "message": str(error)}
+    finally:
+        task_instance.flush_meta()
+
+
+@celery.shared_task(bind=True)
+def compare_chunks(
+    self: celery.Task,
+    user_id: str,
+    i: int,
+    j: int,
+    pair_key: str,
+    **kwargs,
+):
+    task_updater_log_handler.set_handler(lambda x: None)
+    task_instance = ProcessDuplicatesTask(self, user_id, logger=task_logger, **kwargs)
+    try:
+        return task_instance.compare_chunks(i, j, pair_key)
+    except Exception as error:
+        task_logger.exception(f"Failed to compare chunks {i} and {j}: {error}")
+        return {"error": _subtask_error(error), "message": str(error)}
+    finally:
+        task_instance.flush_meta()
+
+
+def _subtask_error(error: Exception) -> str:
+    """
+    @return the error status of a subtask that raised error
+    """
+    from app.lib.google_api_client import InsufficientScopesError
+
+    if isinstance(error, InsufficientScopesError):
+        return "insufficient_scopes"
+    if isinstance(error, DailyLimitExceededError):
+        return "daily_limit_exceeded"
+    if isinstance(
+        error, requests.exceptions.HTTPError
+    ) and "429 Client Error" in str(error):
+        return "daily_limit_exceeded"
+    return "failed"
@@ -144,3 +144,113 @@ class TestRefreshCredentialsIfInvalid:
         assert any("Insufficient authentication scopes" in rec.message for rec in caplog.records)
 
         set_credentials.assert_called_once_with(new_credentials)
+
+
+class TestCaches:
+    def test_save_credentials_invalidates_cached_credentials(
+        self, credentials, user_id, mocker
+    ):
+        from app.lib import google_api_client
+        from app.lib.google_api_client import GoogleApiClient
+
+        get_credentials = mocker.patch(
+            "app.models.credentials_repository.CredentialsRepository.get",
+            return_value=credentials,
+        )
+        set_credentials = mocker.patch(
+            "app.models.credentials_repository.CredentialsRepository.set"
+        )
+
+        client = GoogleApiClient.cached_from_user_id(user_id)
+        assert GoogleApiClient.cached_from_user_id(user_id) is client
+        google_api_client.user_info_cache.set(user_id, {"id": user_id})
+        get_credentials.assert_called_once()
+
+        client.save_credentials()
+        set_credentials.assert_called_once()
+        assert google_api_client.user_info_cache.get(user_id) is None
+        assert GoogleApiClient.cached_from_user_id(user_id) is not client
+        assert get_credentials.call_count == 2
+
+
+class TestRefreshCredentials:
+    @pytest.fixture
+    def unauthorized_error(self):
+        response = Mock(spec=requests.Response, status_code=401)
+        return requests.exceptions.HTTPError(response=response)
+
+    def test_401_refreshes_and_saves_while_holding_lock(
+        self, credentials, user_id, user_info, unauthorized_error, fake_redis, mocker
+    ):
+        from app.lib.google_api_client import GoogleApiClient
+
+        client = GoogleApiClient(credentials, user_id=user_id)
+        mocker.patch(
+            "app.models.credentials_repository.CredentialsRepository.get",
+            return_value=credentials,
+        )
+
+        def refresh():
+            # Nobody else may refresh meanwhile
+            assert fake_redis.exists(f"oauth_token_refresh:{user_id}")
+            client.credentials_obj.token = "NEW_TOKEN"
+
+        refresh_credentials = mocker.patch.object(
+            client, "refresh_credentials", side_effect=refresh
+        )
+        save_credentials = mocker.patch.object(client, "save_credentials")
+        mocker.patch.object(
+            client.session,
+            "get",
+            side_effect=[unauthorized_error, Mock(json=Mock(return_value=user_info))],
+        )
+
+        assert client.get_user_info() == user_info
+        refresh_credentials.assert_called_once()
+        save_credentials.assert_called_once()
+        assert fake_redis.values == {}
+
+    def test_401_reuses_token_refreshed_by_lock_holder(
+        self, credentials, user_id, user_info, unauthorized_error, fake_redis, mocker
+    ):
+        from app.lib.google_api_client import GoogleApiClient
+        from app.lib.redis_lock import RedisLock
+
+        client = GoogleApiClient(credentials, user_id=user_id)
+        holder = RedisLock(fake_redis, f"oauth_token_refresh:{user_id}", 30)
+        holder.acquire()
+        saved_credentials = credentials | {"token": "NEW_TOKEN"}
+        mocker.patch(
+            "app.models.credentials_repository.CredentialsRepository.get",
+            return_value=saved_credentials,
+        )
+
+        # Another worker finishes refreshing while we wait
+        mocker.patch("time.sleep", side_effect=lambda _: holder.release())
+        refresh_credentials = mocker.patch.object(client, "refresh_credentials")
+        mocker.patch.object(
+            client.session,
+            "get",
+            side_effect=[unauthorized_error, Mock(json=Mock(return_value=user_info))],
+        )
+
+        assert client.get_user_info() == user_info
+        refresh_credentials.assert_not_called()
+        assert client.credentials_obj.token == "NEW_TOKEN"
+
+    def test_refreshes_before_expiry(self, credentials, user_id, user_info, mocker):
+        import datetime
+        from app.lib.google_api_client import GoogleApiClient
+
+        mocker.patch("app.lib.redis_lock.get_client", return_value=None)
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+        client = GoogleApiClient(credentials | {"expiry": expiry}, user_id=user_id)
+        refresh_credentials = mocker.patch.object(client, "refresh_credentials")
+        mocker.patch.object(client, "save_credentials")
+        get = mocker.patch.object(
+            client.session, "get", return_value=Mock(json=Mock(return_value=user_info))
+        )
+
+        client.get_user_info()
+        refresh_credentials.assert_called_once()
+        get.assert_called_once()
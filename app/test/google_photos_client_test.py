@@ -1,8 +1,14 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 import pytest
 from unittest.mock import Mock
 import requests
 
 from app.lib.google_photos_client import GooglePhotosClient
+from app.lib.rate_limiter import RateLimiter
 
 
 class TestRefreshCredentialsIfInvalid:
@@ -68,3 +74,212 @@ class TestRefreshCredentialsIfInvalid:
         assert 'fields' in called['params']
         assert 'pageSize' in called['params']
         assert "mediaItems(id,baseUrl,filename,mediaMetadata,mimeType)" in called['params']['fields']
+
+
+@pytest.fixture
+def fake_photos_api(mocker):
+    """
+    Local fake of the Photos API's mediaItems list (serving `pages`) and
+    mediaItems:batchGet endpoints. batchGet records the most requests it was
+    handling at once.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakePhotosApiHandler)
+    server.pages = [{}]
+    server.requests = []
+    server.concurrent_requests = server.max_concurrent_requests = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    mocker.patch(
+        "app.config.PHOTOS_API_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1"
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FakePhotosApiHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.concurrent_requests += 1
+            server.max_concurrent_requests = max(
+                server.max_concurrent_requests, server.concurrent_requests
+            )
+        try:
+            assert self.path == "/v1/mediaItems:batchGet"
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            server.requests.append(body["mediaItemIds"])
+            # Simulate the API's latency
+            time.sleep(0.05)
+            results = [
+                {"mediaItem": {"id": id, "baseUrl": f"http://example/{id}"}}
+                if not id.startswith("missing")
+                else {"status": {"code": 5, "message": "NOT_FOUND"}}
+                for id in body["mediaItemIds"]
+            ]
+            self.send_json({"mediaItemResults": results})
+        finally:
+            with server.lock:
+                server.concurrent_requests -= 1
+
+    def do_GET(self):
+        assert self.path.startswith("/v1/mediaItems?")
+        query = parse_qs(urlparse(self.path).query)
+        page = int(query["pageToken"][0][len("page"):]) if "pageToken" in query else 1
+        self.send_json(self.server.pages[page - 1])
+
+    def send_json(self, data):
+        response = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_get_media_items_by_ids_concurrently(mocker, credentials, fake_photos_api):
+    mocker.patch("app.lib.google_photos_client.MediaItemsRepository")
+    mocker.patch("app.config.PHOTOS_API_BATCH_GET_CONCURRENCY", 4)
+    mocker.patch(
+        "app.lib.google_photos_client.photos_api_rate_limiter", RateLimiter(0)
+    )
+    client = GooglePhotosClient(credentials, user_id="user-1", logger=mocker.Mock())
+    ids = [f"id{i}" for i in range(400)] + ["missing1"]
+
+    result = client.get_media_items_by_ids(ids)
+
+    assert set(result) == set(ids) - {"missing1"}
+    assert result["id0"]["baseUrl"] == "http://example/id0"
+    # Requests of at most 50 ids each, several at once
+    assert sorted(len(r) for r in fake_photos_api.requests) == [1] + [50] * 8
+    assert 1 < fake_photos_api.max_concurrent_requests <= 4
+
+
+def test_get_media_items_by_ids_uses_rate_limiter(mocker, credentials, fake_photos_api):
+    mocker.patch("app.lib.google_photos_client.MediaItemsRepository")
+    rate_limiter = mocker.patch("app.lib.google_photos_client.photos_api_rate_limiter")
+    client = GooglePhotosClient(credentials, user_id="user-1", logger=mocker.Mock())
+
+    client.get_media_items_by_ids([f"id{i}" for i in range(120)])
+
+    assert rate_limiter.acquire.call_count == 3
+
+
+def test_fetch_media_items_syncs_changes(mocker, credentials, fake_photos_api):
+    repo = mocker.patch("app.lib.google_photos_client.MediaItemsRepository").return_value
+    synced = []
+    positions = []
+    generations = set()
+
+    def sync_media_items(media_items, sync_generation, **kwargs):
+        synced.append([m["id"] for m in media_items])
+        positions.extend(m["syncPosition"] for m in media_items)
+        generations.add(sync_generation)
+        return 1
+
+    repo.sync_media_items.side_effect = sync_media_items
+    repo.delete_unsynced.return_value = 2
+    mocker.patch("app.lib.google_photos_client.photos_api_rate_limiter", RateLimiter(0))
+    client = GooglePhotosClient(credentials, user_id="user-1", logger=mocker.Mock())
+    fake_photos_api.pages = [
+        {"mediaItems": [{"id": "id1"}, {"id": "id2"}], "nextPageToken": "page2"},
+        {"mediaItems": [{"id": "id3"}]},
+    ]
+    callback = Mock()
+
+    client.fetch_media_items(callback=callback, batch_size=2)
+
+    # Every batch is synced in the same generation, which then marks the rest
+    #   of the library deleted
+    assert synced == [["id1", "id2"], ["id3"]]
+    # Every media item is written with the position the API listed it at
+    assert positions == [0, 1, 2]
+    assert len(generations) == 1
+    repo.delete_unsynced.assert_called_once_with(generations.pop())
+    assert [call.args[0]["id"] for call in callback.call_args_list] == ["id1", "id2", "id3"]
+
+
+def test_refresh_expired_base_urls(mocker, credentials, fake_photos_api):
+    import datetime
+    from app.lib.google_photos_client import refresh_expired_base_urls
+
+    from app.models.media_items_repository import MediaItemsRepository
+
+    repo_cls = mocker.patch("app.lib.google_photos_client.MediaItemsRepository")
+    repo_cls.source_fields = MediaItemsRepository.source_fields
+    repo = repo_cls.return_value
+    mocker.patch("app.lib.google_photos_client.photos_api_rate_limiter", RateLimiter(0))
+    mocker.patch(
+        "app.models.credentials_repository.CredentialsRepository.get",
+        return_value=credentials,
+    )
+    now = datetime.datetime.now(datetime.timezone.utc)
+    hours_ago = now - datetime.timedelta(hours=2)
+    media_items = [
+        {"id": "expired", "baseUrl": "old", "fetchedAt": hours_ago.replace(tzinfo=None)},
+        {"id": "missing1", "baseUrl": "old", "fetchedAt": hours_ago},
+        {"id": "fresh", "baseUrl": "old", "fetchedAt": now},
+        {
+            "id": "refreshed",
+            "baseUrl": "old",
+            "fetchedAt": hours_ago,
+            "baseUrlFetchedAt": now,
+        },
+        {"id": "extension", "baseUrl": "old", "fetchedAt": hours_ago, "extensionSource": True},
+    ]
+
+    assert refresh_expired_base_urls("user-1", media_items, logger=Mock()) == 1
+
+    # Only expired baseUrls of media items fetched from the API are requested,
+    #   in one batchGet
+    assert fake_photos_api.requests == [["expired", "missing1"]]
+    assert [m["baseUrl"] for m in media_items] == [
+        "http://example/expired",
+        "old",
+        "old",
+        "old",
+        "old",
+    ]
+    [(id, attributes)] = repo.bulk_update.call_args[0][0]
+    assert id == "expired"
+    assert attributes["baseUrl"] == "http://example/expired"
+    assert attributes["baseUrlFetchedAt"] >= now
+
+
+def test_refresh_expired_base_urls_skips_client_when_none_expired(mocker):
+    import datetime
+    from app.lib.google_photos_client import refresh_expired_base_urls
+
+    from_user_id = mocker.patch.object(GooglePhotosClient, "from_user_id")
+    now = datetime.datetime.now().astimezone()
+
+    assert refresh_expired_base_urls("user-1", [{"id": "id1", "fetchedAt": now}]) == 0
+    from_user_id.assert_not_called()
+
+
+def test_fetch_original_sizes(mocker):
+    """Sizes should come from the headers of the originals' downloads."""
+    from app.lib.google_photos_client import fetch_original_sizes
+
+    refresh = mocker.patch("app.lib.google_photos_client.refresh_expired_base_urls")
+
+    def fake_head(url, timeout=None, allow_redirects=False):
+        response = requests.models.Response()
+        response.status_code = 404 if "missing" in url else 200
+        response.headers["Content-Length"] = "4567"
+        response.url = url
+        return response
+
+    head = mocker.patch.object(requests, "head", side_effect=fake_head)
+    media_items = [
+        {"id": "id1", "baseUrl": "http://test/id1"},
+        {"id": "id2", "baseUrl": "http://test/missing"},
+    ]
+
+    assert fetch_original_sizes("user-1", media_items) == {"id1": 4567}
+    refresh.assert_called_once_with("user-1", media_items, mocker.ANY)
+    head.assert_any_call("http://test/id1=d", timeout=5, allow_redirects=True)
@@ -0,0 +1,55 @@
+import pytest
+import pymongo
+import app.config
+from app.models import indexes
+
+# These tests require a real mongo database connection
+# Run `docker-compose up mongo` and
+#   `TEST_DB=1 pytest app/test/indexes_test.py`
+#   in separate terminals
+requires_mongodb = pytest.mark.skipif("os.environ.get('TEST_DB') is None")
+
+
+@pytest.fixture
+def db():
+    db = pymongo.MongoClient(app.config.MONGODB_URI)[app.config.DATABASE]
+    yield db
+    for collection_name in indexes.INDEXES:
+        db[collection_name].drop()
+
+
+def test_plan_stages():
+    """Should list the stages of nested query plans."""
+    plan = {
+        "stage": "SORT",
+        "inputStage": {
+            "stage": "FETCH",
+            "inputStage": {"stage": "IXSCAN", "indexName": "idx"},
+        },
+    }
+
+    assert indexes._plan_stages(plan) == ["SORT", "FETCH", "IXSCAN"]
+
+
+@requires_mongodb
+def test_ensure_indexes(db):
+    """Should create missing indexes and drop legacy ones, once."""
+    db.media_items.create_index("user_id", name="media_items_user_id_idx")
+
+    summary = indexes.ensure_indexes(db)
+
+    assert summary["media_items"]["dropped"] == ["media_items_user_id_idx"]
+    assert "media_items_user_id_id_idx" in db.media_items.index_information()
+    assert indexes.ensure_indexes(db)["media_items"] == {"created": [], "dropped": []}
+
+
+@requires_mongodb
+def test_verify_query_plans(db):
+    """Every repository query should use an index rather than a COLLSCAN."""
+    db.media_items.insert_one({"userId": "user", "id": "id1"})
+
+    assert indexes.verify_query_plans(db) != {}
+
+    indexes.ensure_indexes(db)
+
+    assert indexes.verify_query_plans(db) == {}
@@ -20,6 +20,15 @@ def collection():
     collection.drop()
 
 
+@pytest.fixture
+def counts_collection():
+    collection = pymongo.MongoClient(app.config.MONGODB_URI)[
+        app.config.DATABASE
+    ].media_item_counts
+    yield collection
+    collection.drop()
+
+
 @pytest.fixture
 def user_id():
     return "test-user-id"
@@ -85,6 +94,156 @@ def test_create_or_update__update(collection, user_id, media_item, repo):
     assert document["filename"] == media_item["filename"]
 
 
+@requires_mongodb
+def test_bulk_create_or_update(collection, user_id, media_item, repo):
+    """Should create and update documents across batches"""
+    collection.insert_one(
+        media_item | {"id": "id1", "userId": user_id, "filename": "other.jpg"}
+    )
+    media_items = [media_item | {"id": f"id{i}"} for i in range(1, 4)]
+
+    count = repo.bulk_create_or_update(media_items, batch_size=2)
+
+    assert count == 3
+    assert collection.count_documents({"userId": user_id}) == 3
+    document = collection.find_one({"id": "id1"})
+    assert document["filename"] == media_item["filename"]
+
+
+@requires_mongodb
+def test_sync_media_items__skips_unchanged(collection, user_id, media_item, repo):
+    """Should only write new and changed documents, marking all as seen"""
+    media_items = [media_item | {"id": f"id{i}"} for i in range(1, 4)]
+    assert repo.sync_media_items(media_items, "generation-1") == 3
+
+    # A new baseUrl alone doesn't make a media item changed
+    media_items = [m | {"baseUrl": "http://example/new"} for m in media_items]
+    media_items[0]["filename"] = "renamed.jpg"
+    assert repo.sync_media_items(media_items, "generation-2") == 1
+
+    assert collection.find_one({"id": "id1"})["filename"] == "renamed.jpg"
+    assert collection.count_documents({"syncGeneration": "generation-2"}) == 3
+
+
+@requires_mongodb
+def test_sync_media_items__refreshes_unchanged(collection, user_id, media_item, repo):
+    """Unchanged documents should still get the new baseUrl and listing order"""
+    repo.sync_media_items(
+        [media_item | {"id": f"id{i}", "syncPosition": i} for i in range(3)],
+        "generation-1",
+    )
+
+    # A new media item, which the API lists first
+    media_items = [media_item | {"id": "new"}] + [
+        media_item | {"id": f"id{i}", "baseUrl": f"http://example/id{i}"}
+        for i in range(3)
+    ]
+    media_items = [m | {"syncPosition": i} for i, m in enumerate(media_items)]
+    assert repo.sync_media_items(media_items, "generation-2") == 1
+
+    assert [m["id"] for m in repo.all()] == ["new", "id0", "id1", "id2"]
+    assert collection.find_one({"id": "id1"})["baseUrl"] == "http://example/id1"
+
+
+@requires_mongodb
+def test_delete_unsynced(collection, user_id, media_item, repo):
+    """Should delete only the user's documents not seen in the sync"""
+    repo.sync_media_items(
+        [media_item | {"id": "id1"}, media_item | {"id": "id2"}], "generation-1"
+    )
+    collection.insert_one(media_item | {"id": "id3", "userId": "test-other-user-id"})
+    repo.sync_media_items([media_item | {"id": "id1"}], "generation-2")
+
+    assert repo.delete_unsynced("generation-2") == 1
+
+    assert collection.count_documents({"id": "id1"}) == 1
+    assert collection.count_documents({"id": "id2"}) == 0
+    assert collection.count_documents({"id": "id3"}) == 1
+
+
+def test_fingerprint__ignores_base_url(media_item):
+    fingerprint = MediaItemsRepository.fingerprint(media_item)
+
+    assert MediaItemsRepository.fingerprint(media_item | {"baseUrl": "x"}) == fingerprint
+    assert MediaItemsRepository.fingerprint(media_item | {"filename": "x"}) != fingerprint
+
+
+@requires_mongodb
+def test_bulk_update(collection, user_id, media_item, repo):
+    """Should update only documents with the same user_id"""
+    collection.insert_one(media_item | {"id": "id1", "userId": user_id})
+    collection.insert_one(media_item | {"id": "id2", "userId": "test-other-user-id"})
+
+    repo.bulk_update(
+        [("id1", {"storageFilename": "id1.jpg"}), ("id2", {"storageFilename": "id2.jpg"})]
+    )
+
+    assert collection.find_one({"id": "id1"})["storageFilename"] == "id1.jpg"
+    assert "storageFilename" not in collection.find_one({"id": "id2"})
+
+
+@requires_mongodb
+def test_bulk_upsert_source_items(
+    collection, counts_collection, user_id, media_item, repo
+):
+    """Should flag upserted items with the source and keep a running count"""
+    batch1 = [media_item | {"id": "id1"}, media_item | {"id": "id2"}]
+    batch2 = [media_item | {"id": "id2"}, media_item | {"id": "id3"}]
+
+    assert repo.bulk_upsert_source_items("extensionSource", batch1, True) == 2
+    assert repo.bulk_upsert_source_items("extensionSource", batch2) == 3
+
+    assert collection.count_documents({"extensionSource": True}) == 3
+    assert repo.source_count("extensionSource") == 3
+    assert repo.source_count("pickerSource") == 0
+
+
+@requires_mongodb
+def test_bulk_upsert_source_items__counts_newly_flagged(
+    collection, counts_collection, user_id, media_item, repo
+):
+    """Should count stored items flagged with the source for the first time"""
+    repo.bulk_create_or_update([media_item | {"id": "id1"}])
+    repo.bulk_upsert_source_items("extensionSource", [media_item | {"id": "id0"}], True)
+
+    batch = [media_item | {"id": "id0"}, media_item | {"id": "id1"}]
+    assert repo.bulk_upsert_source_items("extensionSource", batch) == 2
+    assert collection.count_documents({"extensionSource": True}) == 2
+
+
+@requires_mongodb
+def test_source_count__recounts_after_delete(
+    collection, counts_collection, user_id, media_item, repo
+):
+    """Should not count deleted media items"""
+    batch = [media_item | {"id": "id1"}, media_item | {"id": "id2"}]
+    repo.bulk_upsert_source_items("pickerSource", batch, True)
+
+    repo.delete(["id1"])
+
+    assert repo.source_count("pickerSource") == 1
+
+
+@requires_mongodb
+def test_detection_media_items(collection, user_id, media_item, repo):
+    """Should stream projected photos from the requested source"""
+    collection.insert_one(media_item | {"id": "id1", "userId": user_id})
+    collection.insert_one(
+        media_item | {"id": "id2", "userId": user_id, "extensionSource": True}
+    )
+    video = copy.deepcopy(media_item)
+    video["mediaMetadata"]["video"] = {}
+    collection.insert_one(video | {"id": "id3", "userId": user_id})
+
+    documents = list(repo.detection_media_items())
+    assert [d["id"] for d in documents] == ["id1", "id2"]
+    assert "productUrl" not in documents[0]
+    assert documents[0]["mediaMetadata"]["width"] == media_item["mediaMetadata"]["width"]
+
+    documents = list(repo.detection_media_items("extensionSource", raw=True))
+    assert [d["id"] for d in documents] == ["id2"]
+
+
 @requires_mongodb
 def test_delete(collection, user_id, media_item, repo):
     """Should delete documents with matching ID and same user_id"""
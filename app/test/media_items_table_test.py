@@ -0,0 +1,56 @@
+import numpy as np
+from app.lib.media_items_table import MediaItemsTable
+
+
+def media_item(id, width, height, creation_time=None):
+    media_metadata = {"width": str(width), "height": str(height)}
+    if creation_time:
+        media_metadata["creationTime"] = creation_time
+    return {"id": id, "mediaMetadata": media_metadata}
+
+
+def test_from_media_items():
+    """It should store ids and metadata in columns, by media item index."""
+    table = MediaItemsTable.from_media_items(
+        iter(
+            [
+                media_item("a", 100, 200, "2023-07-10T02:20:47Z"),
+                media_item("bb", 300, 400, "2023-07-10T02:20:47.123456789Z"),
+                {"id": "c", "size": 1234},
+            ]
+        )
+    )
+
+    assert len(table) == 3
+    assert table.id(1) == "bb"
+    assert table.ids(1) == ["bb", "c"]
+    assert list(table.widths) == [100, 300, 0]
+    assert list(table.sizes) == [0, 0, 1234]
+    assert table.creation_times[0] == np.datetime64("2023-07-10T02:20:47")
+    assert table.creation_times[1] == np.datetime64("2023-07-10T02:20:47")
+    assert np.isnat(table.creation_times[2])
+
+
+def test_original_index():
+    """The largest media item should be the original, the earliest created on ties."""
+    table = MediaItemsTable.from_media_items(
+        [
+            media_item("small", 10, 10, "2020-01-01T00:00:00Z"),
+            media_item("later", 100, 100, "2023-01-01T00:00:00Z"),
+            media_item("no-time", 100, 100),
+            media_item("earlier", 100, 100, "2022-01-01T00:00:00Z"),
+        ]
+    )
+
+    assert table.original_index([0, 1, 2, 3]) == 3
+    assert table.original_index([0, 2]) == 2
+
+
+def test_reclaimable_bytes():
+    """It should sum the known sizes of every media item but the original."""
+    table = MediaItemsTable.from_media_items(
+        [{"id": "a", "size": 100}, {"id": "b", "size": 20}, {"id": "c"}]
+    )
+
+    assert table.reclaimable_bytes([0, 1, 2], 0) == 20
+    assert table.reclaimable_bytes([0, 1, 2], 1) == 100
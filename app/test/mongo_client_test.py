@@ -0,0 +1,43 @@
+import os
+from unittest.mock import Mock
+from app.models import mongo_client
+from app.models.credentials_repository import CredentialsRepository
+from app.models.media_items_repository import MediaItemsRepository
+
+
+def test_get_client__shared():
+    """Repositories should share a single client per process."""
+    client = mongo_client.get_client()
+
+    assert mongo_client.get_client() is client
+    assert MediaItemsRepository("user-1").db.client is client
+    assert CredentialsRepository("user-2").db.client is client
+
+
+def test_get_client__pool_settings(mocker):
+    mocker.patch("app.config.MONGODB_MAX_POOL_SIZE", 7)
+    client = mongo_client.get_client("mongodb://pool-settings-test:27017/")
+
+    assert client.options.pool_options.max_pool_size == 7
+
+
+def test_get_client__after_fork(mocker):
+    """A forked child should create its own client instead of reusing the parent's."""
+    client = mongo_client.get_client()
+    mocker.patch("os.getpid", return_value=os.getpid() + 1)
+
+    assert mongo_client.get_client() is not client
+
+
+def test_metrics():
+    listener = mongo_client.PoolMetricsListener()
+
+    listener.connection_created(Mock())
+    listener.connection_checked_out(Mock())
+    listener.connection_checked_out(Mock())
+    listener.connection_checked_in(Mock())
+
+    assert listener.counts["connectionsCreated"] == 1
+    assert listener.counts["checkOuts"] == 2
+    assert listener.counts["checkedOut"] == 1
+    assert {"pid", "clients", "maxPoolSize", "checkedOut"} <= mongo_client.metrics().keys()
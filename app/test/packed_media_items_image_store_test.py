@@ -0,0 +1,169 @@
+import os
+import pytest
+import requests
+from app.lib.packed_media_items_image_store import PackedMediaItemsImageStore
+
+
+@pytest.fixture
+def image_store(tmp_path):
+    return PackedMediaItemsImageStore(base_path=str(tmp_path), max_pack_bytes=10)
+
+
+@pytest.fixture
+def mock_get(mocker):
+    def fake_get(url, timeout=None):
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = f"<{url.split('/')[-1]}>".encode()
+        return response
+
+    return mocker.patch.object(requests, "get", side_effect=fake_get)
+
+
+def storable_media_item(media_item, id):
+    return media_item | {"id": id, "baseUrl": f"http://test/{id}"}
+
+
+def test_store_image(mock_get, media_item, image_store):
+    """It should append the image to a pack and read it back by storage filename."""
+    result = image_store.store_image(storable_media_item(media_item, "image1"))
+
+    assert result == "image1-250.jpg"
+    assert bytes(image_store.read_image(result)) == b"<image1=w250-h250>"
+
+
+def test_store_image__already_stored(mock_get, media_item, image_store):
+    """If the image is already in a pack, it should not download it again."""
+    image_store.store_image(storable_media_item(media_item, "image1"))
+    image_store.store_image(storable_media_item(media_item, "image1"))
+
+    assert mock_get.call_count == 1
+
+
+def test_store_image__rolls_over_packs(mock_get, media_item, image_store, tmp_path):
+    """It should start a new pack once the active one reaches max_pack_bytes."""
+    for id in ("image1", "image2", "image3"):
+        image_store.store_image(storable_media_item(media_item, id))
+
+    packs = [f for f in os.listdir(tmp_path) if f.endswith(".pack")]
+    assert len(packs) == 3
+    assert bytes(image_store.read_image("image2-250.jpg")) == b"<image2=w250-h250>"
+
+
+def test_locate(mock_get, media_item, image_store):
+    """It should return the byte range of the image within its pack file."""
+    image_store.store_image(storable_media_item(media_item, "image1"))
+
+    path, offset, length = image_store.locate("image1-250.jpg")
+    with open(path, "rb") as pack_file:
+        pack_file.seek(offset)
+        assert pack_file.read(length) == b"<image1=w250-h250>"
+    assert image_store.locate("missing-250.jpg") is None
+
+
+def test_sees_writes_from_other_instances(mock_get, media_item, image_store, tmp_path):
+    """Stores sharing a path (e.g. in other workers) should see each other's images."""
+    other_store = PackedMediaItemsImageStore(base_path=str(tmp_path))
+    other_store.store_image(storable_media_item(media_item, "image1"))
+
+    assert bytes(image_store.read_image("image1-250.jpg")) == b"<image1=w250-h250>"
+
+
+def test_compact(mock_get, media_item, tmp_path):
+    """It should drop deleted images from the packs and keep the rest readable."""
+    image_store = PackedMediaItemsImageStore(base_path=str(tmp_path))
+    for id in ("image1", "image2", "image3"):
+        image_store.store_image(storable_media_item(media_item, id))
+    image_store.delete(["image2-250.jpg"])
+
+    result = image_store.compact()
+
+    assert result["images"] == 2
+    assert result["bytesAfter"] < result["bytesBefore"]
+    assert image_store.locate("image2-250.jpg") is None
+    assert bytes(image_store.read_image("image3-250.jpg")) == b"<image3=w250-h250>"
+    # A freshly opened store should load the compacted index
+    reopened_store = PackedMediaItemsImageStore(base_path=str(tmp_path))
+    assert bytes(reopened_store.read_image("image1-250.jpg")) == b"<image1=w250-h250>"
+
+
+def test_reads_after_compaction_by_other_instance(mock_get, media_item, image_store, tmp_path):
+    """A long-lived reader should follow a compaction made by another process."""
+    for id in ("image1", "image2", "image3"):
+        image_store.store_image(storable_media_item(media_item, id))
+    # Only the first pack is mapped by the reader before the compaction
+    image_store.read_image("image1-250.jpg")
+
+    PackedMediaItemsImageStore(base_path=str(tmp_path)).compact()
+
+    path, _, _ = image_store.locate("image3-250.jpg")
+    assert os.path.isfile(path)
+    assert bytes(image_store.read_image("image3-250.jpg")) == b"<image3=w250-h250>"
+
+
+def test_concurrent_reads_share_index(mock_get, media_item, image_store, tmp_path):
+    """Threads sharing a store should all see every record of the index."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    storage_filenames = [
+        PackedMediaItemsImageStore(base_path=str(tmp_path)).store_image(
+            storable_media_item(media_item, f"image{i}")
+        )
+        for i in range(50)
+    ]
+
+    with ThreadPoolExecutor(8) as executor:
+        images = list(executor.map(image_store.read_image, storage_filenames * 4))
+
+    assert [bytes(image) for image in images] == [
+        f"<{f.split('-')[0]}=w250-h250>".encode() for f in storage_filenames * 4
+    ]
+
+
+def test_create_image_store(mocker, tmp_path):
+    """The factory should return a store of the configured backend."""
+    from app.lib.image_stores import create_image_store
+    from app.lib.media_items_image_store import MediaItemsImageStore
+
+    mocker.patch("app.config.IMAGE_STORE_BACKEND", "pack")
+    store = create_image_store(base_path=str(tmp_path), use_manifest=True)
+    assert isinstance(store, PackedMediaItemsImageStore)
+
+    mocker.patch("app.config.IMAGE_STORE_BACKEND", "files")
+    store = create_image_store(base_path=str(tmp_path), use_manifest=True)
+    assert isinstance(store, MediaItemsImageStore)
+    assert store.use_manifest is True
+
+
+def test_create_image_store__shared(mocker, mock_get, media_item, tmp_path):
+    """Packed stores for the same path should be shared, reading only new index records."""
+    from app.lib import image_stores
+
+    mocker.patch("app.config.IMAGE_STORE_BACKEND", "pack")
+    image_stores.clear()
+    store = image_stores.create_image_store(base_path=str(tmp_path))
+    image1 = storable_media_item(media_item, "image1")
+    image2 = storable_media_item(media_item, "image2")
+    store.store_image(image1)
+    # Stored by another process
+    PackedMediaItemsImageStore(base_path=str(tmp_path)).store_image(image2)
+
+    assert image_stores.create_image_store(base_path=str(tmp_path)) is store
+    read = mocker.spy(store, "_read_index")
+    assert store.missing([image1, image2]) == []
+    assert read.call_count == 1
+    assert store._index_offset == os.path.getsize(store.index_path)
+
+    # Cached entries are served without touching the index
+    stat = mocker.spy(os, "stat")
+    assert store.image_size("image1-250.jpg") == len(b"<image1=w250-h250>")
+    stat.assert_not_called()
+
+
+def test_image_size(mock_get, media_item, image_store):
+    """It should return the stored image's length."""
+    storage_filename = image_store.store_image(storable_media_item(media_item, "image1"))
+
+    assert image_store.image_size(storage_filename) == len(b"<image1=w250-h250>")
+    with pytest.raises(FileNotFoundError):
+        image_store.image_size("missing-250.jpg")
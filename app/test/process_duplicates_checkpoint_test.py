@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from app.lib.process_duplicates_checkpoint import ProcessDuplicatesCheckpoint
+
+
+@pytest.fixture
+def checkpoint(mocker, tmp_path):
+    mocker.patch("app.config.CHECKPOINT_PATH", str(tmp_path))
+    return ProcessDuplicatesCheckpoint.for_task("user-1", {"resolution": 250})
+
+
+def test_for_task__same_options(checkpoint):
+    """Tasks with the same user and options should share a checkpoint."""
+    other = ProcessDuplicatesCheckpoint.for_task("user-1", {"resolution": 250})
+    assert other.path == checkpoint.path
+
+    other = ProcessDuplicatesCheckpoint.for_task("user-1", {"resolution": 500})
+    assert other.path != checkpoint.path
+
+
+def test_chunk(checkpoint):
+    """It should return saved chunk positions only for a chunk with the same media items."""
+    key = checkpoint.chunk_key(["a", "b"])
+    assert checkpoint.load_chunk(0, key) is None
+
+    checkpoint.save_chunk(0, key, np.array([1]), np.ones((1, 3)))
+
+    assert list(checkpoint.load_chunk(0, key)) == [1]
+    assert checkpoint.load_chunk(0, checkpoint.chunk_key(["a", "c"])) is None
+    assert np.load(checkpoint.chunk_embeddings_path(0)).shape == (1, 3)
+
+
+def test_pair(checkpoint):
+    """It should return saved pair comparisons only for the same key."""
+    assert checkpoint.load_pair(0, 1, "key") is None
+    assert not checkpoint.has_pair(0, 1, "key")
+
+    checkpoint.save_pair(0, 1, "key", np.array([0]), np.array([1]), np.array([0.995]))
+
+    a, b, scores = checkpoint.load_pair(0, 1, "key")
+    assert list(a) == [0] and list(b) == [1] and list(scores) == [0.995]
+    assert checkpoint.has_pair(0, 1, "key")
+    assert checkpoint.load_pair(0, 1, "other-key") is None
+    assert not checkpoint.has_pair(0, 1, "other-key")
+
+
+def test_clear(checkpoint):
+    checkpoint.save_chunk(0, "key", np.array([0]), np.ones((1, 3)))
+
+    checkpoint.clear()
+
+    assert ProcessDuplicatesCheckpoint(checkpoint.path).load_chunk(0, "key") is None
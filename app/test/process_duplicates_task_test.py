@@ -1,8 +1,22 @@
 import pytest
 from unittest.mock import Mock
+from celery.exceptions import Ignore
 
-from app.lib.process_duplicates_task import ProcessDuplicatesTask
+from app.lib.process_duplicates_task import (
+    DailyLimitExceededError,
+    ProcessDuplicatesTask,
+    SubtasksFailedError,
+)
 from app.lib.google_api_client import InsufficientScopesError
+from app.lib.similarity_edges import SimilarityEdges
+
+
+@pytest.fixture(autouse=True)
+def fetch_original_sizes(mocker):
+    """Don't request the originals of duplicates found by tests."""
+    return mocker.patch(
+        "app.lib.process_duplicates_task.fetch_original_sizes", return_value={}
+    )
 
 
 def test_run_returns_insufficient_scopes_when_fetch_fails(mocker):
@@ -24,6 +38,16 @@ def test_run_returns_insufficient_scopes_when_fetch_fails(mocker):
     assert result.get("user_id") == user_id
 
 
+def mock_repository(mocker, media_items):
+    repo_cls = mocker.patch("app.lib.process_duplicates_task.MediaItemsRepository")
+    repo = repo_cls.return_value
+    repo.detection_media_items.side_effect = lambda source_field: iter(media_items)
+    repo.get_id_map.side_effect = lambda ids: {
+        m["id"]: m for m in media_items if m["id"] in ids
+    }
+    return repo
+
+
 def test_chunked_processing_small_dataset(mocker):
     # Create fake media items (4 items)
     media_items = [
@@ -39,10 +63,10 @@ def test_chunked_processing_small_dataset(mocker):
     gp_cls = mocker.patch("app.lib.process_duplicates_task.GooglePhotosClient")
     gp_client = gp_cls.from_user_id.return_value
     gp_client.local_media_items_count.return_value = 4
-    gp_client.get_local_media_items.return_value = media_items
+    mock_repository(mocker, media_items)
 
-    # Patch MediaItemsImageStore.store_image to avoid network/file operations
-    img_store_cls = mocker.patch("app.lib.process_duplicates_task.MediaItemsImageStore")
+    # Patch the image store's store_image to avoid network/file operations
+    img_store_cls = mocker.patch("app.lib.process_duplicates_task.create_image_store")
     img_store = img_store_cls.return_value
     img_store.store_image.side_effect = lambda m: f"{m['id']}-100.jpg"
 
@@ -78,4 +102,268 @@ def test_chunked_processing_small_dataset(mocker):
     assert groups is not None
     group_sets = [set(g["mediaItemIds"]) for g in groups]
     assert {"a", "c"} in group_sets
-    assert {"b", "d"} in group_sets
\ No newline at end of file
+    assert {"b", "d"} in group_sets
+    # Each similar pair is in the compact similarity edges once
+    similarity_map = SimilarityEdges.from_json(result["similarityEdges"]).to_similarity_map()
+    assert set(similarity_map["a"]) == {"c"}
+    assert set(similarity_map["b"]) == {"d"}
+
+
+def test_chunked_processing_resumes_from_checkpoint(mocker, tmp_path):
+    media_items = [
+        {"id": id, "baseUrl": f"http://example/{id}", "mediaMetadata": {"width": "100", "height": "100"}}
+        for id in ("a", "b", "c", "d")
+    ]
+    mocker.patch("app.config.CHECKPOINT_PATH", str(tmp_path))
+
+    gp_cls = mocker.patch("app.lib.process_duplicates_task.GooglePhotosClient")
+    gp_client = gp_cls.from_user_id.return_value
+    gp_client.local_media_items_count.return_value = 4
+    mock_repository(mocker, media_items)
+
+    img_store_cls = mocker.patch("app.lib.process_duplicates_task.create_image_store")
+    img_store_cls.return_value.store_image.side_effect = lambda m: f"{m['id']}-100.jpg"
+
+    embedded_chunks = []
+
+    def fake_calculate(self):
+        import numpy as np
+
+        ids = [m["id"] for m in self.media_items]
+        embedded_chunks.append(ids)
+        if ids == ["c", "d"] and len(embedded_chunks) == 2:
+            raise RuntimeError("worker terminated")
+
+        self.embeddings = Mock(numpy=Mock(return_value=np.array([[1.0, 0.0]] * len(ids))))
+        return self.embeddings
+
+    mocker.patch("app.lib.process_duplicates_task.DuplicateImageDetector._calculate_embeddings", fake_calculate)
+
+    with pytest.raises(RuntimeError):
+        ProcessDuplicatesTask(Mock(), "user-resume", chunk_size=2, logger=Mock()).run()
+
+    result = ProcessDuplicatesTask(Mock(), "user-resume", chunk_size=2, logger=Mock()).run()
+
+    # The first chunk's embeddings should come from the checkpoint
+    assert embedded_chunks == [["a", "b"], ["c", "d"], ["c", "d"]]
+    assert [set(g["mediaItemIds"]) for g in result["groups"]] == [{"a", "b", "c", "d"}]
+
+
+def test_run_streams_extension_sourced_media_items(mocker, tmp_path):
+    media_items = [
+        {"id": id, "baseUrl": f"http://example/{id}", "mediaMetadata": {"width": "100", "height": "100"}}
+        for id in ("a", "b")
+    ]
+    mocker.patch("app.config.CHECKPOINT_PATH", str(tmp_path))
+    repo = mock_repository(mocker, media_items)
+    repo.collection.count_documents.return_value = 2
+
+    img_store_cls = mocker.patch("app.lib.process_duplicates_task.create_image_store")
+    img_store_cls.return_value.store_image.side_effect = lambda m: f"{m['id']}-100.jpg"
+
+    def fake_calculate(self):
+        import numpy as np
+
+        self.embeddings = Mock(numpy=Mock(return_value=np.array([[1.0, 0.0]] * len(self.media_items))))
+        return self.embeddings
+
+    mocker.patch("app.lib.process_duplicates_task.DuplicateImageDetector._calculate_embeddings", fake_calculate)
+
+    result = ProcessDuplicatesTask(
+        Mock(), "user-extension", extension_source=True, chunk_size=1, logger=Mock()
+    ).run()
+
+    repo.detection_media_items.assert_called_once_with("extensionSource")
+    assert [set(g["mediaItemIds"]) for g in result["groups"]] == [{"a", "b"}]
+
+
+def test_update_meta_coalesces_progress(mocker):
+    mocker.patch("app.config.PROGRESS_PUBLISH_INTERVAL_SECONDS", 60.0)
+    task = Mock()
+    pd_task = ProcessDuplicatesTask(task, "user-1", logger=Mock())
+
+    pd_task.start_step("fetch_media_items")
+    for i in range(100):
+        pd_task.update_meta(log_message=f"line {i}")
+    assert task.update_state.call_count == 1
+
+    # Step transitions and flushing are always published, with the latest meta
+    pd_task.complete_step("fetch_media_items")
+    pd_task.update_meta(log_message="done")
+    pd_task.flush_meta()
+    assert task.update_state.call_count == 3
+    assert task.update_state.call_args.kwargs["meta"]["meta"]["logMessage"] == "done"
+    assert pd_task.progress.num_saved_writes == 100
+
+
+def test_run_replaces_task_with_store_images_chord(mocker):
+    mocker.patch("app.lib.process_duplicates_task.MediaItemsRepository")
+    gp_cls = mocker.patch("app.lib.process_duplicates_task.GooglePhotosClient")
+    gp_client = gp_cls.from_user_id.return_value
+    gp_client.local_media_items_count.return_value = 0
+    gp_client.fetch_media_items.side_effect = lambda callback: [
+        callback({"id": f"id{i}"}) for i in range(150)
+    ]
+    chord = mocker.patch("app.lib.process_duplicates_task.celery.chord")
+    task = Mock()
+
+    with pytest.raises(Ignore):
+        ProcessDuplicatesTask(task, "user-1", resolution=100, logger=Mock()).run()
+
+    # One store_images subtask per batch, then detection in a callback
+    #   rather than waiting on them
+    header, body = chord.call_args.args
+    assert [len(s.args[1]) for s in header] == [100, 50]
+    assert header[0].args[2] == 100
+    assert body.args == ("user-1",)
+    assert body.kwargs["subtask_name"] == "store_images"
+    assert body.kwargs["resolution"] == 100
+    assert "logMessage" in body.kwargs["meta"]
+    task.replace.assert_called_once_with(chord.return_value)
+
+
+def test_detect_duplicates_after_store_images(mocker):
+    repo = mock_repository(mocker, [])
+    repo.count.return_value = 2
+    pd_task = ProcessDuplicatesTask(Mock(), "user-1", logger=Mock())
+    detect_duplicates = mocker.patch.object(pd_task, "detect_duplicates")
+
+    result = pd_task.detect_duplicates_after_subtasks(
+        [{"stored": 1, "failed": 0}, {"stored": 0, "failed": 1}], "store_images"
+    )
+
+    assert result == detect_duplicates.return_value
+    assert pd_task.meta["totalItems"] == 2
+    assert pd_task.meta["steps"]["fetch_media_items"]["completedAt"]
+    assert pd_task.meta["steps"]["process_duplicates"]["startedAt"]
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        ("insufficient_scopes", None),
+        ("daily_limit_exceeded", DailyLimitExceededError),
+        ("failed", SubtasksFailedError),
+    ],
+)
+def test_detect_duplicates_after_failed_subtasks(mocker, error, expected):
+    pd_task = ProcessDuplicatesTask(Mock(), "user-1", logger=Mock())
+    detect_duplicates = mocker.patch.object(pd_task, "detect_duplicates")
+    statuses = [{"stored": 1, "failed": 0}, {"error": error, "message": "error"}]
+
+    if expected:
+        with pytest.raises(expected):
+            pd_task.detect_duplicates_after_subtasks(statuses, "store_images")
+    else:
+        result = pd_task.detect_duplicates_after_subtasks(statuses, "store_images")
+        assert result == {"error": "insufficient_scopes", "user_id": "user-1"}
+    detect_duplicates.assert_not_called()
+
+
+def test_chunked_processing_fans_out_embedding_and_comparisons(mocker, tmp_path):
+    media_items = [
+        {"id": id, "baseUrl": f"http://example/{id}", "mediaMetadata": {"width": "100", "height": "100"}}
+        for id in ("a", "b", "c", "d")
+    ]
+    mocker.patch("app.config.CHECKPOINT_PATH", str(tmp_path))
+    mocker.patch("app.config.PROCESS_DUPLICATES_FAN_OUT", True)
+    mocker.patch("app.lib.process_duplicates_task.GooglePhotosClient")
+    mock_repository(mocker, media_items)
+    img_store_cls = mocker.patch("app.lib.process_duplicates_task.create_image_store")
+    img_store_cls.return_value.store_image.side_effect = lambda m: f"{m['id']}-100.jpg"
+
+    def fake_calculate(self):
+        import numpy as np
+
+        self.embeddings = Mock(numpy=Mock(return_value=np.array([[1.0, 0.0]] * len(self.media_items))))
+        return self.embeddings
+
+    mocker.patch("app.lib.process_duplicates_task.DuplicateImageDetector._calculate_embeddings", fake_calculate)
+    chord = mocker.patch("app.lib.process_duplicates_task.celery.chord")
+
+    # The task only coordinates, replacing itself with a subtask per chunk
+    with pytest.raises(Ignore):
+        ProcessDuplicatesTask(Mock(), "user-fan-out", chunk_size=2, logger=Mock()).run()
+    header, body = chord.call_args.args
+    assert [[t.name for t in s.tasks] for s in header] == [
+        ["app.tasks.download_chunk", "app.tasks.embed_chunk"]
+    ] * 2
+    assert [s.tasks[1].args[1:3] for s in header] == [(0, ["a", "b"]), (1, ["c", "d"])]
+    assert body.kwargs["subtask_name"] == "embed_chunk"
+
+    # Subtasks download and embed into the shared checkpoint, then detection
+    #   carries on from it
+    statuses = []
+    for download, embed in (s.tasks for s in header):
+        assert ProcessDuplicatesTask(
+            Mock(), "user-fan-out", **download.kwargs, logger=Mock()
+        ).download_chunk(*download.args[1:]) == {"chunkIndex": download.args[1], "stored": 2}
+        statuses.append(
+            ProcessDuplicatesTask(Mock(), "user-fan-out", **embed.kwargs, logger=Mock()).embed_chunk(*embed.args[1:])
+        )
+    assert statuses == [{"chunkIndex": 0, "embedded": 2}, {"chunkIndex": 1, "embedded": 2}]
+    options = {k: v for k, v in body.kwargs.items() if k not in ("meta", "subtask_name")}
+    with pytest.raises(Ignore):
+        ProcessDuplicatesTask(
+            Mock(), "user-fan-out", logger=Mock(), **options
+        ).detect_duplicates_after_subtasks(statuses, "embed_chunk")
+
+    # Then with a subtask per chunk pair in the upper triangle
+    header, body = chord.call_args.args
+    assert [s.args[1:3] for s in header] == [(0, 0), (0, 1), (1, 1)]
+    assert body.kwargs["subtask_name"] == "compare_chunks"
+    statuses = [
+        ProcessDuplicatesTask(Mock(), "user-fan-out", **s.kwargs, logger=Mock()).compare_chunks(*s.args[1:])
+        for s in header
+    ]
+    assert statuses == [
+        {"chunks": [0, 0], "pairs": 2},
+        {"chunks": [0, 1], "pairs": 4},
+        {"chunks": [1, 1], "pairs": 2},
+    ]
+
+    # Which the task reduces into groups
+    result = ProcessDuplicatesTask(
+        Mock(), "user-fan-out", logger=Mock(), **options
+    ).detect_duplicates_after_subtasks(statuses, "compare_chunks")
+
+    assert [set(g["mediaItemIds"]) for g in result["groups"]] == [{"a", "b", "c", "d"}]
+    assert chord.call_count == 2
+
+
+def test_chunked_processing_reports_reclaimable_bytes(mocker, tmp_path, fetch_original_sizes):
+    """Reclaimable bytes should count the originals' sizes, looked up for duplicates only."""
+    media_items = [
+        {"id": "a", "baseUrl": "http://example/a", "mediaMetadata": {"width": "200", "height": "200"}},
+        {"id": "b", "baseUrl": "http://example/b", "mediaMetadata": {"width": "100", "height": "100"}},
+    ]
+    mocker.patch("app.lib.process_duplicates_task.GooglePhotosClient")
+    mocker.patch("app.config.CHECKPOINT_PATH", str(tmp_path))
+    repo = mock_repository(mocker, media_items)
+
+    img_store = mocker.patch("app.lib.process_duplicates_task.create_image_store").return_value
+    img_store.store_image.side_effect = lambda m: f"{m['id']}-100.jpg"
+    # "a" is already known, and the size of a thumbnail isn't the original's
+    media_items[0]["size"] = 5000
+    img_store.image_size.return_value = 10
+    fetch_original_sizes.return_value = {"b": 1200}
+    updates = []
+    repo.bulk_update.side_effect = lambda u: updates.extend(u)
+
+    def fake_calculate(self):
+        import numpy as np
+
+        self.embeddings = Mock(numpy=Mock(return_value=np.ones((len(self.media_items), 3))))
+        return self.embeddings
+
+    mocker.patch("app.lib.process_duplicates_task.DuplicateImageDetector._calculate_embeddings", fake_calculate)
+
+    pd_task = ProcessDuplicatesTask(Mock(), "user-1", chunk_size=1, similarity_threshold=0.8, logger=Mock())
+    result = pd_task.run()
+
+    # The larger "a" is the original, so only "b" is reclaimable
+    [group] = result["groups"]
+    assert group["originalMediaItemId"] == "a"
+    assert group["reclaimableBytes"] == 1200
+    fetch_original_sizes.assert_called_once_with("user-1", [media_items[1]], pd_task.logger)
+    assert [u for u in updates if "size" in u[1]] == [("b", {"size": 1200})]
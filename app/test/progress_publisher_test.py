@@ -0,0 +1,44 @@
+from unittest.mock import Mock
+from app.lib.progress_publisher import ProgressPublisher
+
+
+def test_update_coalesces_within_min_interval():
+    publish = Mock()
+    now = [0.0]
+    publisher = ProgressPublisher(publish, min_interval=1.0, clock=lambda: now[0])
+
+    assert publisher.update({"n": 1})
+    now[0] = 0.5
+    assert not publisher.update({"n": 2})
+    assert not publisher.update({"n": 3})
+    now[0] = 1.0
+    assert publisher.update({"n": 4})
+
+    assert [c.args[0] for c in publish.call_args_list] == [{"n": 1}, {"n": 4}]
+    assert publisher.num_updates == 4
+    assert publisher.num_writes == 2
+    assert publisher.num_saved_writes == 2
+
+
+def test_update_force_writes_immediately():
+    publish = Mock()
+    publisher = ProgressPublisher(publish, min_interval=60.0, clock=lambda: 0.0)
+
+    publisher.update({"n": 1})
+    publisher.update({"n": 2}, force=True)
+
+    assert publish.call_count == 2
+
+
+def test_flush_writes_latest_update_once():
+    publish = Mock()
+    publisher = ProgressPublisher(publish, min_interval=60.0, clock=lambda: 0.0)
+
+    assert not publisher.flush()
+    publisher.update({"n": 1})
+    publisher.update({"n": 2})
+
+    assert publisher.flush()
+    assert not publisher.flush()
+    assert publish.call_args.args[0] == {"n": 2}
+    assert publish.call_count == 2
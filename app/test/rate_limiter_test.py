@@ -0,0 +1,33 @@
+from app.lib.rate_limiter import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_acquire_allows_burst_then_rate():
+    clock = FakeClock()
+    limiter = RateLimiter(10, burst=2, clock=clock, sleep=clock.sleep)
+
+    assert [limiter.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert limiter.acquire() == 0.1
+    assert limiter.acquire() == 0.1
+    assert clock.now == 0.2
+
+    # Tokens refill while idle, up to the burst
+    clock.now += 10
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.1]
+
+
+def test_acquire_without_rate_never_waits():
+    clock = FakeClock()
+    limiter = RateLimiter(0, clock=clock, sleep=clock.sleep)
+
+    assert [limiter.acquire() for _ in range(100)] == [0.0] * 100
@@ -0,0 +1,43 @@
+from app.lib.redis_lock import RedisLock
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_acquire_is_exclusive_until_released(fake_redis):
+    lock = RedisLock(fake_redis, "key", ttl_seconds=30)
+    other = RedisLock(fake_redis, "key", ttl_seconds=30)
+
+    assert lock.acquire() is True
+    assert other.acquire() is False
+
+    # Only the holder can release it
+    other.release()
+    assert other.acquire() is False
+    lock.release()
+    assert other.acquire() is True
+
+
+def test_wait_released_times_out(fake_redis):
+    clock = FakeClock()
+    RedisLock(fake_redis, "key", ttl_seconds=30).acquire()
+    lock = RedisLock(fake_redis, "key", ttl_seconds=30, clock=clock, sleep=clock.sleep)
+
+    assert lock.wait_released(timeout=1, poll_interval=0.25) is False
+    assert clock.now == 1
+
+
+def test_wait_released_returns_once_released(fake_redis):
+    holder = RedisLock(fake_redis, "key", ttl_seconds=30)
+    holder.acquire()
+    lock = RedisLock(fake_redis, "key", ttl_seconds=30, sleep=lambda _: holder.release())
+
+    assert lock.wait_released(timeout=1, poll_interval=0.25) is True
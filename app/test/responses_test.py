@@ -0,0 +1,90 @@
+import datetime
+import gzip
+import flask
+import pytest
+from app.lib.responses import FastJSONProvider, compress_response
+
+
+@pytest.fixture
+def app(mocker):
+    mocker.patch("app.config.RESPONSE_COMPRESSION_MIN_BYTES", 100)
+    app = flask.Flask(__name__)
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+
+    @app.route("/small")
+    def small():
+        return flask.jsonify({"ok": True})
+
+    @app.route("/large")
+    def large():
+        response = flask.jsonify({"items": [{"id": str(i)} for i in range(100)]})
+        response.set_etag("abc")
+        return response.make_conditional(flask.request)
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def value():
+    return {"b": 1, "a": [1.5, None], "c": datetime.datetime(2024, 1, 2, 3, 4, 5)}
+
+
+def assert_matches_default_provider(app, value):
+    expected = flask.json.loads(flask.json.provider.DefaultJSONProvider(app).dumps(value))
+    assert flask.json.loads(app.json.dumps(value)) == expected
+
+    with app.app_context():
+        body = app.json.response(value).get_data(as_text=True)
+    assert flask.json.loads(body) == expected
+    # Keys are sorted
+    assert body.index('"a"') < body.index('"b"')
+
+
+def test_fast_json_provider__orjson(app, value):
+    pytest.importorskip("orjson")
+    assert_matches_default_provider(app, value)
+
+
+def test_fast_json_provider__without_orjson(app, value, mocker):
+    mocker.patch("app.lib.responses.orjson", None)
+    assert_matches_default_provider(app, value)
+
+
+def test_compress_response__gzip(client):
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert len(flask.json.loads(gzip.decompress(response.get_data()))["items"]) == 100
+
+
+def test_compress_response__not_accepted_or_small(client):
+    response = client.get("/large")
+    assert "Content-Encoding" not in response.headers
+
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.json == {"ok": True}
+
+
+def test_compress_response__etag(client):
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    etag = response.headers["ETag"]
+    assert etag == '"abc-gzip"'
+
+    # The compressed representation revalidates without a body
+    response = client.get(
+        "/large", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+    # And the uncompressed one is still validated by the view
+    response = client.get("/large", headers={"If-None-Match": '"abc"'})
+    assert response.status_code == 304
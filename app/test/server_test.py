@@ -4,6 +4,7 @@ import flask
 import requests
 from app import server
 from app.lib.google_api_client import GoogleApiClient
+from app.lib.similarity_edges import SimilarityEdges
 
 
 @pytest.fixture()
@@ -11,6 +12,13 @@ def client(flask_app):
     return flask_app.test_client()
 
 
+@pytest.fixture(autouse=True)
+def clear_task_results_cache():
+    server.task_results_cache.clear()
+    yield
+    server.task_results_cache.clear()
+
+
 class TestAuthMe:
     def test_auth_me_no__session_user_id(self, client):
         response = client.get("/auth/me")
@@ -42,6 +50,62 @@ class TestAuthMe:
             assert response.json["logged_in"] is True
             assert response.json["user_info"] == user_info
 
+    def test_auth_me__caches_credentials_and_user_info(
+        self,
+        client,
+        credentials,
+        user_info,
+        mocker,
+    ):
+        get_credentials = mocker.patch(
+            "app.models.credentials_repository.CredentialsRepository.get",
+            return_value=credentials,
+        )
+        get_user_info = mocker.patch(
+            "app.lib.google_api_client.GoogleApiClient.get_user_info",
+            return_value=user_info,
+        )
+
+        with client.session_transaction() as session:
+            session["user_id"] = user_info["id"]
+
+        for _ in range(2):
+            response = client.get("/auth/me")
+            assert response.status_code == 200
+        get_credentials.assert_called_once()
+        get_user_info.assert_called_once()
+
+    def test_get_active_task_events(self, client, mocker):
+        meta = {"logMessage": "a", "itemsProcessed": 0}
+        process_duplicates = mocker.patch("app.server.tasks.process_duplicates")
+        process_duplicates.AsyncResult.return_value = Mock(status="PROGRESS", info={"meta": meta})
+
+        states = [
+            {"status": "PROGRESS", "result": {"meta": meta | {"logMessage": "b"}}},
+            None,
+            {"status": "SUCCESS", "result": {"meta": meta | {"logMessage": "b", "itemsProcessed": 5}}},
+        ]
+        pubsub = Mock()
+        pubsub.get_message.side_effect = [s and {"data": s} for s in states]
+        backend = process_duplicates.backend
+        backend.decode_result.side_effect = lambda data: data
+        backend.client.pubsub.return_value = pubsub
+
+        with client.session_transaction() as session:
+            session["active_task_id"] = "fake"
+
+        response = client.get("/api/active_task/events")
+
+        assert response.mimetype == "text/event-stream"
+        assert response.get_data(as_text=True).split("\n\n")[:-1] == [
+            'event: task\ndata: {"meta":{"itemsProcessed":0,"logMessage":"a"},"status":"PROGRESS"}',
+            'event: delta\ndata: {"meta":{"logMessage":"b"}}',
+            ": keepalive",
+            'event: delta\ndata: {"meta":{"itemsProcessed":5},"status":"SUCCESS"}',
+        ]
+        pubsub.subscribe.assert_called_once_with(backend.get_key_for_task.return_value)
+        pubsub.close.assert_called_once()
+
     def test_get_active_task_results_for_insufficient_scopes(self, client, mocker):
         # Setup a fake AsyncResult with SUCCESS status and an error payload
         fake_result = Mock()
@@ -57,6 +121,193 @@ class TestAuthMe:
         assert response.status_code == 200
         assert response.json["error"] == "insufficient_scopes"
 
+    def test_get_active_task_results_from_results_store(
+        self, client, mocker, user_id, media_item
+    ):
+        fake_result = Mock()
+        fake_result.status = "SUCCESS"
+        fake_result.info = {"results": {"taskId": "fake", "groupCount": 1}, "meta": {}}
+        mocker.patch("app.server.tasks.process_duplicates.AsyncResult", return_value=fake_result)
+
+        group = {"id": "0", "mediaItemIds": [media_item["id"]], "originalMediaItemId": media_item["id"]}
+        task_results_repo = mocker.patch("app.server.TaskResultsRepository").return_value
+        task_results_repo.groups.return_value = iter([group])
+        task_results_repo.similarity_map.return_value = {}
+        media_items_repo = mocker.patch("app.server.MediaItemsRepository").return_value
+        media_items_repo.get_id_map.return_value = {
+            media_item["id"]: media_item | {"storageFilename": "a.jpg"}
+        }
+
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+            session["active_task_id"] = "fake"
+
+        response = client.get("/api/active_task/results")
+
+        assert response.status_code == 200
+        task_results_repo.groups.assert_called_once_with("fake")
+        assert response.json["groups"] == {"0": group}
+        assert response.json["mediaItems"][media_item["id"]]["imageUrl"].endswith("a.jpg")
+
+    def test_get_active_task_results_page(self, client, mocker, user_id, media_item):
+        fake_result = Mock()
+        fake_result.status = "SUCCESS"
+        fake_result.info = {"results": {"taskId": "fake", "groupCount": 7}, "meta": {}}
+        mocker.patch("app.server.tasks.process_duplicates.AsyncResult", return_value=fake_result)
+
+        group = {"id": "3", "mediaItemIds": [media_item["id"]], "originalMediaItemId": media_item["id"]}
+        mocker.patch("app.server.TaskResultsRepository.__init__", return_value=None)
+        task_results_repo = Mock(
+            groups_page=mocker.patch(
+                "app.server.TaskResultsRepository.groups_page",
+                return_value=([group], "next"),
+            ),
+            similarity_map=mocker.patch(
+                "app.server.TaskResultsRepository.similarity_map", return_value={}
+            ),
+        )
+        media_items_repo = mocker.patch("app.server.MediaItemsRepository").return_value
+        media_items_repo.get_id_map.return_value = {
+            media_item["id"]: media_item | {"storageFilename": "a.jpg"}
+        }
+
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+            session["active_task_id"] = "fake"
+
+        response = client.get("/api/active_task/results?page_size=1&cursor=abc&sort=size")
+
+        assert response.status_code == 200
+        task_results_repo.groups_page.assert_called_once_with("fake", 1, cursor="abc", sort="size")
+        # Media items and similarities should only be looked up for the page
+        media_items_repo.get_id_map.assert_called_once_with([media_item["id"]])
+        task_results_repo.similarity_map.assert_called_once_with("fake", [media_item["id"]])
+        assert response.json["groupIds"] == ["3"]
+        assert response.json["groupCount"] == 7
+        assert response.json["nextCursor"] == "next"
+
+    def test_get_active_task_results_revalidates_cached_results(
+        self, client, mocker, user_id, media_item
+    ):
+        fake_result = Mock()
+        fake_result.status = "SUCCESS"
+        fake_result.info = {"results": {"taskId": "fake", "groupCount": 1}, "meta": {}}
+        async_result = mocker.patch(
+            "app.server.tasks.process_duplicates.AsyncResult", return_value=fake_result
+        )
+        # Versions shared with other processes
+        versions = {}
+        redis_client = Mock()
+        redis_client.get.side_effect = versions.get
+        redis_client.incr.side_effect = lambda key: versions.update(
+            {key: versions.get(key, 0) + 1}
+        )
+        mocker.patch("app.lib.redis_lock.get_client", return_value=redis_client)
+
+        group = {"id": "0", "mediaItemIds": [media_item["id"]], "originalMediaItemId": media_item["id"]}
+        task_results_repo = mocker.patch("app.server.TaskResultsRepository").return_value
+        task_results_repo.groups.side_effect = lambda task_id: iter([group])
+        task_results_repo.similarity_map.return_value = {}
+        media_items_repo = mocker.patch("app.server.MediaItemsRepository").return_value
+        media_items_repo.get_id_map.return_value = {
+            media_item["id"]: media_item | {"storageFilename": "a.jpg"}
+        }
+        media_items_repo.update.return_value = media_item | {"storageFilename": "a.jpg"}
+
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+            session["active_task_id"] = "fake"
+
+        response = client.get("/api/active_task/results")
+        etag = response.headers["ETag"]
+        assert response.status_code == 200
+        assert not etag.startswith("W/")
+
+        # Unchanged results are served from the cache, and not sent again,
+        #   without reading the task's state or results
+        response = client.get("/api/active_task/results", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert async_result.call_count == 1
+        assert task_results_repo.groups.call_count == 1
+        assert media_items_repo.get_id_map.call_count == 1
+
+        # Updating a media item invalidates the cached results
+        client.post(f"/api/media_items/{media_item['id']}", json={"deletedAt": None})
+        assert versions == {f"task_results_version:{user_id}": 1}
+        response = client.get("/api/active_task/results")
+        assert response.status_code == 200
+        assert task_results_repo.groups.call_count == 2
+
+        # So does another process bumping the version
+        redis_client.incr(f"task_results_version:{user_id}")
+        response = client.get("/api/active_task/results", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert task_results_repo.groups.call_count == 3
+
+    def test_get_active_task_results_page_of_similarity_edges(
+        self, client, mocker, user_id, media_item
+    ):
+        fake_result = Mock()
+        fake_result.status = "SUCCESS"
+        fake_result.info = {"results": {"taskId": "fake", "groupCount": 1}, "meta": {}}
+        mocker.patch("app.server.tasks.process_duplicates.AsyncResult", return_value=fake_result)
+
+        group = {"id": "0", "mediaItemIds": [media_item["id"]], "originalMediaItemId": media_item["id"]}
+        mocker.patch("app.server.TaskResultsRepository.__init__", return_value=None)
+        mocker.patch("app.server.TaskResultsRepository.groups_page", return_value=([group], None))
+        similarity_edges = mocker.patch(
+            "app.server.TaskResultsRepository.similarity_edges",
+            return_value=SimilarityEdges.from_similarity_map({}),
+        )
+        media_items_repo = mocker.patch("app.server.MediaItemsRepository").return_value
+        media_items_repo.get_id_map.return_value = {
+            media_item["id"]: media_item | {"storageFilename": "a.jpg"}
+        }
+
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+            session["active_task_id"] = "fake"
+
+        response = client.get("/api/active_task/results?page_size=1&format=edges")
+
+        assert response.status_code == 200
+        similarity_edges.assert_called_once_with("fake", [media_item["id"]])
+        assert response.json["similarityEdges"]["ids"] == []
+        assert "similarityMap" not in response.json
+
+    def test_get_active_task_results_rejects_invalid_format(self, client, mocker, user_id):
+        fake_result = Mock()
+        fake_result.status = "SUCCESS"
+        fake_result.info = {"results": {"taskId": "fake", "groupCount": 7}, "meta": {}}
+        mocker.patch("app.server.tasks.process_duplicates.AsyncResult", return_value=fake_result)
+
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+            session["active_task_id"] = "fake"
+
+        response = client.get("/api/active_task/results?format=xml")
+
+        assert response.status_code == 400
+        assert response.json["error"] == "invalid_format"
+
+    def test_get_active_task_results_page_rejects_invalid_page_size(
+        self, client, mocker, user_id
+    ):
+        fake_result = Mock()
+        fake_result.status = "SUCCESS"
+        fake_result.info = {"results": {"taskId": "fake", "groupCount": 7}, "meta": {}}
+        mocker.patch("app.server.tasks.process_duplicates.AsyncResult", return_value=fake_result)
+        mocker.patch("app.server.TaskResultsRepository.__init__", return_value=None)
+
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+            session["active_task_id"] = "fake"
+
+        response = client.get("/api/active_task/results?page_size=0")
+
+        assert response.status_code == 400
+        assert response.json["error"] == "invalid_page_size"
+
     def test_get_credentials(self, client, mocker, credentials, user_id):
         mocker.patch(
         "app.models.credentials_repository.CredentialsRepository",
@@ -141,4 +392,102 @@ class TestAuthMe:
 
         res = client.get("/auth/google/callback")
         assert res.status_code == 400
-        assert res.json["error"] == "token_exchange_failed"
\ No newline at end of file
+        assert res.json["error"] == "token_exchange_failed"
+
+
+class TestReceivePhotos:
+    def test_extension_photos_upserts_batch(self, client, mocker, user_id):
+        bulk_upsert = mocker.patch(
+            "app.server.MediaItemsRepository.bulk_upsert_source_items",
+            return_value=1234,
+        )
+        mocker.patch("app.server.MediaItemsRepository.__init__", return_value=None)
+
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+
+        payload = {
+            "photos": [{"id": "id1"}, {"id": "id2"}],
+            "batch_number": 2,
+            "total_batches": 3,
+        }
+        res = client.post("/api/extension/photos", json=payload)
+
+        assert res.status_code == 200
+        assert res.json["total_stored"] == 1234
+        source_field, photos_data = bulk_upsert.call_args[0]
+        assert source_field == "extensionSource"
+        assert [p["id"] for p in photos_data] == ["id1", "id2"]
+        assert bulk_upsert.call_args[1]["resync_count"] is False
+
+    def test_picker_photos_resyncs_count_on_first_batch(self, client, mocker, user_id):
+        bulk_upsert = mocker.patch(
+            "app.server.MediaItemsRepository.bulk_upsert_source_items",
+            return_value=1,
+        )
+        mocker.patch("app.server.MediaItemsRepository.__init__", return_value=None)
+
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+
+        payload = {"photos": [{"id": "id1", "name": "a.jpg"}], "batch_number": 1}
+        res = client.post("/api/picker/photos", json=payload)
+
+        assert res.status_code == 200
+        assert bulk_upsert.call_args[0][0] == "pickerSource"
+        assert bulk_upsert.call_args[0][1][0]["filename"] == "a.jpg"
+        assert bulk_upsert.call_args[1]["resync_count"] is True
+
+
+class TestGetPackedImage:
+    def test_get_packed_image(self, client, mocker, tmp_path):
+        from app.lib import image_stores
+
+        mocker.patch("app.server.config.IMAGE_STORE_BACKEND", "pack")
+        mocker.patch("app.config.IMAGE_STORE_PATH", str(tmp_path))
+        image_stores.clear()
+        # Writes from another process
+        image_stores.PackedMediaItemsImageStore()._write_image(
+            "image1-250.jpg", b"image-bytes"
+        )
+
+        res = client.get("/api/images/image1-250.jpg")
+        assert res.status_code == 200
+        assert res.mimetype == "image/jpeg"
+        assert res.data == b"image-bytes"
+
+        res = client.get("/api/images/image1-250.jpg", headers={"Range": "bytes=0-4"})
+        assert res.status_code == 206
+        assert res.data == b"image"
+
+        res = client.get("/api/images/missing-250.jpg")
+        assert res.status_code == 404
+
+
+class TestPickerToken:
+    def test_refreshes_expiring_cached_token(
+        self, client, mocker, credentials, user_id
+    ):
+        import datetime
+
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+        mocker.patch(
+            "app.models.credentials_repository.CredentialsRepository.get",
+            return_value=credentials | {"expiry": expiry},
+        )
+        mocker.patch("app.lib.redis_lock.get_client", return_value=None)
+        save_credentials = mocker.patch.object(GoogleApiClient, "save_credentials")
+
+        def refresh(self):
+            self.credentials_obj.token = "NEW_TOKEN"
+            self.credentials_obj.expiry = expiry + datetime.timedelta(hours=1)
+
+        mocker.patch.object(GoogleApiClient, "refresh_credentials", refresh)
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+
+        for _ in range(2):
+            response = client.get("/api/picker/token")
+            assert response.json["accessToken"] == "NEW_TOKEN"
+        # The cached client's token is fresh the second time
+        save_credentials.assert_called_once()
@@ -0,0 +1,57 @@
+import json
+import numpy as np
+from app.lib.similarity_edges import SimilarityEdges
+
+
+def test_from_similarity_map():
+    similarity_map = {
+        "a": {"b": 0.99, "c": 0.995},
+        "b": {"a": 0.99},
+        "c": {"a": 0.995},
+    }
+
+    similarity_edges = SimilarityEdges.from_similarity_map(similarity_map)
+
+    # Each pair is stored once, with quantised scores
+    assert similarity_edges.to_json() == {
+        "ids": ["a", "b", "c"],
+        "i": [0, 0],
+        "j": [1, 2],
+        "scores": [9900, 9950],
+        "scoreScale": 10000,
+    }
+    assert similarity_edges.to_similarity_map() == similarity_map
+
+
+def test_from_pairs__only_keeps_media_items_in_pairs():
+    ids = ["a", "b", "c", "d", "e"]
+    pairs = (np.array([4, 1, 4]), np.array([1, 3, 1]), np.array([0.9, 0.95, 0.9]))
+
+    similarity_edges = SimilarityEdges.from_pairs(pairs, ids.__getitem__)
+
+    assert similarity_edges.ids == ["b", "d", "e"]
+    assert list(similarity_edges.id_pairs()) == [("b", "e", 0.9), ("b", "d", 0.95)]
+
+
+def test_from_json():
+    data = {"ids": ["a", "b"], "i": [0], "j": [1], "scores": [99], "scoreScale": 100}
+
+    similarity_edges = SimilarityEdges.from_json(data)
+
+    assert len(similarity_edges) == 1
+    assert list(similarity_edges.id_pairs()) == [("a", "b", 0.99)]
+
+
+def test_to_json_is_smaller_than_similarity_map():
+    # Groups of 3 similar media items, with ids as long as Google's
+    ids = [f"{i:0100d}" for i in range(3000)]
+    similarity_map = {}
+    for g in range(0, len(ids), 3):
+        for a in ids[g : g + 3]:
+            similarity_map[a] = {b: 0.9876543 for b in ids[g : g + 3] if b != a}
+
+    similarity_edges = SimilarityEdges.from_similarity_map(similarity_map)
+
+    map_size = len(json.dumps(similarity_map))
+    edges_size = len(json.dumps(similarity_edges.to_json()))
+    assert edges_size * 2 < map_size
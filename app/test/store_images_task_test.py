@@ -1,6 +1,9 @@
+import os
 import pytest
 from unittest.mock import Mock
 
+from app.lib import image_stores
+from app.lib.media_items_image_store import ImageStore
 from app.lib.store_images_task import StoreImagesTask
 
 
@@ -19,17 +22,18 @@ def test_store_images_fetches_missing_items(mocker, media_item):
     gp_client.get_media_items_by_ids.return_value = {media_id: media_item}
 
     # Prevent actual downloading of images
-    img_store_cls = mocker.patch("app.lib.store_images_task.MediaItemsImageStore")
+    img_store_cls = mocker.patch("app.lib.store_images_task.create_image_store")
     img_store = img_store_cls.return_value
     img_store.store_image.return_value = "filename.jpg"
 
     task = StoreImagesTask(user_id, [media_id], resolution=100, logger=Mock())
     task.run()
 
-    # Ensure create_or_update was called with the fetched media_item
-    assert repo_instance.create_or_update.called
-    # Ensure update was called to set storageFilename
-    assert repo_instance.update.called
+    # Ensure the fetched media_item was written
+    written = list(repo_instance.bulk_create_or_update.call_args[0][0])
+    assert [m["id"] for m in written] == [media_id]
+    # Ensure bulk_update was called to set storageFilename
+    assert repo_instance.bulk_update.called
 
 
 def test_store_images_respects_custom_path_and_original_flag(mocker, tmp_path, media_item):
@@ -42,9 +46,10 @@ def test_store_images_respects_custom_path_and_original_flag(mocker, tmp_path, m
     repo_instance.get_id_map.return_value = {media_id: media_item}
 
     # Prevent actual downloading of images
-    img_store_cls = mocker.patch("app.lib.store_images_task.MediaItemsImageStore")
+    img_store_cls = mocker.patch("app.lib.store_images_task.create_image_store")
     img_store = img_store_cls.return_value
     img_store.store_image.return_value = f"{media_id}-original.jpg"
+    img_store.image_size.return_value = 1234
 
     custom_path = str(tmp_path / "images")
 
@@ -59,8 +64,77 @@ def test_store_images_respects_custom_path_and_original_flag(mocker, tmp_path, m
 
     task.run()
 
-    # repo.update should be called with storageFilename that indicates original
-    repo_instance.update.assert_called()
-    args = repo_instance.update.call_args[0]
-    assert "storageFilename" in args[1]
-    assert args[1]["storageFilename"].endswith("-original.jpg")
\ No newline at end of file
+    # repo.bulk_update should be called with storageFilename that indicates original
+    repo_instance.bulk_update.assert_called_once()
+    [(id, attributes)] = repo_instance.bulk_update.call_args[0][0]
+    assert id == media_id
+    assert attributes["storageFilename"].endswith("-original.jpg")
+    # Stored originals count towards reclaimable bytes
+    assert attributes["size"] == 1234
+
+
+def test_store_images_deletes_failed_items(mocker, media_item):
+    """Media items whose image can't be stored should be deleted in one call."""
+    media_ids = ["image1", "image2"]
+
+    repo_cls = mocker.patch("app.lib.store_images_task.MediaItemsRepository")
+    repo_instance = repo_cls.return_value
+    repo_instance.get_id_map.return_value = {
+        id: media_item | {"id": id} for id in media_ids
+    }
+
+    img_store_cls = mocker.patch("app.lib.store_images_task.create_image_store")
+    img_store = img_store_cls.return_value
+    img_store.store_image.side_effect = ["image1-100.jpg", Exception("403")]
+    img_store.image_size.return_value = 1234
+
+    status = StoreImagesTask("user-1", media_ids, resolution=100, logger=Mock()).run()
+
+    assert status == {"stored": 1, "failed": 1}
+
+    # Stored images are thumbnails, not the originals whose sizes count
+    repo_instance.bulk_update.assert_called_once_with(
+        [("image1", {"storageFilename": "image1-100.jpg"})]
+    )
+    repo_instance.delete.assert_called_once_with(["image2"])
+
+
+def test_store_images_refreshes_expired_base_urls(mocker, media_item):
+    """Expired baseUrls should be refreshed in bulk before downloading images."""
+    repo_cls = mocker.patch("app.lib.store_images_task.MediaItemsRepository")
+    repo_cls.return_value.get_id_map.return_value = {media_item["id"]: media_item}
+    img_store = mocker.patch("app.lib.store_images_task.create_image_store").return_value
+    img_store.missing.return_value = [media_item]
+    img_store.store_image.return_value = "filename.jpg"
+    refresh = mocker.patch("app.lib.google_photos_client.refresh_expired_base_urls")
+    logger = Mock()
+
+    StoreImagesTask("user-1", [media_item["id"]], logger=logger).run()
+
+    # Before downloading any image
+    refresh.assert_called_once_with("user-1", [media_item], logger)
+    img_store.store_image.assert_called_once_with(media_item)
+
+
+def test_store_images_lists_image_directory_once(mocker, tmp_path, media_item):
+    """Runs in the same process should share the index of stored images."""
+    image_stores.clear()
+    media_ids = ["image1", "image2"]
+    repo_cls = mocker.patch("app.lib.store_images_task.MediaItemsRepository")
+    repo_cls.return_value.get_id_map.return_value = {
+        id: media_item | {"id": id} for id in media_ids
+    }
+    mocker.patch("app.lib.google_photos_client.refresh_expired_base_urls")
+    download = mocker.patch.object(ImageStore, "_download_image", return_value=b"image")
+    scandir = mocker.spy(os, "scandir")
+
+    for media_id in media_ids:
+        StoreImagesTask(
+            "user-1", [media_id], resolution=100, image_store_path=str(tmp_path), logger=Mock()
+        ).run()
+    StoreImagesTask(
+        "user-1", media_ids, resolution=100, image_store_path=str(tmp_path), logger=Mock()
+    ).run()
+
+    assert scandir.call_count == 1
+    assert download.call_count == 2
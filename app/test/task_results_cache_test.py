@@ -0,0 +1,52 @@
+from unittest.mock import Mock
+from app.lib.task_results_cache import TaskResultsCache
+
+
+def test_get_returns_cached_body_and_etag():
+    cache = TaskResultsCache(max_entries=2)
+    etag = cache.set("user-1", "key", b'{"groups": {}}')
+
+    assert cache.get("user-1", "key") == (b'{"groups": {}}', etag)
+    assert cache.get("user-2", "key") is None
+    # Strong ETags only depend on the body
+    assert TaskResultsCache(max_entries=1).set("user-2", "other", b'{"groups": {}}') == etag
+    assert cache.set("user-1", "key", b'{"groups": {"0": {}}}') != etag
+
+
+def test_set_evicts_least_recently_used():
+    cache = TaskResultsCache(max_entries=2)
+    cache.set("user-1", "a", b"a")
+    cache.set("user-1", "b", b"b")
+    cache.get("user-1", "a")
+    cache.set("user-1", "c", b"c")
+
+    assert cache.get("user-1", "a") is not None
+    assert cache.get("user-1", "b") is None
+    assert cache.get("user-1", "c") is not None
+
+
+def test_invalidate_only_drops_the_users_entries():
+    cache = TaskResultsCache(max_entries=4)
+    cache.set("user-1", "a", b"a")
+    cache.set("user-1", "b", b"b")
+    cache.set("user-2", "a", b"a")
+
+    cache.invalidate("user-1")
+
+    assert cache.get("user-1", "a") is None
+    assert cache.get("user-1", "b") is None
+    assert cache.get("user-2", "a") is not None
+
+
+def test_invalidate_bumps_shared_version(mocker):
+    """Other processes should see invalidations through the version in Redis."""
+    redis_client = Mock()
+    mocker.patch("app.lib.redis_lock.get_client", return_value=redis_client)
+    cache = TaskResultsCache(max_entries=4)
+
+    cache.invalidate("user-1")
+
+    redis_client.incr.assert_called_once_with("task_results_version:user-1")
+    redis_client.get.return_value = b"1"
+    assert cache.version("user-1") == b"1"
+    redis_client.get.assert_called_once_with("task_results_version:user-1")
@@ -0,0 +1,140 @@
+import pytest
+import pymongo
+import app.config
+from app.lib.similarity_edges import SimilarityEdges
+from app.models.task_results_repository import TaskResultsRepository
+
+# These tests require a real mongo database connection
+# Run `docker-compose up mongo` and
+#   `TEST_DB=1 pytest app/test/task_results_repository_test.py`
+#   in separate terminals
+requires_mongodb = pytest.mark.skipif("os.environ.get('TEST_DB') is None")
+
+
+@pytest.fixture
+def db():
+    db = pymongo.MongoClient(app.config.MONGODB_URI)[app.config.DATABASE]
+    yield db
+    for collection_name in ("task_results", "task_result_groups", "task_result_edges"):
+        db[collection_name].drop()
+
+
+@pytest.fixture
+def repo(user_id):
+    return TaskResultsRepository(user_id)
+
+
+@pytest.fixture
+def results():
+    return {
+        "groups": [
+            {"id": "0", "mediaItemIds": ["a", "b", "c"], "originalMediaItemId": "a"},
+            {
+                "id": "1",
+                "mediaItemIds": ["d", "e"],
+                "originalMediaItemId": "e",
+                "reclaimableBytes": 1000,
+            },
+            {"id": "2", "mediaItemIds": ["f", "g"], "originalMediaItemId": "f"},
+        ],
+        "similarityMap": {
+            "a": {"b": 0.99, "c": 0.995},
+            "b": {"a": 0.99},
+            "c": {"a": 0.995},
+            "d": {"e": 1.0},
+            "e": {"d": 1.0},
+        },
+    }
+
+
+def test_init__requires_user_id():
+    with pytest.raises(ValueError):
+        TaskResultsRepository(None)
+
+
+@requires_mongodb
+def test_save(db, repo, results):
+    """Should store groups and each pair once, returning a pointer"""
+    pointer = repo.save("task-1", results)
+
+    assert pointer == {"taskId": "task-1", "groupCount": 3}
+    assert repo.get("task-1")["edgeCount"] == 3
+    groups = list(repo.groups("task-1"))
+    assert [g["id"] for g in groups] == ["0", "1", "2"]
+    assert groups[0]["mediaItemIds"] == ["a", "b", "c"]
+    assert repo.similarity_map("task-1") == results["similarityMap"]
+
+
+@requires_mongodb
+def test_similarity_map__media_item_ids(db, repo, results):
+    """Should only include pairs between the given media items"""
+    repo.save("task-1", results)
+
+    assert repo.similarity_map("task-1", ["d", "e", "a"]) == {
+        "d": {"e": 1.0},
+        "e": {"d": 1.0},
+    }
+
+
+@requires_mongodb
+def test_similarity_edges(db, repo, results):
+    """Should return each pair once, in the compact form"""
+    repo.save("task-1", results)
+
+    similarity_edges = repo.similarity_edges("task-1", ["d", "e", "a"])
+
+    assert similarity_edges.to_json() == {
+        "ids": ["d", "e"],
+        "i": [0],
+        "j": [1],
+        "scores": [10000],
+        "scoreScale": 10000,
+    }
+    assert repo.similarity_edges("task-1").to_similarity_map() == results["similarityMap"]
+
+
+@requires_mongodb
+def test_save__similarity_edges(db, repo, results):
+    """Should store results with compact similarity edges"""
+    similarity_edges = SimilarityEdges.from_similarity_map(results.pop("similarityMap"))
+    repo.save("task-1", results | {"similarityEdges": similarity_edges.to_json()})
+
+    assert repo.get("task-1")["edgeCount"] == 3
+    assert repo.similarity_map("task-1", ["d", "e"]) == {"d": {"e": 1.0}, "e": {"d": 1.0}}
+
+
+@requires_mongodb
+def test_save__replaces(db, repo, user_id, results):
+    """Saving again should replace results, and be separate per user"""
+    repo.save("task-1", results)
+    TaskResultsRepository("other-user-id").save("task-1", results)
+
+    repo.save("task-1", {"groups": [], "similarityMap": {}})
+
+    assert list(repo.groups("task-1")) == []
+    assert db.task_result_groups.count_documents({"userId": "other-user-id"}) == 3
+
+
+@requires_mongodb
+@pytest.mark.parametrize(
+    "sort,expected_ids",
+    [
+        ("position", ["0", "1", "2"]),
+        ("size", ["0", "1", "2"]),
+        ("reclaimable_bytes", ["1", "0", "2"]),
+    ],
+)
+def test_groups_page(db, repo, results, sort, expected_ids):
+    """Should page through every group in sort order"""
+    repo.save("task-1", results)
+
+    page1, cursor = repo.groups_page("task-1", 2, sort=sort)
+    page2, last_cursor = repo.groups_page("task-1", 2, cursor=cursor, sort=sort)
+
+    assert [g["id"] for g in page1 + page2] == expected_ids
+    assert last_cursor is None
+
+
+def test_groups_page__invalid_cursor(repo):
+    with pytest.raises(ValueError):
+        repo.groups_page("task-1", 2, cursor="not a cursor")
@@ -1,7 +1,10 @@
 import pytest
+import requests
 import app.tasks
 import app.config
 from unittest.mock import Mock
+from app.lib.google_api_client import InsufficientScopesError
+from app.lib.process_duplicates_task import DailyLimitExceededError
 
 
 @pytest.mark.skip(
@@ -37,17 +40,110 @@ def test_process_duplicates(
         calculate_similarity_map=Mock(return_value={}),
     )
 
+    save = mocker.patch("app.tasks.TaskResultsRepository").return_value.save
+    save.return_value = {"taskId": "task-id", "groupCount": 1}
+
     async_result = app.tasks.process_duplicates.delay(
         user_info["id"],
         refresh_media_items=True,
     )
     result = async_result.get()
 
-    assert "groups" in result["results"]
-    assert len(result["results"]["groups"]) == 1
-    assert "mediaItemIds" in result["results"]["groups"][0]
-    assert len(result["results"]["groups"][0]["mediaItemIds"]) == 1
-    assert result["results"]["groups"][0]["mediaItemIds"][0] == media_item["id"]
+    # Results are stored separately, the task result only points to them
+    assert result["results"] == save.return_value
+    results = save.call_args[0][1]
+    assert len(results["groups"]) == 1
+    assert "mediaItemIds" in results["groups"][0]
+    assert len(results["groups"][0]["mediaItemIds"]) == 1
+    assert results["groups"][0]["mediaItemIds"][0] == media_item["id"]
+
+    assert results["similarityEdges"]["ids"] == []
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (InsufficientScopesError("scopes"), "insufficient_scopes"),
+        (requests.exceptions.HTTPError("429 Client Error: Too Many Requests"), "daily_limit_exceeded"),
+        (DailyLimitExceededError("quota"), "daily_limit_exceeded"),
+        (ValueError("no credentials"), "failed"),
+    ],
+)
+def test_store_images_returns_error_status(mocker, error, expected):
+    store_images_task = mocker.patch("app.tasks.StoreImagesTask").return_value
+    store_images_task.run.side_effect = error
+
+    status = app.tasks.store_images("user-1", ["id1"])
+
+    assert status == {"error": expected, "message": str(error)}
+
+
+def test_detect_duplicates_continues_process_duplicates(mocker):
+    task_cls = mocker.patch("app.tasks.ProcessDuplicatesTask")
+    task_instance = task_cls.return_value
+    task_instance.detect_duplicates_after_subtasks.return_value = {"groups": []}
+    task_instance.get_meta.return_value = {"logMessage": "done"}
+    save = mocker.patch("app.tasks.TaskResultsRepository").return_value.save
+    statuses = [{"stored": 1, "failed": 0}]
+
+    result = app.tasks.detect_duplicates.apply(
+        (statuses, "user-1"), {"meta": {"logMessage": "fetched"}}, task_id="task-id"
+    ).get()
+
+    # Meta carries on from process_duplicates, and results are saved under
+    #   its task id
+    assert task_cls.call_args.args[1] == "user-1"
+    assert task_instance.meta == {"logMessage": "fetched"}
+    task_instance.detect_duplicates_after_subtasks.assert_called_once_with(
+        statuses, "store_images"
+    )
+    save.assert_called_once_with("task-id", {"groups": []})
+    assert result == {"results": save.return_value, "meta": {"logMessage": "done"}}
+
+
+def test_detect_duplicates_logs_mongo_pool_metrics(mocker):
+    task_cls = mocker.patch("app.tasks.ProcessDuplicatesTask")
+    task_cls.return_value.detect_duplicates_after_subtasks.return_value = {"groups": []}
+    mocker.patch("app.tasks.TaskResultsRepository")
+    mocker.patch("app.tasks.mongo_client.metrics", return_value={"checkedOut": 3})
+    info = mocker.patch("app.tasks.logging.info")
+
+    app.tasks.detect_duplicates.apply(([], "user-1"), task_id="task-id").get()
+
+    info.assert_any_call("MongoDB connection pool: {'checkedOut': 3}")
+
+
+@pytest.mark.parametrize(
+    "task, queue",
+    [
+        (app.tasks.store_images, "io"),
+        (app.tasks.download_chunk, "io"),
+        (app.tasks.process_duplicates, "cpu"),
+        (app.tasks.embed_chunk, "cpu"),
+        (app.tasks.compare_chunks, "cpu"),
+        (app.tasks.detect_duplicates, "cpu"),
+    ],
+)
+def test_task_routes(task, queue):
+    route = task.app.amqp.router.route({}, task.name)
+    assert route["queue"].name == queue
+
+
+def test_embed_chunk_skips_failed_download(mocker):
+    task_cls = mocker.patch("app.tasks.ProcessDuplicatesTask")
+    download_status = {"error": "daily_limit_exceeded", "message": "quota"}
+
+    status = app.tasks.embed_chunk(download_status, "user-1", 0, ["id1"], 1)
+
+    assert status == download_status
+    task_cls.assert_not_called()
+
+
+def test_compare_chunks_flushes_meta_when_failing(mocker):
+    task_instance = mocker.patch("app.tasks.ProcessDuplicatesTask").return_value
+    task_instance.compare_chunks.side_effect = ValueError("corrupt checkpoint")
+
+    status = app.tasks.compare_chunks("user-1", 0, 1, "key")
 
-    assert "similarityMap" in result["results"]
-    assert result["results"]["similarityMap"] == {}
+    assert status == {"error": "failed", "message": "corrupt checkpoint"}
+    task_instance.flush_meta.assert_called_once_with()
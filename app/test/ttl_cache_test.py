@@ -0,0 +1,47 @@
+from app.lib.ttl_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_expires_entries_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(2, ttl_seconds=10, clock=clock)
+    cache.set("a", 1)
+
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+
+
+def test_set_evicts_least_recently_used():
+    cache = TTLCache(2, ttl_seconds=10, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Using "a" makes "b" the least recently used
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_invalidate_and_clear():
+    cache = TTLCache(2, ttl_seconds=10, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+    cache.clear()
+    assert cache.get("b") is None
@@ -19,6 +19,7 @@ import { useFetch } from "utils/useFetch";
 import { appApiUrl, fetchAppJson } from "utils";
 import { MeResponseType } from "utils/types";
 import { AppContext, AppContextType, ActiveTaskType } from "utils/AppContext";
+import { useActiveTaskEvents } from "utils/useActiveTaskEvents";
 import DeduperAppBar from "components/DeduperAppBar";
 import Box from "@mui/material/Box";
 import TaskResultsPage from "components/pages/TaskResultsPage";
@@ -43,6 +44,11 @@ export default function App() {
     reloadActiveTask();
   }, []);
 
+  const isActiveTaskRunning = activeTask?.status
+    ? ["SENT", "PROGRESS"].includes(activeTask.status)
+    : false;
+  useActiveTaskEvents(isActiveTaskRunning, setActiveTask);
+
   if (meIsLoading) {
     return null;
   }
@@ -48,8 +48,10 @@ export default function ActiveTaskPage() {
   const showViewResultsButton = activeTask?.status === "SUCCESS";
   const navigate = useNavigate();
 
+  // Wait for a new task to appear. Once it's running, its progress is pushed
+  //   (see useActiveTaskEvents)
   useInterval(async () => {
-    if (!activeTask || isRunning) {
+    if (!activeTask) {
       reloadActiveTask();
     }
   }, 1000);
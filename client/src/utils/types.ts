@@ -54,6 +54,25 @@ export interface TaskResultsType {
   };
 }
 
+// A page of results, from /api/active_task/results?page_size=...
+export interface TaskResultsPageType extends TaskResultsType {
+  groupIds: string[];
+  groupCount: number;
+  nextCursor: string | null;
+}
+
+export type TaskResultsSortType = "position" | "size" | "reclaimable_bytes";
+
+// Compact form of similarityMap, from /api/active_task/results?format=edges.
+//   The similarity of ids[i[k]] and ids[j[k]] is scores[k] / scoreScale
+export interface SimilarityEdgesType {
+  ids: string[];
+  i: number[];
+  j: number[];
+  scores: number[];
+  scoreScale: number;
+}
+
 export interface TaskResultsGroupType {
   id: string;
   mediaItemIds: string[];
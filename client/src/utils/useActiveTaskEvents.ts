@@ -0,0 +1,39 @@
+import { Dispatch, SetStateAction, useEffect } from "react";
+import { appApiUrl } from "utils";
+import { ActiveTaskType } from "utils/AppContext";
+
+// Follow the active task's progress as it's pushed by
+//   /api/active_task/events, instead of polling /api/active_task
+export function useActiveTaskEvents(
+  enabled: boolean,
+  setActiveTask: Dispatch<SetStateAction<ActiveTaskType | undefined>>
+) {
+  useEffect(() => {
+    if (!enabled) {
+      return;
+    }
+
+    // Reconnects by itself if the stream ends before the task is done
+    const eventSource = new EventSource(appApiUrl("/api/active_task/events"));
+
+    eventSource.addEventListener("task", (event) => {
+      const task = JSON.parse((event as MessageEvent).data);
+      setActiveTask(task.error ? undefined : task);
+    });
+
+    eventSource.addEventListener("delta", (event) => {
+      const delta = JSON.parse((event as MessageEvent).data);
+      setActiveTask((activeTask) =>
+        activeTask
+          ? {
+              ...activeTask,
+              ...delta,
+              meta: { ...activeTask.meta, ...delta.meta },
+            }
+          : activeTask
+      );
+    });
+
+    return () => eventSource.close();
+  }, [enabled, setActiveTask]);
+}